@@ -1,7 +1,6 @@
-import random
+from control import ActionType
 from scoring import ExpectedScore
 from pieces import Card
-from control import ActionType
 
 
 class PlayerAgent:
@@ -13,6 +12,13 @@ class PlayerAgent:
         raise NotImplementedError('Cannot use base PlayerAgent as agent: implement "bid()" in derived class.')
     def steal(self, game_view):
         raise NotImplementedError('Cannot use base PlayerAgent as agent: implement "steal()" in derived class.')
+    # Batched decisions over many games, used by the batch scheduler; override to evaluate the states together.
+    def act_batch(self, game_views):
+        return [self.act(v) for v in game_views]
+    def bid_batch(self, bid_args):
+        return [self.bid(*args) for args in bid_args]
+    def steal_batch(self, game_views):
+        return [self.steal(v) for v in game_views]
     def __str__(self):
         return self._name
     @property
@@ -21,40 +27,58 @@ class PlayerAgent:
 
 
 class TrivialPlayerAgent(PlayerAgent):
+    BID_PROBS = (0.05, 0.15, 0.30, 0.50, 0.65, 0.75, 0.85, 0.95)  # Probability to bid by number of auctioned cards.
+
+    def __init__(self, name, bid_probs=BID_PROBS):
+        super().__init__(name)
+        if len(bid_probs) != len(TrivialPlayerAgent.BID_PROBS):
+            raise Exception('Bid probabilities needed for 0 to {} auctioned cards.'.format(len(TrivialPlayerAgent.BID_PROBS) - 1))
+        self._bid_probs = tuple(bid_probs)
     def act(self, game_view):
         return ActionType.Draw  # FIXME
     def bid(self, game_view, auction_view, player_view, is_mandated):
-        bid_probs = {0: 0.05, 1: 0.15, 2: 0.30, 3: 0.50, 4: 0.65, 5: 0.75, 6: 0.85, 7: 0.95}
-        prob = bid_probs[len(auction_view.auctioned_cards)]
-        willing_to_bid = random.random() < prob
+        prob = self._bid_probs[len(auction_view.auctioned_cards)]
+        willing_to_bid = game_view.random.random() < prob or is_mandated
         if willing_to_bid:
             # always bid the lowest cheque that exceeds current highest bid
-            cheques = player_view.available_cheques()
             top = auction_view.highest_bid
             if top:
-                exceeding_cheques = [c for c in cheques if c > top]
-                return min(exceeding_cheques)
+                return player_view.lowest_cheque_above(top)
             else:
-                return min(cheques)
+                return player_view.lowest_cheque
+    def steal(self, game_view):
+        board_counts = game_view.get_board_view().card_counts()
+        return [next(c for c in Card if board_counts[c])]  # any single card
 
 class StealingPlayerAgent(TrivialPlayerAgent):
     VALUABLE_THRESHOLD = 4.0  # Threshold (points per card) that counts as valuable in the face of a thief.
 
-    def _remaining_board_value(self):
-        pass  # FIXME
+    def __init__(self, name, bid_probs=TrivialPlayerAgent.BID_PROBS, valuable_threshold=VALUABLE_THRESHOLD):
+        super().__init__(name, bid_probs)
+        self._valuable_threshold = valuable_threshold
+
+    def _remaining_board_value(self, game_view, player_view, min_oppo_bodyguards, max_oppo_bodyguards):
+        # Expected marginal points of the booty still to be drawn before the next auction.
+        _, booty_mix = game_view.get_deck_view().expected_booty()
+        values = ExpectedScore.marginal_card_scores(
+            player_view.card_counts(),
+            list(booty_mix),
+            min_oppo_bodyguards,
+            max_oppo_bodyguards,
+            game_view.rounds_remaining)
+        return sum(n * values[c] for c, n in booty_mix.items())
     def _identify_valuable_cards(self, player_view, board_view, min_oppo_bodyguards, max_oppo_bodyguards, num_rounds_remaining):
         # TODO: should consider possibility that two cards are stolen at once.
         player_card_counts = player_view.card_counts()
         board_card_counts = board_view.card_counts()
-        def marginal_score(stolen_card):
-            return ExpectedScore.marginal_card_score(
-                player_card_counts,
-                {c: 1 if c == stolen_card else 0 for c in Card},
-                min_oppo_bodyguards,
-                max_oppo_bodyguards,
-                num_rounds_remaining)
-        valuables = {c: marginal_score(c) if board_card_counts[c] >= 1 else None for c in Card if c != Card.Policeman}
-        return {k: v for k, v in valuables.items() if v and v >= StealingPlayerAgent.VALUABLE_THRESHOLD}
+        stealable_cards = [c for c in Card if c != Card.Policeman and board_card_counts[c] >= 1]
+        valuables = ExpectedScore.marginal_card_scores(
+            player_card_counts,
+            stealable_cards,
+            min_oppo_bodyguards,
+            max_oppo_bodyguards,
+            num_rounds_remaining)
+        return {k: v for k, v in valuables.items() if v and v >= self._valuable_threshold}
 
     def _theft_plan(self, game_view):
         # TODO: allow stealing more than one card (that is, using more than one thief at once.
@@ -62,7 +86,7 @@ class StealingPlayerAgent(TrivialPlayerAgent):
         all_player_views = game_view.get_all_player_views()
         board_view = game_view.get_board_view()
         if player_view.num_available_thieves() == 0:
-            return False, None, None
+            return False, None, False, None
         opponent_bg_counts = [p.card_counts()[Card.Bodyguard] for p in all_player_views]
         opponent_bg_counts.remove(player_view.card_counts()[Card.Bodyguard])  # remove first occurrence
         valuable_cards_available = self._identify_valuable_cards(
@@ -71,15 +95,19 @@ class StealingPlayerAgent(TrivialPlayerAgent):
             min(opponent_bg_counts),
             max(opponent_bg_counts),
             game_view.rounds_remaining)
-        #remaining_board_value_low =  # TODO: should consider possibility there is only one valuable, even when being last player.
+        # A single valuable card is worth stealing, even by the last player, when the rest of the booty is worth less.
+        remaining_board_value_low = bool(valuable_cards_available) and self._remaining_board_value(
+            game_view,
+            player_view,
+            min(opponent_bg_counts),
+            max(opponent_bg_counts)) < max(valuable_cards_available.values())
         outbid_candidates = [p.highest_cheque for p in all_player_views if p.highest_cheque]
         opponents_can_outbid = outbid_candidates and max(outbid_candidates) > player_view.highest_cheque
-        return True, valuable_cards_available, opponents_can_outbid
+        return True, valuable_cards_available, remaining_board_value_low, opponents_can_outbid
 
     def _is_theft_suggested(self, game_view):
-        has_thief, valuable_cards_available, opponents_can_outbid = self._theft_plan(game_view)
-        theft_suggested = has_thief and valuable_cards_available and opponents_can_outbid
-        # TODO: theft_suggested = valuable_cards_available and (remaining_board_value_low or opponents_can_outbid)
+        has_thief, valuable_cards_available, remaining_board_value_low, opponents_can_outbid = self._theft_plan(game_view)
+        theft_suggested = has_thief and valuable_cards_available and (remaining_board_value_low or opponents_can_outbid)
         return theft_suggested
 
     def act(self, game_view):
@@ -90,7 +118,7 @@ class StealingPlayerAgent(TrivialPlayerAgent):
 
     def steal(self, game_view):
         # TODO: enable stealing more than one card at once.
-        _, valuable_cards_available, _ = self._theft_plan(game_view)
+        _, valuable_cards_available, _, _ = self._theft_plan(game_view)
         v = valuable_cards_available
         most_valuable_card = max(v, key=v.get)
         return [most_valuable_card]  # list of all cards to steal (need to have enough Thief cards)
@@ -1,24 +1,83 @@
-from pieces import Card
+import functools
+import math
+
+from pieces import Card, mask_cheques, mask_highest_cheque, mask_lowest_cheque, mask_lowest_cheque_above
+
+
+class GameSnapshot:
+    """Public game state frozen at one decision point, shared read-only by all views built on it."""
+    def __init__(self, game, players, board):
+        self.player_views = tuple(PlayerView(p) for p in players)
+        self.views_by_player = {view._player: view for view in self.player_views}
+        self.board_view = BoardView(board)
+        self.rounds_remaining = game.rounds_remaining
+        self.deck_size = game.deck_size
+        self._game = game
+        self._deck_view = None
+    @property
+    def deck_view(self):
+        # Built on demand, or by "freeze" when the game drops the snapshot, before its state changes.
+        if self._deck_view is None:
+            self._deck_view = self._game._deck_view()
+        return self._deck_view
+    def freeze(self):
+        self.deck_view
+        self._game = None
+
 
 class GameView:
-    def __init__(self, game, active_player, all_players, board):
+    """View of one decision point; the shared snapshot is only built if the agent looks at the state.
+
+    The view binds the snapshot on first access, and keeps showing it after the game moves on. A view
+    first read after the state has changed raises, instead of showing a later decision point.
+    """
+    def __init__(self, game, active_player):
         self._game_state = game
         self._active_player = active_player
-        self._all_players = all_players
-        self._board = board
-        from agent import PlayerAgent
-        if isinstance(active_player, PlayerAgent):
-            raise Exception('wrong type of arg: got PlayerAgent instead of player')
+        self._state_version = game._state_version
+        self._snapshot = None
 
+    def _state(self):
+        if self._snapshot is None:
+            if self._game_state._state_version != self._state_version:
+                raise Exception('The game has moved on since this view was built.')
+            self._snapshot = self._game_state.snapshot()
+        return self._snapshot
     def get_active_player_view(self):
-        return PlayerView(self._active_player)
+        return self._state().views_by_player[self._active_player]
     def get_all_player_views(self):
-        return [PlayerView(p) for p in self._all_players]
+        return list(self._state().player_views)
     def get_board_view(self):
-        return BoardView(self._board)
+        return self._state().board_view
     @property
     def rounds_remaining(self):
-        return self._game_state.rounds_remaining
+        return self._state().rounds_remaining
+    @property
+    def deck_size(self):
+        return self._state().deck_size
+    def get_deck_view(self):
+        return self._state().deck_view
+    def get_auction_view(self):
+        """View of the auction in progress, or None."""
+        return self._game_state._auction_view
+    @property
+    def seat(self):
+        return self._game_state._seats[self._active_player]
+    def sample_game(self, player_agents, rng):
+        """Determinized copy of the game for search: the unseen deck order is resampled with "rng"."""
+        return self._game_state.clone(player_agents, rng, redeterminize=True)
+    def fork(self):
+        """The same decision point on a private copy of the game, with its own copies of the random streams.
+
+        Copying the state of "random" back from the fork makes the decision count as taken on this view.
+        """
+        game = self._game_state
+        clone = game.clone(rng=game._rng.fork())
+        return GameView(clone, clone._players[game._seats[self._active_player]])
+    @property
+    def random(self):
+        """Random stream reserved for the decisions of the active player."""
+        return self._game_state.agent_random(self._active_player)
 
 class AuctionView:
     def __init__(self, auction):
@@ -32,26 +91,104 @@ class AuctionView:
 
 class PlayerView:
     def __init__(self, player):
-        self._player = player
-        from agent import PlayerAgent
-        if isinstance(player, PlayerAgent):
-            raise Exception('wrong type of arg: got PlayerAgent instead of player')
+        self._player = player  # private: agents must not reach the mutable player state
+        self._card_counts = player.frozen_card_counts()
+        self._cheque_mask = player.available_cheque_mask
+        self._available_cheques = None
     def available_cheques(self):
-        return self._player.available_cheques()  # copy
+        if self._available_cheques is None:
+            self._available_cheques = tuple(mask_cheques(self._cheque_mask))
+        return list(self._available_cheques)
     def num_available_thieves(self):
-        return self._player.num_cards(Card.Thief)
+        return self._card_counts[Card.Thief]
     @property
     def highest_cheque(self):
-        return self._player.highest_cheque
+        return mask_highest_cheque(self._cheque_mask)
+    @property
+    def lowest_cheque(self):
+        return mask_lowest_cheque(self._cheque_mask)
+    def lowest_cheque_above(self, cheque):
+        return mask_lowest_cheque_above(self._cheque_mask, cheque)
+    @property
+    def cheque_mask(self):
+        return self._cheque_mask
     def card_counts(self):
-        return self._player.card_counts()  # copy
-    def is_same_player(self, player):
-        return player == self._player
+        return self._card_counts  # immutable, shared
+    def is_same_player(self, player_view):
+        return player_view._player is self._player
 
 class BoardView:
     def __init__(self, board):
-        self._board = board
+        self._card_counts = board.frozen_card_counts()
+        self._num_policemen = board.num_policemen
+        self._cheque = board.cheque
     def card_counts(self):
-        return self._board.get_card_counts()  # copy
+        return self._card_counts  # immutable, shared
+    @property
+    def num_policemen(self):
+        return self._num_policemen
+    @property
+    def cheque(self):
+        return self._cheque
+
+
+PROBABILITY_TABLE_CACHE_SIZE = 2**10  # Tables by deck state: far more than one game reaches.
+
 
+@functools.lru_cache(maxsize=PROBABILITY_TABLE_CACHE_SIZE)
+def _round_end_table(num_cards, num_policemen, num_needed):
+    # Entry k: probability that the next k draws hold at least "num_needed" policemen (hypergeometric tail).
+    # The m-th policeman is drawn at t with probability C(t-1, m-1) * C(N-t, K-m) / C(N, K).
+    m, total = num_needed, math.comb(num_cards, num_policemen)
+    table, cumulative = [0.0], 0
+    for t in range(1, num_cards + 1):
+        if m <= num_policemen:
+            cumulative += math.comb(t - 1, m - 1) * math.comb(num_cards - t, num_policemen - m)
+        table.append(cumulative / total)
+    return tuple(table)
+
+@functools.lru_cache(maxsize=PROBABILITY_TABLE_CACHE_SIZE)
+def _booty_table(num_cards, num_policemen):
+    # Entry c: expected number of cards drawn before the next policeman, when at most "c" are drawn.
+    # The first j draws hold no policeman with probability C(N-j, K) / C(N, K).
+    total = math.comb(num_cards, num_policemen)
+    table, expected = [0.0], 0.0
+    for j in range(1, num_cards - num_policemen + 1):
+        expected += math.comb(num_cards - j, num_policemen) / total
+        table.append(expected)
+    return tuple(table)
+
+class DeckView:
+    """Odds of the next draws, from the public contents of the deck: every draw is seen by all players.
+
+    The probability tables depend only on the numbers of cards and policemen left, so they are computed
+    once per deck state and shared by all games; each query is a lookup.
+    """
+    def __init__(self, deck, board, round_end_policemen, board_capacity):
+        self._card_counts = deck.frozen_card_counts()
+        self._num_cards = deck.size()
+        self._num_policemen = self._card_counts[Card.Policeman]
+        self._num_needed = round_end_policemen - board.num_policemen
+        self._space = board_capacity - board.num_cards
+    def card_counts(self):
+        return self._card_counts  # immutable, shared
+    @property
+    def num_cards(self):
+        return self._num_cards
+    def policeman_probability(self):
+        """Probability that the next card drawn is a policeman."""
+        return self._num_policemen / self._num_cards if self._num_cards else 0.0
+    def round_end_probability(self, num_draws):
+        """Probability that the round ends by policemen within the next "num_draws" draws."""
+        table = _round_end_table(self._num_cards, self._num_policemen, self._num_needed)
+        return table[min(num_draws, self._num_cards)]
+    def expected_booty(self):
+        """Expected number of booty cards drawn before the next policeman or full board, and their expected mix.
 
+        Assumes that the players keep drawing: auctions called by players and thefts are not anticipated.
+        """
+        table = _booty_table(self._num_cards, self._num_policemen)
+        expected = table[min(self._space, len(table) - 1)]
+        num_booty = self._num_cards - self._num_policemen
+        mix = {c: expected * self._card_counts[c] / num_booty for c in Card if c != Card.Policeman and self._card_counts[c]}
+        return expected, mix
@@ -1,5 +1,6 @@
 from pieces import Card, Cheque
 import control
+import math
 import statistics
 
 def _determine_winner(scores):
@@ -81,6 +82,197 @@ def analyze_cheque_value(multi_scorings):
         print(s_template.format(cheque, avg, len(money[cheque])))
 
 
+class RunningStats:
+    """Running mean and variance (Welford), mergeable with other partial results."""
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self._m2 = 0.0
+    def add(self, x):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self._m2 += delta * (x - self.mean)
+    def merge(self, other):
+        n = self.n + other.n
+        if not n:
+            return
+        delta = other.mean - self.mean
+        self._m2 += other._m2 + delta * delta * self.n * other.n / n
+        self.mean += delta * other.n / n
+        self.n = n
+    @property
+    def variance(self):
+        return self._m2 / (self.n - 1) if self.n >= 2 else float('nan')
+    @property
+    def stdev(self):
+        return math.sqrt(self.variance)
 
 
+class PlayerOrderAccumulator:
+    def __init__(self):
+        self._names = None
+        self._wins = None
+    def add_game(self, scores):
+        if self._names is None:
+            self._names = [str(p) for p in scores]
+            self._wins = len(scores) * [0]
+        player_scores = [s.final_score() for s in scores.values()]
+        self._wins[player_scores.index(max(player_scores))] += 1
+    def merge(self, other):
+        if other._names is None:
+            return
+        if self._names is None:
+            self._names, self._wins = other._names, len(other._wins) * [0]
+        self._wins = [a + b for a, b in zip(self._wins, other._wins)]
+    def report(self):
+        return ', '.join(['{} won {} times'.format(p, c) for p, c in zip(self._names, self._wins)])
 
+
+class CardValueAccumulator:
+    def __init__(self):
+        rounds = range(1, control.GAME_ROUNDS + 1)
+        self._points = {c: RunningStats() for c in Card if c != Card.Policeman}
+        self._round_points = {r: {c: RunningStats() for c in self._points} for r in rounds}
+    def add_game(self, scores):
+        for s in scores.values():
+            for sc in s.final_scoring_cards():
+                self._points[sc.card].add(sc.scored_points)
+                self._round_points[sc.round][sc.card].add(sc.scored_points)
+    def merge(self, other):
+        for c, stats in self._points.items():
+            stats.merge(other._points[c])
+        for r, points in self._round_points.items():
+            for c, stats in points.items():
+                stats.merge(other._round_points[r][c])
+    def report(self):
+        lines = ['{} is worth {:.3f} points with {:.3f} stdev'.format(c, p.mean, p.stdev) for c, p in self._points.items()]
+        s_template = 'On Round {}, {:14s} is worth {:.3f} points with {:.3f} stdev in {} samples'
+        for r, points in self._round_points.items():
+            lines.extend(s_template.format(r, c, p.mean, p.stdev, p.n) for c, p in points.items())
+        return '\n'.join(lines)
+
+
+class ChequeValueAccumulator:
+    def __init__(self):
+        rounds = range(1, control.GAME_ROUNDS + 1)
+        score_cheques = [c for c in Cheque] + [Card.Thief]
+        self._num_games = 0
+        self._sums = {r: {c: 0 for c in score_cheques} for r in rounds}
+        self._cards = {r: {c: 0 for c in score_cheques} for r in rounds}
+        self._money = {c: RunningStats() for c in Cheque}
+        self._game_points = {c: RunningStats() for c in score_cheques}  # points won with a cheque in one game
+    def add_game(self, scores):
+        self._num_games += 1
+        game_points = dict.fromkeys(self._game_points, 0)
+        for s in scores.values():
+            for sc in s.final_scoring_cards():
+                self._sums[sc.round][sc.cheque] += sc.scored_points
+                self._cards[sc.round][sc.cheque] += 1
+                game_points[sc.cheque] += sc.scored_points
+            for sc in s.final_scoring_cheques():
+                self._money[sc.cheque].add(sc.scored_points)
+        for c, points in game_points.items():
+            self._game_points[c].add(points)
+    def merge(self, other):
+        self._num_games += other._num_games
+        for r in self._sums:
+            for c in self._sums[r]:
+                self._sums[r][c] += other._sums[r][c]
+                self._cards[r][c] += other._cards[r][c]
+        for c, stats in self._money.items():
+            stats.merge(other._money[c])
+        for c, stats in self._game_points.items():
+            stats.merge(other._game_points[c])
+    def report(self):
+        n = self._num_games
+        s_template = 'On Round {}, {} is worth {:.3f} points with {:.3f} cards'
+        lines = [s_template.format(r, c, self._sums[r][c] / n, self._cards[r][c] / n) for r in self._sums for c in self._sums[r]]
+        s_template = 'At game end, {} is worth {:.3f} money points in {} samples'
+        lines.extend(s_template.format(c, p.mean, p.n) for c, p in self._money.items())
+        return '\n'.join(lines)
+
+
+class GameStatistics:
+    """All streamed reports together: consumes one game at a time in constant memory."""
+    def __init__(self):
+        self.player_order = PlayerOrderAccumulator()
+        self.card_value = CardValueAccumulator()
+        self.cheque_value = ChequeValueAccumulator()
+    def _accumulators(self):
+        return [self.player_order, self.card_value, self.cheque_value]
+    def add_game(self, scores):
+        for acc in self._accumulators():
+            acc.add_game(scores)
+    def merge(self, other):
+        for acc, other_acc in zip(self._accumulators(), other._accumulators()):
+            acc.merge(other_acc)
+    def report(self):
+        return '\n'.join(acc.report() for acc in self._accumulators())
+    @property
+    def num_games(self):
+        return self.cheque_value._num_games
+
+
+##
+## Precision targets for adaptive runs: each is met once its confidence intervals are narrow enough.
+## The intervals are fixed-sample ones: checked after every batch, the chance of stopping on a fluke
+## grows with the number of checks, so the realised confidence is lower than the nominal one.
+##
+
+def _z(confidence):
+    return statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+
+def _half_width(stats, z):
+    return z * stats.stdev / math.sqrt(stats.n) if stats.n >= 2 else math.inf
+
+class CardValueTarget:
+    """Every card value (or every card value on every round) known to within "half_width" points."""
+    def __init__(self, half_width, confidence=0.95, per_round=False):
+        self.half_width = half_width
+        self.confidence = confidence
+        self.per_round = per_round
+    def intervals(self, stats):
+        z = _z(self.confidence)
+        acc = stats.card_value
+        if self.per_round:
+            return {'Round {} {}'.format(r, c): (p.mean, _half_width(p, z)) for r, points in acc._round_points.items() for c, p in points.items()}
+        return {str(c): (p.mean, _half_width(p, z)) for c, p in acc._points.items()}
+    def is_met(self, stats):
+        return all(half <= self.half_width for _, half in self.intervals(stats).values())
+    def report(self, stats):
+        widest = max(half for _, half in self.intervals(stats).values())
+        return 'Card values within ±{:.3f} points at {:.0%} (target ±{})'.format(widest, self.confidence, self.half_width)
+
+class ChequeValueTarget:
+    """The points won per game with every cheque (and with thieves) known to within "half_width"."""
+    def __init__(self, half_width, confidence=0.95):
+        self.half_width = half_width
+        self.confidence = confidence
+    def intervals(self, stats):
+        z = _z(self.confidence)
+        return {str(c): (p.mean, _half_width(p, z)) for c, p in stats.cheque_value._game_points.items()}
+    def is_met(self, stats):
+        return all(half <= self.half_width for _, half in self.intervals(stats).values())
+    def report(self, stats):
+        widest = max(half for _, half in self.intervals(stats).values())
+        return 'Cheque values within ±{:.3f} points per game at {:.0%} (target ±{})'.format(widest, self.confidence, self.half_width)
+
+class WinnerTarget:
+    """The seat with the most wins beats the runner-up with the given confidence."""
+    def __init__(self, confidence=0.99):
+        self.confidence = confidence
+    def z_score(self, stats):
+        wins = sorted(stats.player_order._wins or [0, 0], reverse=True)
+        n = sum(wins)
+        if not n:
+            return 0.0
+        p1, p2 = wins[0] / n, wins[1] / n
+        var = (p1 + p2 - (p1 - p2) ** 2) / n  # variance of a difference of multinomial proportions
+        return (p1 - p2) / math.sqrt(var) if var else 0.0
+    def is_met(self, stats):
+        return self.z_score(stats) >= _z(self.confidence)
+    def report(self, stats):
+        acc = stats.player_order
+        leader = acc._names[acc._wins.index(max(acc._wins))] if acc._names else None
+        return 'Winner {} decided at z = {:.2f} (target {:.2f} for {:.0%})'.format(leader, self.z_score(stats), _z(self.confidence), self.confidence)
@@ -22,6 +22,12 @@ class Auction:
             raise Exception('Cheque is not able to outbid an existing bid.')
         self._highest_bid = bidded_cheque
         self._highest_bidder = bidder_state
+    def copy(self, players):
+        # "players" maps the bidder states to their copies.
+        auction = Auction(self._auction_mode, players[self._initiator], self._auctioned_cards, self._auctioned_cheque)
+        auction._highest_bid = self._highest_bid
+        auction._highest_bidder = players.get(self._highest_bidder)
+        return auction
 
     @property
     def auction_mode(self):
@@ -0,0 +1,202 @@
+"""
+Simulation throughput benchmarks.
+
+Measures games/sec, microseconds per turn and peak memory for AI agent types and player counts,
+plus micro-benchmarks of the hot paths. Only the cheap agents are benchmarked by default: a search
+game takes tens of seconds, so its rate would rest on a single game. Peak memory is the tracemalloc
+peak of the bytes allocated while playing the first game again, after the timed games: tracing
+allocations slows the games down, so it stays out of the timing. Results can be saved as a JSON
+baseline; comparing against a baseline exits with status 1 when a metric regresses beyond the threshold.
+
+    python benchmark.py --save baseline.json
+    python benchmark.py --compare baseline.json --threshold 0.2
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+
+from control import Game
+from auction import AuctionMode
+from randomness import GameRandom
+from razzia import Razzia, AI_AGENTS
+from scoring import Scoring, ScoringCard, ExpectedScore
+from pieces import Card, CardCounts, Cheque
+import analytics
+import records
+
+try:
+    import lockstep
+except ImportError:
+    lockstep = None  # the lockstep engine needs NumPy
+
+
+DEFAULT_AGENTS = ('trivial', 'stealing')
+PLAYER_COUNTS = (2, 3, 4, 5)
+DEFAULT_MIN_TIME = 1.0  # Seconds of play per agent type and player count.
+DEFAULT_THRESHOLD = 0.2  # Relative change that counts as a regression.
+HIGHER_IS_BETTER = {'games_per_sec'}
+BENCHMARK_SEED = 1
+LOCKSTEP_BATCH = 1000  # Games per call of the lockstep engine.
+
+
+def _agents(ai, num_players):
+    return Razzia(num_players, ai=ai)._player_agents
+
+def _peak_kib(agents, rng):
+    # Untimed: tracemalloc slows allocations down.
+    gc.collect()
+    tracemalloc.start()
+    try:
+        Game(agents, rng).play_game()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+def bench_games(ai, num_players, min_time=DEFAULT_MIN_TIME):
+    agents = _agents(ai, num_players)
+    num_games, num_turns, elapsed = 0, 0, 0.0
+    while elapsed < min_time:
+        gc.collect()  # games are cyclic garbage: start every game from a clean heap, outside the timing
+        game = Game(agents, GameRandom(BENCHMARK_SEED, num_games))
+        start = time.perf_counter()
+        game.play_game()
+        elapsed += time.perf_counter() - start
+        num_games += 1
+        num_turns += game.num_turns
+    peak_kib = _peak_kib(agents, GameRandom(BENCHMARK_SEED, 0))
+    return {'games_per_sec': num_games / elapsed, 'us_per_turn': 1e6 * elapsed / num_turns, 'peak_kib': peak_kib}
+
+
+def _us_per_op(fn):
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    return 1e6 * min(timer.repeat(3, number)) / number
+
+def _us_per_item(fn, items):
+    # Times "fn" over prepared items, for operations that consume their input.
+    best = None
+    for batch in items:
+        start = time.perf_counter()
+        for item in batch:
+            fn(item)
+        t = (time.perf_counter() - start) / len(batch)
+        best = t if best is None else min(best, t)
+    return 1e6 * best
+
+def _sample_scorings(num_games):
+    return Razzia(4, ai='trivial', random_seed=BENCHMARK_SEED).play_games(num_games)
+
+def _auction_game():
+    game = Game(_agents('trivial', 4), GameRandom(BENCHMARK_SEED))
+    for card in [Card.Ring, Card.Bodyguard, Card.Car, Card.Casino]:
+        game._board.add_card(card)
+    return game
+
+def bench_micro():
+    scards = [ScoringCard(c, 1, Cheque.Five, 1) for c in [Card.Ring, Card.Ring, Card.Film, Card.Bodyguard, Card.Car, Card.Driver, Card.GoldCoin, Card.Thief, Card.Casino]]
+    scoring = Scoring('Benchmark')
+    counts = CardCounts.of(sc.card for sc in scards)
+    gained = CardCounts.of([Card.Driver])
+    stealable = [Card.Ring, Card.Bodyguard, Card.Car, Card.Driver, Card.GoldCoin]
+    auction_game = _auction_game()
+    auction_batches = [[auction_game.clone(rng=GameRandom(BENCHMARK_SEED, i)) for i in range(1000)] for _ in range(5)]
+    scorings = _sample_scorings(50)
+    record = records.record_game(_agents('stealing', 4), GameRandom(BENCHMARK_SEED))[1]
+    def run_auction(game):
+        game._execute_auction(AuctionMode.ByPoliceman, game._players[0], game._board)
+    def accumulate():
+        stats = analytics.GameStatistics()
+        for scores in scorings:
+            stats.add_game(scores)
+        return stats.report()
+    def quietly(fn):
+        def run():
+            with contextlib.redirect_stdout(io.StringIO()):
+                fn(scorings)
+        return run
+    micro = {
+        'score_round': _us_per_op(lambda: scoring.score_round(0, 2, scards)),
+        'static_card_score': _us_per_op(lambda: ExpectedScore._static_card_score(counts, 0, 2, 1)),
+        'marginal_card_score': _us_per_op(lambda: ExpectedScore.marginal_card_score(counts, gained, 0, 2, 1)),
+        'marginal_card_scores': _us_per_op(lambda: ExpectedScore.marginal_card_scores(counts, stealable, 0, 2, 1)),
+        'execute_auction': _us_per_item(run_auction, auction_batches),
+        'game_clone': _us_per_op(lambda: auction_game.clone(rng=GameRandom(BENCHMARK_SEED))),
+        'replay_game': _us_per_op(lambda: records.replay_game(record)),
+        'analyze_player_order': _us_per_op(quietly(analytics.analyze_player_order)),
+        'analyze_card_value': _us_per_op(quietly(analytics.analyze_card_value)),
+        'analyze_cheque_value': _us_per_op(quietly(analytics.analyze_cheque_value)),
+        'game_statistics': _us_per_op(accumulate),
+    }
+    if lockstep is not None:
+        lockstep_games = Razzia(4, ai='trivial', random_seed=BENCHMARK_SEED)
+        micro['lockstep_game'] = _us_per_op(lambda: lockstep_games.lockstep_scores(LOCKSTEP_BATCH)) / LOCKSTEP_BATCH
+    return micro
+
+
+def run(agent_types=DEFAULT_AGENTS, player_counts=PLAYER_COUNTS, min_time=DEFAULT_MIN_TIME):
+    games = {}
+    for ai in agent_types:
+        for n in player_counts:
+            games['{}/{}'.format(ai, n)] = bench_games(ai, n, min_time)
+    return {
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'games': games,
+        'micro': {name: {'us_per_op': us} for name, us in bench_micro().items()},
+    }
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """Descriptions of the metrics of "current" that regressed from "baseline" by more than "threshold"."""
+    regressions = []
+    for section in ('games', 'micro'):
+        for name, metrics in current[section].items():
+            for metric, value in metrics.items():
+                base = baseline.get(section, {}).get(name, {}).get(metric)
+                if not base:
+                    continue
+                change = base / value - 1 if metric in HIGHER_IS_BETTER else value / base - 1
+                if change > threshold:
+                    regressions.append('{} {}: {:.3f} -> {:.3f} ({:+.0%})'.format(name, metric, base, value, change))
+    return regressions
+
+def report(results):
+    lines = ['{:14s} {:>10s} {:>12s} {:>12s}'.format('games', 'games/s', 'us/turn', 'peak KiB')]
+    lines.extend('{:14s} {:10.1f} {:12.1f} {:12.1f}'.format(name, m['games_per_sec'], m['us_per_turn'], m['peak_kib']) for name, m in results['games'].items())
+    lines.append('{:24s} {:>12s}'.format('micro-benchmark', 'us/op'))
+    lines.extend('{:24s} {:12.2f}'.format(name, m['us_per_op']) for name, m in results['micro'].items())
+    return '\n'.join(lines)
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Razzia! simulation benchmarks.')
+    parser.add_argument('--agents', nargs='+', choices=list(AI_AGENTS), default=list(DEFAULT_AGENTS), help='agent types')
+    parser.add_argument('--players', nargs='+', type=int, default=list(PLAYER_COUNTS), help='player counts')
+    parser.add_argument('--min-time', type=float, default=DEFAULT_MIN_TIME, help='seconds of play per configuration')
+    parser.add_argument('--save', help='write the results as a JSON baseline')
+    parser.add_argument('--compare', help='JSON baseline to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='relative change that fails the comparison')
+    options = parser.parse_args(args)
+    results = run(options.agents, options.players, options.min_time)
+    print(report(results))
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(results, f, indent=2)
+    if options.compare:
+        with open(options.compare) as f:
+            regressions = compare(json.load(f), results, options.threshold)
+        if regressions:
+            print('Regressions beyond {:.0%}:\n  {}'.format(options.threshold, '\n  '.join(regressions)))
+            return 1
+        print('No regressions beyond {:.0%}.'.format(options.threshold))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,37 @@
+"""
+Checkpoints of long simulation runs.
+
+A checkpoint pickles the partial aggregates of a run together with its seed and the index of the
+next game to play. Checkpoints are written to a temporary file and moved over the old one, so a run
+killed while writing leaves the previous checkpoint intact.
+"""
+
+import os
+import pickle
+
+
+class Checkpoint:
+    """State of a run over "num_games" seeded games, of which the first "next_game_idx" are aggregated in "stats"."""
+    def __init__(self, seed, num_games, chunk_games, agents, stats, next_game_idx=0):
+        self.seed = seed
+        self.num_games = num_games
+        self.chunk_games = chunk_games
+        self.agents = agents
+        self.stats = stats
+        self.next_game_idx = next_game_idx
+    @property
+    def is_done(self):
+        return self.next_game_idx >= self.num_games
+
+
+def save(path, checkpoint):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def load(path):
+    with open(path, 'rb') as f:
+        return pickle.load(f)
@@ -0,0 +1,229 @@
+"""
+Columnar result store for simulated games.
+
+Scoring rows are kept as typed columns, one raw binary file per column, so that a
+finished run can be memory-mapped and queried with vectorized group-by operations.
+Writing needs only the standard library; querying needs NumPy.
+"""
+
+from array import array
+import json
+import os
+
+from pieces import Card, Cheque
+from scoring import Score
+import control
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+THEFT = 0  # Cheque value and ordinal of cards that were stolen with a Thief.
+
+CARD_COLUMNS = (
+    ('game', 'I'), ('num_players', 'B'), ('seat', 'B'), ('card', 'B'), ('round', 'B'),
+    ('cheque', 'B'), ('cheque_ordinal', 'B'), ('points', 'd'))
+CHEQUE_COLUMNS = (('game', 'I'), ('num_players', 'B'), ('seat', 'B'), ('cheque', 'B'), ('points', 'd'))
+PLAYER_COLUMNS = (('game', 'I'), ('num_players', 'B'), ('seat', 'B'), ('total', 'h')) + tuple((s.name, 'h') for s in Score)
+TABLES = {'cards': CARD_COLUMNS, 'cheques': CHEQUE_COLUMNS, 'players': PLAYER_COLUMNS}
+
+CARDS_BY_ID = {c.id: c for c in Card}
+NUM_CARD_IDS = max(CARDS_BY_ID) + 1
+NUM_CHEQUE_CODES = max(c.value for c in Cheque) + 1
+
+
+def _cheque_code(cheque):
+    return cheque.value if isinstance(cheque, Cheque) else THEFT
+
+def _ordinal_code(cheque_ordinal):
+    return cheque_ordinal if isinstance(cheque_ordinal, int) else THEFT
+
+
+class GameColumns:
+    """In-memory column buffers for a batch of games; picklable, so workers can return them."""
+    def __init__(self):
+        self._columns = {t: {name: array(code) for name, code in cols} for t, cols in TABLES.items()}
+        self._num_games = 0
+    def add_game(self, game_id, scores):
+        cards, cheques, players = self._columns['cards'], self._columns['cheques'], self._columns['players']
+        n = len(scores)
+        for seat, s in enumerate(scores.values()):
+            for sc in s.final_scoring_cards():
+                cards['game'].append(game_id)
+                cards['num_players'].append(n)
+                cards['seat'].append(seat)
+                cards['card'].append(sc.card.id)
+                cards['round'].append(sc.round)
+                cards['cheque'].append(_cheque_code(sc.cheque))
+                cards['cheque_ordinal'].append(_ordinal_code(sc.cheque_ordinal))
+                cards['points'].append(sc.scored_points)
+            for sc in s.final_scoring_cheques():
+                cheques['game'].append(game_id)
+                cheques['num_players'].append(n)
+                cheques['seat'].append(seat)
+                cheques['cheque'].append(sc.cheque.value)
+                cheques['points'].append(sc.scored_points)
+            players['game'].append(game_id)
+            players['num_players'].append(n)
+            players['seat'].append(seat)
+            players['total'].append(s.final_score())
+            for score, value in s.final_score_by_type().items():
+                players[score.name].append(value)
+        self._num_games += 1
+    @property
+    def num_games(self):
+        return self._num_games
+    def num_rows(self, table):
+        return len(self._columns[table]['game'])
+
+
+class ResultStoreWriter:
+    """Appends GameColumns batches to the column files of a store directory.
+
+    Game ids of a batch are taken relative to the games already in the store when the writer was opened.
+    The metadata is replaced after every batch, so the batches written before a crash stay readable;
+    rows past the recorded row counts, from a batch cut short, are truncated when the store is reopened.
+    """
+    def __init__(self, path):
+        self._path = path
+        os.makedirs(path, exist_ok=True)
+        self._meta = _read_meta(path) or {'num_games': 0, 'tables': {t: {name: code for name, code in cols} for t, cols in TABLES.items()},
+                                          'rows': {t: 0 for t in TABLES}}
+        self._first_game_id = self._meta['num_games']
+        self._files = {t: {name: open(_column_file(path, t, name), 'ab') for name, _ in cols} for t, cols in TABLES.items()}
+        for t, columns in self._files.items():
+            for name, f in columns.items():
+                f.truncate(self._meta['rows'][t] * array(self._meta['tables'][t][name]).itemsize)
+        self._write_meta()
+    def _write_meta(self):
+        meta_file = os.path.join(self._path, 'meta.json')
+        with open(meta_file + '.tmp', 'w') as f:
+            json.dump(self._meta, f)
+        os.replace(meta_file + '.tmp', meta_file)
+    def write(self, game_columns):
+        for t, columns in game_columns._columns.items():
+            for name, values in columns.items():
+                if name == 'game' and self._first_game_id:
+                    values = array(values.typecode, (g + self._first_game_id for g in values))
+                values.tofile(self._files[t][name])
+                self._files[t][name].flush()
+            self._meta['rows'][t] += game_columns.num_rows(t)
+        self._meta['num_games'] += game_columns.num_games
+        self._write_meta()
+    def close(self):
+        for columns in self._files.values():
+            for f in columns.values():
+                f.close()
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _column_file(path, table, name):
+    return os.path.join(path, '{}.{}.col'.format(table, name))
+
+def _read_meta(path):
+    meta_file = os.path.join(path, 'meta.json')
+    if not os.path.exists(meta_file):
+        return None
+    with open(meta_file) as f:
+        return json.load(f)
+
+
+class ResultStore:
+    """Read-only, memory-mapped view of a store directory."""
+    def __init__(self, path):
+        if np is None:
+            raise Exception('Querying a result store requires NumPy.')
+        meta = _read_meta(path)
+        if meta is None:
+            raise Exception('Not a result store: {}'.format(path))
+        self._num_games = meta['num_games']
+        self._tables = {t: {name: self._map(_column_file(path, t, name), code, meta['rows'][t]) for name, code in cols.items()}
+                        for t, cols in meta['tables'].items()}
+    @staticmethod
+    def _map(filename, code, num_rows):
+        dtype = np.dtype(code)
+        if not num_rows:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode='r', shape=(num_rows,))
+    @property
+    def num_games(self):
+        return self._num_games
+    def table(self, name):
+        return self._tables[name]
+
+
+##
+## Vectorized queries.
+##
+
+def _group_stats(keys, values, num_keys):
+    # Two passes, like RunningStats in precision: the squared deviations are summed around the group means.
+    n = np.bincount(keys, minlength=num_keys)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.bincount(keys, weights=values, minlength=num_keys) / n
+        deviations = values - mean[keys]
+        var = np.bincount(keys, weights=deviations * deviations, minlength=num_keys) / (n - 1)
+    return mean, np.sqrt(var), n
+
+def _filter(table, **conditions):
+    mask = None
+    for name, value in conditions.items():
+        if value is None:
+            continue
+        m = table[name] == value
+        mask = m if mask is None else mask & m
+    if mask is None:
+        return table
+    return {name: column[mask] for name, column in table.items()}
+
+def card_worth(store, card, round=None, cheque_ordinal=None, num_players=None):
+    """Mean, stdev and number of samples of the points a card scored in the matching rows."""
+    cards = _filter(store.table('cards'), card=card.id, round=round, cheque_ordinal=cheque_ordinal, num_players=num_players)
+    mean, stdev, n = _group_stats(np.zeros(len(cards['points']), dtype=np.intp), cards['points'], 1)
+    return float(mean[0]), float(stdev[0]), int(n[0])
+
+def analyze_player_order(store, num_players=None):
+    players = _filter(store.table('players'), num_players=num_players)
+    game, seat, total = players['game'], players['seat'], players['total']
+    starts = np.flatnonzero(np.r_[True, game[1:] != game[:-1]])
+    counts = np.diff(np.r_[starts, len(game)])
+    top = np.repeat(np.maximum.reduceat(total, starts), counts) if len(game) else total
+    is_top = total == top
+    _, first = np.unique(game[is_top], return_index=True)  # first seat with the top score wins ties
+    wins = np.bincount(seat[is_top][first], minlength=int(seat.max()) + 1 if len(seat) else 0)
+    return ', '.join('Seat {} won {} times'.format(i + 1, w) for i, w in enumerate(wins))
+
+def analyze_card_value(store, num_players=None):
+    cards = _filter(store.table('cards'), num_players=num_players)
+    card_ids, points = cards['card'].astype(np.intp), cards['points']
+    score_cards = [c for c in Card if c != Card.Policeman]
+    mean, stdev, _ = _group_stats(card_ids, points, NUM_CARD_IDS)
+    lines = ['{} is worth {:.3f} points with {:.3f} stdev'.format(c, mean[c.id], stdev[c.id]) for c in score_cards]
+    keys = cards['round'].astype(np.intp) * NUM_CARD_IDS + card_ids
+    mean, stdev, n = _group_stats(keys, points, (control.GAME_ROUNDS + 1) * NUM_CARD_IDS)
+    s_template = 'On Round {}, {:14s} is worth {:.3f} points with {:.3f} stdev in {} samples'
+    for r in range(1, control.GAME_ROUNDS + 1):
+        lines.extend(s_template.format(r, c, mean[r * NUM_CARD_IDS + c.id], stdev[r * NUM_CARD_IDS + c.id], n[r * NUM_CARD_IDS + c.id]) for c in score_cards)
+    return '\n'.join(lines)
+
+def analyze_cheque_value(store, num_players=None):
+    cards = _filter(store.table('cards'), num_players=num_players)
+    num_games = len(np.unique(_filter(store.table('players'), num_players=num_players)['game']))
+    keys = cards['round'].astype(np.intp) * NUM_CHEQUE_CODES + cards['cheque']
+    num_keys = (control.GAME_ROUNDS + 1) * NUM_CHEQUE_CODES
+    sums = np.bincount(keys, weights=cards['points'], minlength=num_keys)
+    n = np.bincount(keys, minlength=num_keys)
+    score_cheques = [(c, c.value) for c in Cheque] + [(Card.Thief, THEFT)]
+    s_template = 'On Round {}, {} is worth {:.3f} points with {:.3f} cards'
+    lines = [s_template.format(r, c, sums[r * NUM_CHEQUE_CODES + code] / num_games, n[r * NUM_CHEQUE_CODES + code] / num_games)
+             for r in range(1, control.GAME_ROUNDS + 1) for c, code in score_cheques]
+    cheques = _filter(store.table('cheques'), num_players=num_players)
+    mean, _, n = _group_stats(cheques['cheque'].astype(np.intp), cheques['points'], NUM_CHEQUE_CODES)
+    s_template = 'At game end, {} is worth {:.3f} money points in {} samples'
+    lines.extend(s_template.format(c, mean[c.value] if n[c.value] else 0, n[c.value]) for c in Cheque)
+    return '\n'.join(lines)
@@ -3,9 +3,12 @@ import itertools
 import logging
 
 from auction import Auction, AuctionMode
-from agentview import AuctionView, GameView, PlayerView
+from agentview import AuctionView, DeckView, GameView, GameSnapshot
 
 from player import Player
+from events import Tracer, LoggingSink, PassReason
+from events import RoundStartEvent, DrawEvent, PolicemanEvent, AuctionStartEvent, BidEvent, PassEvent, WinEvent, TheftEvent, RoundScoringEvent, GameEndEvent
+from randomness import GameRandom
 from pieces import Deck, Card, Board
 from pieces import CHEQUE_STARTING, CHEQUES_FOR_2, CHEQUES_FOR_3, CHEQUES_FOR_4, CHEQUES_FOR_5
 
@@ -14,6 +17,8 @@ GAME_ROUNDS = 3
 ROUND_END_POLICEMEN = 7
 ROUND_END_POLICEMEN_TWOPLAYER = 5
 AUTOMATIC_AUCTION_NUM_CARDS = 7
+PROFILED_PHASES = ('_play_one_turn', '_execute_draw', '_execute_auction', '_execute_thieves', '_score_round', '_score_game_end', '_is_game_end_valid')
+PROFILED_DECISIONS = ('_ask_act', '_ask_bid', '_ask_steal')
 
 
 class ActionType(Enum):
@@ -51,22 +56,141 @@ class TurnOrder:
         return list(itertools.islice(self.circling_from(item), n + 1))[1:(n+1)]
 
 
+def _same_agent(x, y):
+    return x.player_agent == y.player_agent
+
+
+class DecisionRequest(Exception):
+    """A decision of "agent" pending in a game played by "Game.decisions()"; "args" are those of act, bid or steal."""
+    def __init__(self, kind, agent, args):
+        super().__init__(kind, agent.name)
+        self.kind = kind
+        self.agent = agent
+        self.args = args
+
+
+_NO_ANSWER = object()
+
+class _Stepper:
+    # Stands in for the agents: gives the answer sent to the generator, or pauses the game with a request.
+    def __init__(self):
+        self.answer = _NO_ANSWER
+    def _ask(self, kind, player, args):
+        answer, self.answer = self.answer, _NO_ANSWER
+        if answer is _NO_ANSWER:
+            raise DecisionRequest(kind, player.player_agent, args)
+        return answer
+    def act(self, player, game_view):
+        return self._ask('act', player, (game_view,))
+    def bid(self, player, *args):
+        return self._ask('bid', player, args)
+    def steal(self, player, game_view):
+        return self._ask('steal', player, (game_view,))
+
+
 class Game:
-    def __init__(self, player_agents):
+    def __init__(self, player_agents, rng=None, tracer=None, deck=None, profiler=None, streams_by_agent=False):
         n = len(player_agents)
         if not 2 <= n <= 5:
             raise Exception('Unsupported number of players: {}'.format(player_agents))
         cheques = {2: CHEQUES_FOR_2[:], 3: CHEQUES_FOR_3[:], 4: CHEQUES_FOR_4[:], 5: CHEQUES_FOR_5[:]}
         players = [Player(p, cs) for p, cs in zip(player_agents, cheques[n])]
         self._players = players
-        self._deck = Deck()
+        self._rng = rng if rng else GameRandom.unseeded()
+        self._deck = deck if deck else Deck(self._rng.deal)
         self._board = Board(CHEQUE_STARTING)
         self._round = 1
         self._round_end_policemen = ROUND_END_POLICEMEN if n > 2 else ROUND_END_POLICEMEN_TWOPLAYER
         self._end = False
-        self._round_order_generator = TurnOrder(self._players, lambda x, y: x.player_agent == y.player_agent)
+        self._snapshot = None
+        self._state_version = 0  # counts the state changes, so that views can tell if they are stale
+        self._seats = {p: i for i, p in enumerate(players)}
+        # Random streams follow the seat by default; keyed by agent name, they follow the agent across seatings.
+        self._streams = {p: p.player_agent.name for p in players} if streams_by_agent else self._seats
+        if tracer is None and logging.getLogger().isEnabledFor(logging.DEBUG):
+            tracer = Tracer([LoggingSink()])
+        self._tracer = tracer
+        self._emit = tracer.emit if tracer else None  # events are only built when a tracer is attached
+        self._round_order_generator = TurnOrder(self._players, _same_agent)
+        self._turn_player = None  # None between rounds
+        self._consecutive_passes = 0
+        self._num_turns = 0
+        self._profiler = profiler
+        if profiler:
+            self._instrument(profiler)
+        self._auction = None  # auction in progress
+        self._auction_view = None
+        self._bidders = None  # players yet to decide on the auction in progress
+        self._thief = None  # player yet to choose the cards of a theft in progress
+
+    def clone(self, player_agents=None, rng=None, redeterminize=False):
+        """Independent copy of the game that resumes at the pending decision when played.
+
+        Agents are not copied: the clone is played by "player_agents", by default the same agents.
+        With "redeterminize", the hidden order of the deck is reshuffled with the deal stream of "rng".
+        """
+        game = Game.__new__(Game)
+        agents = player_agents if player_agents else [p.player_agent for p in self._players]
+        players = [p.copy(a) for p, a in zip(self._players, agents)]
+        copies = dict(zip(self._players, players))
+        game._players = players
+        game._rng = rng if rng else GameRandom.unseeded()
+        game._deck = self._deck.copy(game._rng.deal if redeterminize else None)
+        game._board = self._board.copy()
+        game._round = self._round
+        game._round_end_policemen = self._round_end_policemen
+        game._end = self._end
+        game._snapshot = None
+        game._state_version = 0
+        game._seats = {p: i for i, p in enumerate(players)}
+        game._streams = {copies[p]: s for p, s in self._streams.items()}
+        game._tracer = None
+        game._emit = None
+        game._profiler = None
+        game._round_order_generator = TurnOrder(players, _same_agent)
+        game._turn_player = copies.get(self._turn_player)
+        game._consecutive_passes = self._consecutive_passes
+        game._num_turns = self._num_turns
+        game._auction = self._auction.copy(copies) if self._auction else None
+        game._auction_view = AuctionView(game._auction) if game._auction else None
+        game._bidders = [copies[p] for p in self._bidders] if self._auction else None
+        game._thief = copies.get(self._thief)
+        return game
+
+    def snapshot(self):
+        # All views of one decision point share a snapshot; it is rebuilt only after the state changes.
+        if self._snapshot is None:
+            self._snapshot = GameSnapshot(self, self._players, self._board)
+        return self._snapshot
+
+    def _deck_view(self):
+        return DeckView(self._deck, self._board, self._round_end_policemen, AUTOMATIC_AUCTION_NUM_CARDS)
+
+    def _game_view(self, player):
+        return GameView(self, player)
+
+    def _state_changed(self):
+        # Called before the state changes, so that the dropped snapshot is frozen at its own state.
+        if self._snapshot is not None:
+            self._snapshot.freeze()  # views bound to it keep showing the state they were built for
+            self._snapshot = None
+        self._state_version += 1
+
+    def _ask_act(self, player, game_view):
+        return player.player_agent.act(game_view)
+    def _ask_bid(self, player, game_view, auction_view, player_view, is_mandated):
+        return player.player_agent.bid(game_view, auction_view, player_view, is_mandated)
+    def _ask_steal(self, player, game_view):
+        return player.player_agent.steal(game_view)
+
+    def _instrument(self, profiler):
+        for name in PROFILED_PHASES:
+            setattr(self, name, profiler.wrap(name.lstrip('_'), getattr(self, name)))
+        for name in PROFILED_DECISIONS:
+            setattr(self, name, profiler.wrap_agent(name.replace('_ask_', 'agent.'), getattr(self, name)))
 
     def _execute_winning_bid(self, bidder, bid_cheque, board):
+        self._state_changed()
         cheque_ordinal = bidder.num_unavailable_cheques + 1
         new_cards = board.take_all_booty_cards()
         bidder.gain_cards(new_cards, self._round, bid_cheque, cheque_ordinal)
@@ -74,65 +198,74 @@ class Game:
         bidder.remove_available_cheque(bid_cheque)
         bidder.add_unavailable_cheque(gained_cheque)
         board.replace_cheque(bid_cheque)
-        logging.debug('  {} wins the auction:'.format(bidder.player_agent))
-        logging.debug('    loses cheque {}'.format(bid_cheque))
-        logging.debug('    gains cheque {} (as unavailable)'.format(gained_cheque))
-        logging.debug('    gains cards: {}'.format(', '.join(c.name for c in new_cards)))
+        if self._emit:
+            self._emit(WinEvent(self._round, self._seats[bidder], bid_cheque, gained_cheque, new_cards))
 
     def _execute_auction(self, auction_mode, initiator, board):
         auction = Auction(auction_mode, initiator, board.get_cards(), board.cheque)
-        for player in self._round_order_generator.one_circle_from_next(auction.initiator):
+        self._auction = auction
+        self._auction_view = AuctionView(auction)
+        self._bidders = self._round_order_generator.one_circle_from_next(auction.initiator)
+        if self._emit:
+            self._emit(AuctionStartEvent(self._round, self._seats[initiator], auction_mode, auction.auctioned_cards))
+        self._continue_auction()
+
+    def _continue_auction(self):
+        # Bidders leave the queue only after their decision has been applied, so a clone asks the pending bidder again.
+        auction = self._auction
+        auction_view = self._auction_view
+        bidders = self._bidders
+        emit = self._emit
+        while bidders:
+            player = bidders[0]
             top = auction.highest_bid
-            agent = player.player_agent
             if player.round_is_over:
-                logging.debug('  {} PASSes bid because no cheques are available.'.format(agent))
-                continue
-            avail_cheques_str = ','.join(str(c) for c in player.available_cheques())
-            if top and player.highest_cheque < top:
-                logging.debug('  {} PASSes bid because cannot outbid (had {} available).'.format(agent, avail_cheques_str))
-                continue
-            is_mandated = auction.auction_mode == AuctionMode.ByPlayer and player == auction.initiator
-            game_view = GameView(self, player, self._players, self._board)
-            auction_view = AuctionView(auction)
-            player_view = PlayerView(player)
-            bidded_cheque = player.player_agent.bid(game_view, auction_view, player_view, is_mandated)
-            if bidded_cheque:
-                logging.debug('  {} BIDs with cheque {} (had {} available).'.format(agent, bidded_cheque, avail_cheques_str))
-                auction.set_highest_bid(bidded_cheque, player)
-            elif is_mandated:
-                raise Exception('Missing mandated bid.')
+                if emit:
+                    emit(PassEvent(self._round, self._seats[player], PassReason.NoCheques))
+            elif top and player.highest_cheque < top:
+                if emit:
+                    emit(PassEvent(self._round, self._seats[player], PassReason.CannotOutbid))
             else:
-                logging.debug('  {} PASSes bid deliberately (had {} available).'.format(agent, avail_cheques_str))
+                # The initiator of an auction must bid, unless somebody else already did.
+                is_mandated = auction.auction_mode == AuctionMode.ByPlayer and player == auction.initiator and not top
+                game_view = self._game_view(player)
+                player_view = game_view.get_active_player_view()
+                bidded_cheque = self._ask_bid(player, game_view, auction_view, player_view, is_mandated)
+                if bidded_cheque:
+                    auction.set_highest_bid(bidded_cheque, player)
+                    if emit:
+                        emit(BidEvent(self._round, self._seats[player], bidded_cheque))
+                elif is_mandated:
+                    raise Exception('Missing mandated bid.')
+                elif emit:
+                    emit(PassEvent(self._round, self._seats[player], PassReason.Deliberate))
+            bidders.pop(0)
+        self._auction = None
         if auction.highest_bid:
-            self._execute_winning_bid(auction.highest_bidder, auction.highest_bid, board)
-            if not auction.highest_bidder.num_available_cheques:
-                logging.debug('    is out of cheques and out of round')
-        else:
-            logging.debug('  No bids in this auction.')
+            self._execute_winning_bid(auction.highest_bidder, auction.highest_bid, self._board)
+        elif auction.auction_mode == AuctionMode.ByFullBoard:
+            self._state_changed()
+            self._board.discard_booty_cards()
 
     def _execute_auction_by_full_board(self, initiator):
-        logging.debug('Starting an Auction (by full board)')
-        highest_bidder = self._execute_auction(AuctionMode.ByFullBoard, initiator, self._board)
-        if not highest_bidder:
-            self._board.discard_booty_cards()
+        self._execute_auction(AuctionMode.ByFullBoard, initiator, self._board)
     def _execute_auction_by_player(self, initiator):
-        pass  # FIXME: implement this action
+        self._execute_auction(AuctionMode.ByPlayer, initiator, self._board)
+        return Trigger.Turn
     def _execute_auction_by_policeman(self, initiator):
-        logging.debug('Starting an Auction (by Policeman)')
         self._execute_auction(AuctionMode.ByPoliceman, initiator, self._board)
     def _execute_draw(self, initiator):
+        self._state_changed()
         card = self._deck.draw()
-        logging.debug('Player agent {} DRAWs a card: {}'.format(initiator.player_agent, card))
+        if self._emit:
+            self._emit(DrawEvent(self._round, self._seats[initiator], card))
         if card == Card.Policeman:
             self._board.add_policeman()
-            logging.debug(  'added policeman (total {})'.format(self._board.num_policemen))
             is_instant_round_end = self._board.num_policemen == self._round_end_policemen
+            if self._emit:
+                discarded = self._board.get_cards() if is_instant_round_end else []
+                self._emit(PolicemanEvent(self._round, self._seats[initiator], self._board.num_policemen, is_instant_round_end, discarded))
             if is_instant_round_end:
-                logging.debug('Policemen limit reached.')
-                discarded_str = ', '.join(str(c) for c in self._board.get_cards())
-                logging.debug('Discarding {} cards from board: {}'.format(self._board.num_cards, discarded_str))
-                if not self.last_round:
-                    logging.debug('Round ends with {} cards in deck remaining.'.format(self._deck.size()))
                 self._board.discard_booty_cards()
                 self._board.discard_policemen()
                 return Trigger.Round
@@ -149,15 +282,18 @@ class Game:
         num_thieves = initiator.num_thieves
         if not num_thieves or not self._board.num_cards:
             raise Exception('Cannot execute Thief action: player has no thieves or no cards on board.')
-        cards_to_steal = initiator.player_agent.steal(GameView(self, initiator, self._players, self._board))
-        stolen_str = ', '.join([sc.name for sc in cards_to_steal])
-        logging.debug('Player agent {} STEALs cards with thieves: {}'.format(initiator.player_agent, stolen_str))
+        self._thief = initiator  # pending until the cards are chosen, so a clone asks for them again
+        cards_to_steal = self._ask_steal(initiator, self._game_view(initiator))
+        self._thief = None
         num_steal = len(cards_to_steal)
         if num_thieves < num_steal:
             raise Exception('Cannot steal {} cards with {} thieves.'.format(num_steal, num_thieves))
+        self._state_changed()
         initiator.remove_cards(num_steal * [Card.Thief])
         self._board.take_booty_cards(cards_to_steal)
         initiator.gain_cards(cards_to_steal, self.round, Card.Thief, Card.Thief)  # Thief used instead of a cheque.
+        if self._emit:
+            self._emit(TheftEvent(self._round, self._seats[initiator], list(cards_to_steal)))
         return Trigger.Turn
 
         # 1. Check that initiator has thieves and there are cards on board.
@@ -174,8 +310,9 @@ class Game:
         return max([p for p in self._players], key=lambda x: x.highest_cheque)
 
     def _play_one_turn(self, player):
-        action = player.player_agent.act(GameView(self, player, self._players, self._board))
-        logging.debug('{} chooses {}'.format(player.player_agent, action))
+        self._state_changed()
+        action = self._ask_act(player, self._game_view(player))
+        self._num_turns += 1
         if action == ActionType.Thief:
             return self._execute_thieves(player)
         elif action == ActionType.Draw:
@@ -187,33 +324,43 @@ class Game:
 
     def _score_round(self):
         nums_bodyguards = [player.num_bodyguards for player in self._players]
-        for player in self._players:
-            player.do_round_scoring(min(nums_bodyguards), max(nums_bodyguards))
+        for seat, player in enumerate(self._players):
+            round_scores = player.do_round_scoring(min(nums_bodyguards), max(nums_bodyguards))
+            if self._emit:
+                self._emit(RoundScoringEvent(self._round, seat, round_scores))
 
-    def _play_round(self, round_number):
-        logging.debug('-------')
-        logging.debug('Round {}'.format(round_number))
-        logging.debug('-------')
+    def _start_round(self):
         for player in self._players:
             player.refresh_cheques()
-        starting_player = self._determine_starting_player()
-        logging.debug('Starting player: {} has highest cheque ({}) and starts the Round.'.format(starting_player.player_agent, max(starting_player.available_cheques())))
-        consecutive_passes = 0
-        for player in self._round_order_generator.circling_from(starting_player):
-            if player.round_is_over:
-                logging.debug('Player agent {} passed (out of Round).'.format(player.player_agent))
-                consecutive_passes += 1
-                if consecutive_passes < self.num_players:
+        self._turn_player = self._determine_starting_player()
+        self._consecutive_passes = 0
+        if self._emit:
+            self._emit(RoundStartEvent(self._round, self._seats[self._turn_player]))
+
+    def _next_player(self, player):
+        return self._players[(self._seats[player] + 1) % len(self._players)]
+
+    def _play_round(self):
+        # Continues from the pending decision: an auction or a theft in progress, or the turn of "_turn_player".
+        while True:
+            if self._auction:
+                self._continue_auction()
+                trigger = Trigger.Turn
+            elif self._thief:
+                trigger = self._execute_thieves(self._thief)
+            else:
+                player = self._turn_player
+                if player.round_is_over:
+                    self._consecutive_passes += 1
+                    if self._consecutive_passes == self.num_players:
+                        break
+                    self._turn_player = self._next_player(player)
                     continue
-                else:
-                    logging.debug('All cheques have been used.')
-                    break
-            consecutive_passes = 0
-            trigger = self._play_one_turn(player)
-            #logging.debug(player)
-            #logging.debug(self._board)
+                self._consecutive_passes = 0
+                trigger = self._play_one_turn(player)
             if trigger == Trigger.Round:
                 break
+            self._turn_player = self._next_player(self._turn_player)
 
     def _is_game_end_valid(self):
         expected_cards = sum([c.how_many for c in Card])
@@ -227,7 +374,7 @@ class Game:
         num_cards = deck_cards + discarded_booty_cards + policemen + discarded_policemen + player_cards + player_scored_cards + player_removed_cards
         if num_cards != expected_cards:
             raise Exception('Unexpected number of cards at game end: expected {}, but had {}.'.format(expected_cards, num_cards))
-        counted_player_cards = sum(v for p in self._players for k, v in p._counts.items())
+        counted_player_cards = sum(p._counts.total() for p in self._players)
         counted_cards = deck_cards + discarded_booty_cards + policemen + discarded_policemen + counted_player_cards + player_scored_cards + player_removed_cards
         if counted_cards != expected_cards:
             raise Exception('Unexpected card counts at game end: expected {}, but had {}.'.format(expected_cards, counted_cards))
@@ -241,28 +388,68 @@ class Game:
         return {player.player_agent: player.get_final_scoring() for player in self._players}
 
     def play_game(self):
+        """Play from the current state to the end of the game."""
         if self._end:
             raise Exception('Game has already ended.')
-        logging.debug('===============================')
-        logging.debug('Starting Razzia! with {} players'.format(self.num_players))
-        logging.debug('===============================')
-        for r in range(1, GAME_ROUNDS + 1):
-            self._play_round(r)
+        if self._tracer and self._round == 1 and self._turn_player is None:
+            self._tracer.start_game([p.player_agent for p in self._players])
+        while self._round <= GAME_ROUNDS:
+            if self._turn_player is None:
+                self._start_round()
+            self._play_round()
             self._score_round()
+            self._turn_player = None
             self._advance_round()
         self._end = True
         self._score_game_end()
-        logging.debug('Game ends with {} cards in deck remaining.'.format(self._deck.size()))
-        logging.debug('==============')
-        logging.debug('Game has ended')
-        logging.debug('==============')
         self._is_game_end_valid()
         scorings = self._get_player_scorings()
+        if self._emit:
+            self._emit(GameEndEvent(self._round, -1, [s.final_score() for s in scorings.values()]))
         return scorings
 
+    def decisions(self):
+        """Play the game as a generator that yields a DecisionRequest per decision and returns the scorings.
+
+        The answer to each request is sent into the generator. Between requests the game rests at the
+        pending decision, so its views can be evaluated later, and many games can be interleaved.
+        Each answer restarts play_game, which unwinds to the pending decision and resumes there: for
+        cheap agents, stepping costs more than the decisions (batched play of trivial agents takes
+        about 2.5 times as long as play_game). While the generator rests, the game asks its agents
+        again, so a game whose generator is abandoned can still be finished by play_game.
+        Profiled games are rejected: the profiled phases would count the restarts, and the agents
+        would not be timed.
+        """
+        if self._profiler:
+            raise Exception('A profiled game cannot be played by decisions().')
+        return self._decisions()
+
+    def _decisions(self):
+        stepper = _Stepper()
+        while True:
+            self._ask_act, self._ask_bid, self._ask_steal = stepper.act, stepper.bid, stepper.steal
+            try:
+                return self.play_game()
+            except DecisionRequest as request:
+                pending = request
+            finally:
+                del self._ask_act, self._ask_bid, self._ask_steal  # back to the agents while the generator rests
+            stepper.answer = yield pending
+
+    def agent_random(self, player):
+        return self._rng.agent(self._streams[player])
+
     def auctioned_cards(self):
         return len(self._board.get_cards())
 
+    @property
+    def deck_size(self):
+        return self._deck.size()
+
+    @property
+    def num_turns(self):
+        return self._num_turns
+
     @property
     def num_players(self):
         return len(self._players)
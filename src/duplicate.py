@@ -0,0 +1,114 @@
+"""
+Duplicate deals: common random numbers for comparing agents.
+
+Like duplicate bridge, every candidate agent plays every deal of a DealBank from every seat
+against the same field of opponents, rotated so that the field agents also take every seat. The
+field agents keep their random streams across the games of a deal, and all candidates draw from
+one shared stream, so the games only differ where the candidates decide differently. Deal luck
+then cancels out of the per-deal paired differences between candidates, which need far fewer
+games than independent ones for the same confidence.
+"""
+
+import concurrent.futures
+import itertools
+import mmap
+
+from control import Game
+from randomness import GameRandom
+from pieces import Card, Deck
+from analytics import RunningStats
+from tournament import make_agent, confidence_interval
+
+
+DEAL_SIZE = sum(c.how_many for c in Card)
+CANDIDATE_STREAM = 'Candidate'  # Agent name, and so the random stream, shared by all candidates.
+CARDS_BY_ID = {c.id: c for c in Card}
+
+
+class DealBank:
+    """Deck orders as rows of card ids in a flat file, memory-mapped read-only; processes share it by path."""
+    @staticmethod
+    def generate(path, num_deals, seed):
+        with open(path, 'wb') as f:
+            for i in range(num_deals):
+                f.write(bytes(c.id for c in Deck(GameRandom(seed, i).deal).order()))
+        return DealBank(path)
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    def __len__(self):
+        return len(self._data) // DEAL_SIZE
+    def deck(self, deal_idx):
+        row = self._data[deal_idx * DEAL_SIZE:(deal_idx + 1) * DEAL_SIZE]
+        return Deck(None, [CARDS_BY_ID[i] for i in row])
+    def close(self):
+        self._data.close()
+
+
+def _play_deals(candidates, field, bank_path, seed, first_deal_idx, num_deals):
+    # Per deal, the mean score of every candidate over all seats.
+    bank = DealBank(bank_path)
+    candidate_agents = [make_agent(c._replace(name=CANDIDATE_STREAM)) for c in candidates]
+    field_agents = [make_agent(c) for c in field]
+    means = []
+    for d in range(first_deal_idx, first_deal_idx + num_deals):
+        deal_means = {}
+        for config, candidate in zip(candidates, candidate_agents):
+            total = 0
+            lineup = [candidate] + field_agents
+            for seat in range(len(lineup)):
+                seating = lineup[-seat:] + lineup[:-seat] if seat else lineup  # every agent takes every seat
+                game = Game(seating, GameRandom(seed, d), deck=bank.deck(d), streams_by_agent=True)
+                total += game.play_game()[candidate].final_score()
+            deal_means[config.name] = total / (len(field) + 1)
+        means.append(deal_means)
+    bank.close()
+    return means
+
+
+class DuplicateResult:
+    def __init__(self, deal_means):
+        self.deal_means = deal_means
+    def paired_difference(self, name_a, name_b):
+        """Mean per-deal score difference of agent "a" over agent "b", as a RunningStats."""
+        stats = RunningStats()
+        for means in self.deal_means:
+            stats.add(means[name_a] - means[name_b])
+        return stats
+    def report(self):
+        names = list(self.deal_means[0]) if self.deal_means else []
+        s_template = '{} - {}: {:+.2f} ± {:.2f} points per game over {} duplicate deals'
+        return '\n'.join(s_template.format(a, b, *confidence_interval(self.paired_difference(a, b)), len(self.deal_means))
+                         for a, b in itertools.combinations(names, 2))
+
+
+class DuplicateMatch:
+    """Plays the deals of a bank with each of "candidates" in every seat, against the "field" rotated through the other seats."""
+    def __init__(self, candidates, field, bank, seed=1, chunk_deals=50):
+        if len({c.name for c in candidates}) != len(candidates):
+            raise Exception('Candidate configuration names must be unique.')
+        if CANDIDATE_STREAM in {c.name for c in field} or len({c.name for c in field}) != len(field):
+            raise Exception('Field configuration names must be unique and differ from "{}".'.format(CANDIDATE_STREAM))
+        if not 2 <= len(field) + 1 <= 5:
+            raise Exception('Unsupported number of players: {}'.format(len(field) + 1))
+        self._candidates = list(candidates)
+        self._field = list(field)
+        self._bank_path = bank.path
+        self._num_deals = len(bank)
+        self._seed = seed
+        self._chunk_deals = chunk_deals
+    def run(self, num_deals=None, workers=1):
+        num_deals = self._num_deals if num_deals is None else num_deals
+        if not 0 < num_deals <= self._num_deals:
+            raise Exception('Number of deals must be between 1 and {}: {}'.format(self._num_deals, num_deals))
+        starts = range(0, num_deals, self._chunk_deals)
+        sizes = [min(self._chunk_deals, num_deals - start) for start in starts]
+        n = len(sizes)
+        args = (n * [self._candidates], n * [self._field], n * [self._bank_path], n * [self._seed], starts, sizes)
+        if workers == 1:
+            chunks = list(map(_play_deals, *args))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+                chunks = list(executor.map(_play_deals, *args))
+        return DuplicateResult([means for chunk in chunks for means in chunk])
@@ -0,0 +1,280 @@
+"""
+Exact endgame solver: expectimax over the rest of the last round.
+
+Chance nodes draw every card type left in the deck with its share of the deck, and decision nodes
+try every legal action and bid. The value of a position is the margin of the solving player over
+the best opponent, with the opponents assumed to minimize it. This paranoid model allows alpha-beta
+pruning at decision nodes and Star1 pruning at chance nodes.
+
+Positions are stepped with the game engine itself on clones, so the rules are not duplicated. The
+clones stop at the end of the round, where the final scores follow from the card counts and cheques.
+The transposition table is keyed by the abstract state: card counts and cheque masks of the players,
+the board, the deck counts, and the pending decision. Scores depend only on counts, so any two games
+in the same abstract state have the same future.
+"""
+
+import itertools
+import time
+
+from control import ActionType, GAME_ROUNDS
+from agent import PlayerAgent, TrivialPlayerAgent
+from randomness import GameRandom
+from pieces import Card
+from scoring import ExpectedScore
+
+
+DEFAULT_MAX_NODES = 10000  # About a second of solving.
+DEFAULT_MAX_ENTRIES = 2**18  # Transposition table entries; the table is cleared when full.
+DEFAULT_THRESHOLD = 9  # Endgame size at which EndgamePlayerAgent starts solving.
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class _Pending(Exception):
+    """Raised by a stepping agent: the game waits for the decision of "seat"."""
+    def __init__(self, kind, seat, is_mandated=False):
+        super().__init__(kind, seat)
+        self.kind = kind
+        self.seat = seat
+        self.is_mandated = is_mandated
+
+class _RoundOver(Exception):
+    pass
+
+class _OutOfBudget(Exception):
+    pass
+
+def _round_over():
+    raise _RoundOver()
+
+def _score_bounds(game, player):
+    # Card scores only grow with gained cards, apart from the bodyguard standing (-2 to +5) and spent thieves.
+    counts = player._counts
+    bodyguards = counts[Card.Bodyguard]
+    lowest = counts.copy()
+    lowest[Card.Thief] = 0
+    highest = counts.plus(game._deck._counts).plus(game._board._counts)
+    highest[Card.Policeman] = 0
+    past = player.get_final_scoring().final_score()
+    low = past + ExpectedScore.static_card_score(lowest, bodyguards, bodyguards + 1, 0) - 5
+    high = past + ExpectedScore.static_card_score(highest, highest[Card.Bodyguard], highest[Card.Bodyguard], 0) + 2 + 5
+    return low, high
+
+def _final_scores(game):
+    # Scores of the last round and the game end, from counts as Player.do_round_scoring and do_game_end_scoring would give.
+    players = game._players
+    bodyguards = [p.num_bodyguards for p in players]
+    money = [p.cheque_total for p in players]
+    min_bg, max_bg, min_money, max_money = min(bodyguards), max(bodyguards), min(money), max(money)
+    return [p.get_final_scoring().final_score() + ExpectedScore.static_card_score(p._counts, min_bg, max_bg, 0)
+            + (-5 if m == min_money else 0) + (5 if m == max_money else 0) for p, m in zip(players, money)]
+
+
+class _StepAgent(PlayerAgent):
+    """Gives the forced answers, then pauses the game at the next decision."""
+    def __init__(self, name):
+        super().__init__(name)
+        self.forced = []
+    def act(self, game_view):
+        if self.forced:
+            return self.forced.pop(0)
+        raise _Pending('act', game_view.seat)
+    def bid(self, game_view, auction_view, player_view, is_mandated):
+        if self.forced:
+            return self.forced.pop(0)
+        raise _Pending('bid', game_view.seat, is_mandated)
+    def steal(self, game_view):
+        return list(self.forced.pop(0))
+
+
+def endgame_size(game_view):
+    """Cheques left to bid and cards left to draw, or None before the last round."""
+    if game_view.rounds_remaining:
+        return None
+    return sum(len(p.available_cheques()) for p in game_view.get_all_player_views()) + game_view.deck_size
+
+
+class EndgameSolver:
+    """Solves the last round within "max_nodes" nodes and "time_budget" seconds, if given.
+
+    The transposition table is kept between solves, up to "max_entries" entries.
+    """
+    def __init__(self, max_nodes=DEFAULT_MAX_NODES, time_budget=None, max_entries=DEFAULT_MAX_ENTRIES):
+        self._max_nodes = max_nodes
+        self._time_budget = time_budget
+        self._max_entries = max_entries
+        self._table = {}
+        self._rng = GameRandom(0)  # the deck order of clones is never used: draws are placed on top
+        self._agents = {}
+        self.num_nodes = 0
+
+    def solve(self, game_view):
+        """Value and decision for the active player, or None when the budget runs out first."""
+        if game_view.rounds_remaining:
+            raise Exception('Endgame solver only covers round {}.'.format(GAME_ROUNDS))
+        seat = game_view.seat
+        num_players = len(game_view.get_all_player_views())
+        self._seat = seat
+        self._steppers = self._agents.setdefault(num_players, [_StepAgent('Endgame {}'.format(i + 1)) for i in range(num_players)])
+        self._nodes = 0
+        self._deadline = time.perf_counter() + self._time_budget if self._time_budget else None
+        game = game_view.sample_game(self._steppers, self._rng)
+        game._score_round = _round_over
+        # Bounds of the margin over the rest of the game, for Star1 pruning.
+        bounds = [_score_bounds(game, p) for p in game._players]
+        own = bounds.pop(seat)
+        self._lower = own[0] - max(high for _, high in bounds)
+        self._upper = own[1] - max(low for low, _ in bounds)
+        pending = self._advance(game, seat, [])
+        try:
+            value, decision = self._decide(game, pending, self._lower, self._upper, True)
+        except _OutOfBudget:
+            return None
+        finally:
+            self.num_nodes += self._nodes
+        return value, decision
+
+    def _advance(self, game, seat, forced):
+        # Plays the forced answers of "seat" and returns the next pending decision, or the final margin.
+        self._steppers[seat].forced = list(forced)
+        try:
+            game.play_game()
+        except _Pending as pending:
+            return pending
+        except _RoundOver:
+            pass
+        finally:
+            self._steppers[seat].forced = []
+        scores = _final_scores(game)
+        own = scores.pop(self._seat)
+        return own - max(scores)
+
+    def _key(self, game, pending):
+        seats = game._seats
+        players = tuple((p.get_final_scoring().final_score(), tuple(p._counts), p.available_cheque_mask, p.unavailable_cheque_mask)
+                        for p in game._players)
+        auction = game._auction
+        if auction:
+            bidder = seats[auction.highest_bidder] if auction.highest_bidder else None
+            auction = (auction.auction_mode, seats[auction.initiator], auction.highest_bid, bidder, tuple(seats[b] for b in game._bidders))
+        board = game._board
+        return (self._seat, pending.kind, pending.seat, game._consecutive_passes, players,
+                tuple(board._counts), board.num_policemen, board.cheque, tuple(game._deck._counts), auction)
+
+    def _candidates(self, game, pending):
+        player = game._players[pending.seat]
+        if pending.kind == 'bid':
+            top = game._auction.highest_bid
+            cheques = [c for c in player.available_cheques() if not top or top < c]
+            return [(c,) for c in cheques] if pending.is_mandated else [(None,)] + [(c,) for c in cheques]
+        candidates = [(ActionType.Draw,)] if game.deck_size else []
+        candidates.append((ActionType.AuctionByPlayer,))
+        board_counts = game._board._counts
+        board_cards = [c for c in Card for _ in range(board_counts[c])]
+        for n in range(1, min(player.num_thieves, len(board_cards)) + 1):
+            candidates.extend((ActionType.Thief, cards) for cards in dict.fromkeys(itertools.combinations(board_cards, n)))
+        return candidates
+
+    def _clone(self, game):
+        clone = game.clone(self._steppers, self._rng)
+        clone._score_round = _round_over
+        return clone
+
+    def _search(self, node, alpha, beta):
+        if not isinstance(node[1], _Pending):
+            return node[1]  # final margin
+        return self._decide(*node, alpha, beta, False)[0]
+
+    def _decide(self, game, pending, alpha, beta, is_root):
+        self._nodes += 1
+        if self._nodes > self._max_nodes or (self._deadline and not self._nodes % 64 and time.perf_counter() > self._deadline):
+            raise _OutOfBudget()
+        key = self._key(game, pending)
+        entry = self._table.get(key)
+        if entry and not is_root:
+            value, flag = entry
+            if flag == EXACT or (flag == LOWER and value >= beta) or (flag == UPPER and value <= alpha):
+                return value, None
+        is_max = pending.seat == self._seat
+        alpha0, beta0 = alpha, beta
+        best, best_decision = None, None
+        for forced in self._candidates(game, pending):
+            if forced[0] == ActionType.Draw:
+                value = self._chance(game, pending.seat, alpha, beta)
+            else:
+                child = self._clone(game)
+                value = self._search((child, self._advance(child, pending.seat, forced)), alpha, beta)
+            if best is None or (value > best if is_max else value < best):
+                best, best_decision = value, forced
+            if is_max:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                break
+        flag = UPPER if best <= alpha0 else LOWER if best >= beta0 else EXACT
+        if len(self._table) >= self._max_entries:
+            self._table.clear()
+        self._table[key] = (best, flag)
+        return best, best_decision
+
+    def _chance(self, game, seat, alpha, beta):
+        # Star1: the children are searched with windows that could still move the expectation out of (alpha, beta).
+        counts = game._deck._counts
+        size = game.deck_size
+        draws = sorted((c for c in Card if counts[c]), key=lambda c: -counts[c])
+        expected, remaining = 0.0, 1.0
+        for card in draws:
+            p = counts[card] / size
+            remaining -= p
+            child_alpha = max(self._lower, (alpha - expected - self._upper * remaining) / p)
+            child_beta = min(self._upper, (beta - expected - self._lower * remaining) / p)
+            child = self._clone(game)
+            cards = child._deck._cards
+            cards.append(cards.pop(len(cards) - 1 - cards[::-1].index(card)))  # "card" is drawn next
+            value = self._search((child, self._advance(child, seat, [ActionType.Draw])), child_alpha, child_beta)
+            if value <= child_alpha:
+                return expected + p * value + self._upper * remaining  # upper bound, at most alpha
+            if value >= child_beta:
+                return expected + p * value + self._lower * remaining  # lower bound, at least beta
+            expected += p * value
+        return expected
+
+
+class EndgamePlayerAgent(PlayerAgent):
+    """Plays exactly once the endgame size is at most "threshold", and as "fallback" before that or over budget."""
+    def __init__(self, name, threshold=DEFAULT_THRESHOLD, max_nodes=DEFAULT_MAX_NODES, time_budget=None, fallback=None):
+        super().__init__(name)
+        self._threshold = threshold
+        self._solver = EndgameSolver(max_nodes, time_budget)
+        self._fallback = fallback if fallback else TrivialPlayerAgent(name)
+        self._stolen = None
+        self.num_solved = 0
+        self.num_unsolved = 0
+
+    def _solve(self, game_view):
+        size = endgame_size(game_view)
+        if size is None or size > self._threshold:
+            return None
+        solution = self._solver.solve(game_view)
+        if solution is None:
+            self.num_unsolved += 1
+            return None
+        self.num_solved += 1
+        return solution[1]
+
+    def act(self, game_view):
+        decision = self._solve(game_view)
+        if decision is None:
+            return self._fallback.act(game_view)
+        self._stolen = decision[1] if len(decision) > 1 else None
+        return decision[0]
+    def bid(self, game_view, auction_view, player_view, is_mandated):
+        decision = self._solve(game_view)
+        if decision is None:
+            return self._fallback.bid(game_view, auction_view, player_view, is_mandated)
+        return decision[0]
+    def steal(self, game_view):
+        if self._stolen:
+            stolen, self._stolen = self._stolen, None
+            return list(stolen)
+        return self._fallback.steal(game_view)
@@ -0,0 +1,236 @@
+"""
+Structured event stream of the game engine.
+
+The engine builds an event only when a tracer is attached, so an untraced game pays a
+single attribute test per emission point. Sinks receive the typed events and decide
+what to do with them: log them, record them compactly, or just count them.
+"""
+
+from collections import Counter, namedtuple
+from enum import Enum
+import logging
+import struct
+
+from pieces import Card, Cheque
+from auction import AuctionMode
+from scoring import Score
+
+
+class EventType(Enum):
+    RoundStart=1
+    Draw=2
+    Policeman=3
+    AuctionStart=4
+    Bid=5
+    Pass=6
+    Win=7
+    Theft=8
+    RoundScoring=9
+    GameEnd=10
+
+
+class PassReason(Enum):
+    NoCheques=1
+    CannotOutbid=2
+    Deliberate=3
+
+
+# Every event carries the round and the seat of the player concerned (-1 for none).
+RoundStartEvent = namedtuple('RoundStartEvent', 'round seat')
+DrawEvent = namedtuple('DrawEvent', 'round seat card')
+PolicemanEvent = namedtuple('PolicemanEvent', 'round seat num_policemen round_end discarded')
+AuctionStartEvent = namedtuple('AuctionStartEvent', 'round seat mode cards')
+BidEvent = namedtuple('BidEvent', 'round seat cheque')
+PassEvent = namedtuple('PassEvent', 'round seat reason')
+WinEvent = namedtuple('WinEvent', 'round seat paid gained cards')
+TheftEvent = namedtuple('TheftEvent', 'round seat cards')
+RoundScoringEvent = namedtuple('RoundScoringEvent', 'round seat scores')
+GameEndEvent = namedtuple('GameEndEvent', 'round seat scores')
+
+EVENT_CLASSES = {
+    EventType.RoundStart: RoundStartEvent,
+    EventType.Draw: DrawEvent,
+    EventType.Policeman: PolicemanEvent,
+    EventType.AuctionStart: AuctionStartEvent,
+    EventType.Bid: BidEvent,
+    EventType.Pass: PassEvent,
+    EventType.Win: WinEvent,
+    EventType.Theft: TheftEvent,
+    EventType.RoundScoring: RoundScoringEvent,
+    EventType.GameEnd: GameEndEvent,
+}
+EVENT_TYPES = {cls: t for t, cls in EVENT_CLASSES.items()}
+
+
+class Tracer:
+    """Fans events out to the attached sinks."""
+    def __init__(self, sinks=()):
+        self._sinks = list(sinks)
+    def attach(self, sink):
+        self._sinks.append(sink)
+    def detach(self, sink):
+        self._sinks.remove(sink)
+    def emit(self, event):
+        for sink in self._sinks:
+            sink.handle(event)
+    def start_game(self, player_agents):
+        for sink in self._sinks:
+            sink.start_game(player_agents)
+
+
+class Sink:
+    def start_game(self, player_agents):
+        pass
+    def handle(self, event):
+        raise NotImplementedError('Implement "handle()" in derived class.')
+
+
+class CounterSink(Sink):
+    """Counts events by type, over any number of games."""
+    def __init__(self):
+        self.counts = Counter()
+    def handle(self, event):
+        self.counts[EVENT_TYPES[type(event)]] += 1
+
+
+class LoggingSink(Sink):
+    """Human-readable game log."""
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self._logger = logger if logger else logging.getLogger()
+        self._level = level
+        self._names = []
+    def start_game(self, player_agents):
+        self._names = [str(a) for a in player_agents]
+        self._log('===============================')
+        self._log('Starting Razzia! with {} players'.format(len(player_agents)))
+        self._log('===============================')
+    def _log(self, msg):
+        self._logger.log(self._level, msg)
+    def handle(self, event):
+        name = self._names[event.seat] if 0 <= event.seat < len(self._names) else None
+        t = EVENT_TYPES[type(event)]
+        if t == EventType.RoundStart:
+            self._log('-------')
+            self._log('Round {}'.format(event.round))
+            self._log('-------')
+            self._log('Starting player: {} has the highest cheque and starts the Round.'.format(name))
+        elif t == EventType.Draw:
+            self._log('Player agent {} DRAWs a card: {}'.format(name, event.card))
+        elif t == EventType.Policeman:
+            self._log('  added policeman (total {})'.format(event.num_policemen))
+            if event.round_end:
+                self._log('Policemen limit reached.')
+                self._log('Discarding {} cards from board: {}'.format(len(event.discarded), ', '.join(str(c) for c in event.discarded)))
+        elif t == EventType.AuctionStart:
+            self._log('Starting an Auction ({}) by {} for: {}'.format(event.mode.name, name, ', '.join(str(c) for c in event.cards)))
+        elif t == EventType.Bid:
+            self._log('  {} BIDs with cheque {}.'.format(name, event.cheque))
+        elif t == EventType.Pass:
+            self._log('  {} PASSes bid ({}).'.format(name, event.reason.name))
+        elif t == EventType.Win:
+            self._log('  {} wins the auction:'.format(name))
+            self._log('    loses cheque {}'.format(event.paid))
+            self._log('    gains cheque {} (as unavailable)'.format(event.gained))
+            self._log('    gains cards: {}'.format(', '.join(c.name for c in event.cards)))
+        elif t == EventType.Theft:
+            self._log('Player agent {} STEALs cards with thieves: {}'.format(name, ', '.join(c.name for c in event.cards)))
+        elif t == EventType.RoundScoring:
+            self._log('  Round scoring for {}: {}'.format(name, ', '.join('{}({:+})'.format(s.name, v) for s, v in event.scores.items())))
+        elif t == EventType.GameEnd:
+            self._log('Game has ended: ' + ', '.join('"{}" = {}'.format(n, s) for n, s in zip(self._names, event.scores)))
+
+
+##
+## Compact binary encoding: a header of (type, round, seat) followed by the fields of the event.
+##
+
+_HEADER = struct.Struct('<BBb')
+_CARDS_BY_ID = {c.id: c for c in Card}
+_CHEQUES_BY_VALUE = {c.value: c for c in Cheque}
+_FIELD_CODECS = {
+    EventType.RoundStart: (),
+    EventType.Draw: ('card',),
+    EventType.Policeman: ('int', 'bool', 'cards'),
+    EventType.AuctionStart: ('mode', 'cards'),
+    EventType.Bid: ('cheque',),
+    EventType.Pass: ('reason',),
+    EventType.Win: ('cheque', 'cheque', 'cards'),
+    EventType.Theft: ('cards',),
+    EventType.RoundScoring: ('scores',),
+    EventType.GameEnd: ('totals',),
+}
+
+
+def _encode_field(codec, value, out):
+    if codec == 'card':
+        out.append(value.id)
+    elif codec == 'cheque':
+        out.append(value.value)
+    elif codec in ('mode', 'reason'):
+        out.append(value.value)
+    elif codec in ('int', 'bool'):
+        out.append(int(value))
+    elif codec == 'cards':
+        out.append(len(value))
+        out.extend(c.id for c in value)
+    elif codec == 'scores':
+        out.append(len(value))
+        for score, points in value.items():
+            out.extend(struct.pack('<Bb', score.value, points))
+    elif codec == 'totals':
+        out.append(len(value))
+        out.extend(struct.pack('<{}h'.format(len(value)), *value))
+
+def _decode_field(codec, data, pos):
+    if codec == 'card':
+        return _CARDS_BY_ID[data[pos]], pos + 1
+    elif codec == 'cheque':
+        return _CHEQUES_BY_VALUE[data[pos]], pos + 1
+    elif codec == 'mode':
+        return AuctionMode(data[pos]), pos + 1
+    elif codec == 'reason':
+        return PassReason(data[pos]), pos + 1
+    elif codec == 'int':
+        return data[pos], pos + 1
+    elif codec == 'bool':
+        return bool(data[pos]), pos + 1
+    elif codec == 'cards':
+        n = data[pos]
+        return [_CARDS_BY_ID[i] for i in data[pos + 1:pos + 1 + n]], pos + 1 + n
+    elif codec == 'scores':
+        n = data[pos]
+        pairs = struct.unpack_from('<{}'.format('Bb' * n), data, pos + 1)
+        return {Score(pairs[i]): pairs[i + 1] for i in range(0, 2 * n, 2)}, pos + 1 + 2 * n
+    elif codec == 'totals':
+        n = data[pos]
+        return list(struct.unpack_from('<{}h'.format(n), data, pos + 1)), pos + 1 + 2 * n
+
+def encode_event(event, out):
+    t = EVENT_TYPES[type(event)]
+    out.extend(_HEADER.pack(t.value, event.round, event.seat))
+    for codec, value in zip(_FIELD_CODECS[t], event[2:]):
+        _encode_field(codec, value, out)
+
+def decode_events(data):
+    pos = 0
+    while pos < len(data):
+        type_value, round, seat = _HEADER.unpack_from(data, pos)
+        pos += _HEADER.size
+        t = EventType(type_value)
+        fields = []
+        for codec in _FIELD_CODECS[t]:
+            value, pos = _decode_field(codec, data, pos)
+            fields.append(value)
+        yield EVENT_CLASSES[t](round, seat, *fields)
+
+
+class BinaryRecorderSink(Sink):
+    """Records events in a compact byte string; "decode_events" turns it back into events."""
+    def __init__(self):
+        self._data = bytearray()
+    def handle(self, event):
+        encode_event(event, self._data)
+    def getvalue(self):
+        return bytes(self._data)
+    def clear(self):
+        self._data = bytearray()
@@ -0,0 +1,163 @@
+"""
+Decision latency tracking for agents.
+
+LatencyTrackingAgent wraps any agent and records the latency of each act, bid and steal call in
+log-bucketed histograms, in the manner of HdrHistogram: values keep about two significant digits
+of precision over any range, counts are sparse, and histograms merge by adding bucket counts.
+With a deadline, decisions run on a worker thread, on a forked view: a private copy of the game with
+its own copies of the random streams. An overrunning call is abandoned (Python threads cannot be
+interrupted) and the fallback agent decides instead on the live view, so the abandoned call cannot
+race the game. A call that finishes in time hands its random stream state back, so seeded games
+play as without a deadline. At most MAX_ABANDONED_CALLS abandoned calls are left running at once;
+while that many still run, the fallback decides without asking the agent.
+"""
+
+import concurrent.futures
+import json
+import time
+
+from agent import PlayerAgent, TrivialPlayerAgent
+
+
+SUB_BUCKET_BITS = 7  # 2**7 linear sub-buckets per power of two: under 1.6% relative error.
+DECISIONS = ('act', 'bid', 'steal')
+MAX_ABANDONED_CALLS = 4  # Threads left behind by overrunning calls, at most.
+
+
+def _bucket_index(value):
+    e = value.bit_length() - SUB_BUCKET_BITS
+    if e <= 0:
+        return value
+    half = 1 << (SUB_BUCKET_BITS - 1)
+    return (1 << SUB_BUCKET_BITS) + (e - 1) * half + (value >> e) - half
+
+def _bucket_bounds(index):
+    full = 1 << SUB_BUCKET_BITS
+    if index < full:
+        return index, index
+    half = full >> 1
+    e = (index - full) // half + 1
+    mantissa = (index - full) % half + half
+    return mantissa << e, ((mantissa + 1) << e) - 1
+
+
+class LatencyHistogram:
+    """Latencies in whole microseconds."""
+    def __init__(self):
+        self._counts = {}
+        self.count = 0
+        self.min = None
+        self.max = 0
+    def record(self, seconds):
+        us = int(seconds * 1e6)
+        i = _bucket_index(us)
+        self._counts[i] = self._counts.get(i, 0) + 1
+        self.count += 1
+        self.min = us if self.min is None else min(self.min, us)
+        self.max = max(self.max, us)
+    def merge(self, other):
+        for i, n in other._counts.items():
+            self._counts[i] = self._counts.get(i, 0) + n
+        self.count += other.count
+        if other.min is not None:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+    def percentile(self, p):
+        """Upper bound of the bucket holding the "p"th percentile, never above the maximum."""
+        if not self.count:
+            return 0
+        rank = max(1, round(p / 100 * self.count))
+        seen = 0
+        for i in sorted(self._counts):
+            seen += self._counts[i]
+            if seen >= rank:
+                return min(_bucket_bounds(i)[1], self.max)
+        return self.max
+    def to_dict(self):
+        return {
+            'count': self.count, 'min_us': self.min, 'p50_us': self.percentile(50), 'p99_us': self.percentile(99), 'max_us': self.max,
+            'buckets': {str(i): n for i, n in sorted(self._counts.items())},
+        }
+    @staticmethod
+    def from_dict(d):
+        h = LatencyHistogram()
+        h._counts = {int(i): n for i, n in d['buckets'].items()}
+        h.count, h.min, h.max = d['count'], d['min_us'], d['max_us']
+        return h
+
+
+class LatencyTrackingAgent(PlayerAgent):
+    """Wraps "agent"; with a "deadline" in seconds, "fallback" decides when the agent overruns it."""
+    def __init__(self, agent, deadline=None, fallback=None, max_abandoned=MAX_ABANDONED_CALLS):
+        super().__init__(agent.name)
+        self.agent = agent
+        self._deadline = deadline
+        self._fallback = fallback if fallback else TrivialPlayerAgent(agent.name)
+        self._max_abandoned = max_abandoned
+        self._executor = None
+        self._abandoned = []  # futures of the overrunning calls still running
+        self.histograms = {d: LatencyHistogram() for d in DECISIONS}
+        self.overruns = {d: 0 for d in DECISIONS}
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['_executor'] = None  # threads do not cross process boundaries
+        state['_abandoned'] = []
+        return state
+
+    def _decide_in_time(self, decision, game_view, fork_args):
+        # The decision of the agent as a 1-tuple, or None if it overran or too many overrunning calls still run.
+        self._abandoned = [f for f in self._abandoned if not f.done()]
+        if len(self._abandoned) >= self._max_abandoned:
+            return None
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        forked_view = game_view.fork()
+        start = time.perf_counter()
+        future = self._executor.submit(getattr(self.agent, decision), *fork_args(forked_view))
+        try:
+            result = future.result(timeout=self._deadline)
+        except concurrent.futures.TimeoutError:
+            self._executor.shutdown(wait=False)  # leave the overrunning call behind, on its forked view
+            self._executor = None
+            self._abandoned.append(future)
+            return None
+        if time.perf_counter() - start > self._deadline:
+            return None  # finished late, while this thread was waiting for its turn to run
+        game_view.random.setstate(forked_view.random.getstate())
+        return result,
+
+    def _decide(self, decision, args, fork_args):
+        start = time.perf_counter()
+        if self._deadline is None:
+            result = getattr(self.agent, decision)(*args)
+        else:
+            decided = self._decide_in_time(decision, args[0], fork_args)
+            if decided is None:
+                self.overruns[decision] += 1
+                result = getattr(self._fallback, decision)(*args)
+            else:
+                result = decided[0]
+        self.histograms[decision].record(time.perf_counter() - start)
+        return result
+
+    def act(self, game_view):
+        return self._decide('act', (game_view,), lambda forked: (forked,))
+    def bid(self, game_view, auction_view, player_view, is_mandated):
+        return self._decide('bid', (game_view, auction_view, player_view, is_mandated),
+                            lambda forked: (forked, forked.get_auction_view(), forked.get_active_player_view(), is_mandated))
+    def steal(self, game_view):
+        return self._decide('steal', (game_view,), lambda forked: (forked,))
+
+    def summary(self):
+        s_template = '{} {:5s}: {:7d} decisions, p50 {:8d} us, p99 {:8d} us, max {:8d} us, {} overruns'
+        return '\n'.join(s_template.format(self.name, d, h.count, h.percentile(50), h.percentile(99), h.max, self.overruns[d])
+                         for d, h in self.histograms.items() if h.count)
+
+
+def dump_histograms(agents, path):
+    """Write the histograms of the latency-tracking agents to a JSON file."""
+    data = {a.name: {d: dict(h.to_dict(), overruns=a.overruns[d]) for d, h in a.histograms.items()}
+            for a in agents if isinstance(a, LatencyTrackingAgent)}
+    with open(path, 'w') as f:
+        json.dump(data, f, indent=2)
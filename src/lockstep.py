@@ -0,0 +1,175 @@
+"""
+Lockstep engine: plays a batch of games at once as NumPy array operations.
+
+Only the stochastic baseline policy is supported: every player always draws, and bids with a
+probability looked up by the number of auctioned cards, using the lowest cheque that outbids.
+This is the behaviour of TrivialPlayerAgent, so the scores follow the same distribution as
+games played by control.Game with trivial agents.
+"""
+
+import numpy as np
+
+import control
+from pieces import Card, Cheque, TRINKET_CARDS, BUSINESS_CARDS, REMOVABLE_CARDS, NUM_CARD_TYPES
+from pieces import CHEQUE_STARTING, CHEQUES_FOR_2, CHEQUES_FOR_3, CHEQUES_FOR_4, CHEQUES_FOR_5
+from scoring import Score
+from agent import TrivialPlayerAgent
+
+
+_MASKS = np.arange(1 << len(Cheque))
+_HIGHEST = np.zeros(len(_MASKS), dtype=np.int64)  # highest cheque value of a mask (0 if empty)
+_LOWEST = np.zeros(len(_MASKS), dtype=np.int64)  # lowest cheque value of a mask (0 if empty)
+_TOTAL = np.zeros(len(_MASKS), dtype=np.int64)  # total cheque value of a mask
+for _c in reversed(Cheque):
+    _has = (_MASKS & _c.bit) != 0
+    _LOWEST[_has] = _c.value
+    _TOTAL[_has] += _c.value
+for _c in Cheque:
+    _HIGHEST[(_MASKS & _c.bit) != 0] = _c.value
+
+_TRINKET_SCORES = np.array([-5, 0, 0, 5, 10, 15])
+_TRINKETS = [c.idx for c in TRINKET_CARDS]
+_BUSINESSES = [c.idx for c in BUSINESS_CARDS]
+_REMOVABLE = [c.idx for c in REMOVABLE_CARDS]
+_DECK = np.array([c.idx for c in Card for _ in range(c.how_many)])
+_STARTING_CHEQUES = {2: CHEQUES_FOR_2, 3: CHEQUES_FOR_3, 4: CHEQUES_FOR_4, 5: CHEQUES_FOR_5}
+_SCORE_IDX = {s: i for i, s in enumerate(Score)}
+
+
+def _bit(values):
+    return np.left_shift(1, values - 1)
+
+
+class LockstepGames:
+    def __init__(self, num_players, num_games, seed=None, bid_probs=None):
+        if not 2 <= num_players <= 5:
+            raise Exception('Unsupported number of players: {}'.format(num_players))
+        probs = bid_probs if bid_probs is not None else TrivialPlayerAgent.BID_PROBS
+        self._bid_probs = np.array([probs[n] for n in range(control.AUTOMATIC_AUCTION_NUM_CARDS + 1)])
+        self._rng = np.random.default_rng(seed)
+        self._n = num_players
+        self._k = num_games
+        self._round_end_policemen = control.ROUND_END_POLICEMEN if num_players > 2 else control.ROUND_END_POLICEMEN_TWOPLAYER
+        k, n = num_games, num_players
+        # Deck order: cards are drawn from position 0 onwards.
+        self._deck = _DECK[self._rng.random((k, len(_DECK))).argsort(axis=1)]
+        self._drawn = np.zeros(k, dtype=np.int64)
+        self._board = np.zeros((k, NUM_CARD_TYPES), dtype=np.int64)
+        self._board_cards = np.zeros(k, dtype=np.int64)
+        self._policemen = np.zeros(k, dtype=np.int64)
+        self._board_cheque = np.full(k, CHEQUE_STARTING.value)
+        start_masks = [sum(c.bit for c in cheques) for cheques in _STARTING_CHEQUES[n]]
+        self._available = np.tile(np.array(start_masks, dtype=np.int64), (k, 1))
+        self._unavailable = np.zeros((k, n), dtype=np.int64)
+        self._counts = np.zeros((k, n, NUM_CARD_TYPES), dtype=np.int64)
+        self._scores = np.zeros((k, n, len(Score)), dtype=np.int64)
+        self._round = np.ones(k, dtype=np.int64)
+        self._current = np.zeros(k, dtype=np.int64)
+        self._passes = np.zeros(k, dtype=np.int64)
+        self._done = np.zeros(k, dtype=bool)
+        self._start_round(np.arange(k))
+
+    def _start_round(self, g):
+        self._available[g] |= self._unavailable[g]
+        self._unavailable[g] = 0
+        self._current[g] = _HIGHEST[self._available[g]].argmax(axis=1)
+        self._passes[g] = 0
+
+    def _auction(self, g, initiator):
+        top = np.zeros(len(g), dtype=np.int64)
+        winner = np.full(len(g), -1)
+        prob = self._bid_probs[self._board_cards[g]]
+        for offset in range(1, self._n + 1):
+            bidder = (initiator + offset) % self._n
+            mask = self._available[g, bidder]
+            can_bid = _HIGHEST[mask] > top  # also excludes players out of cheques
+            willing = can_bid & (self._rng.random(len(g)) < prob)
+            bid = _LOWEST[mask >> top << top]
+            top = np.where(willing, bid, top)
+            winner = np.where(willing, bidder, winner)
+        won = winner >= 0
+        gw, w, bid = g[won], winner[won], top[won]
+        self._counts[gw, w] += self._board[gw]
+        self._available[gw, w] ^= _bit(bid)
+        self._unavailable[gw, w] |= _bit(self._board_cheque[gw])
+        self._board_cheque[gw] = bid
+        self._board[gw] = 0
+        self._board_cards[gw] = 0
+
+    def _score_rounds(self, g):
+        counts = self._counts[g]
+        scores = self._scores[g]
+        bodyguards = counts[:, :, Card.Bodyguard.idx]
+        lowest = bodyguards == bodyguards.min(axis=1, keepdims=True)
+        highest = bodyguards == bodyguards.max(axis=1, keepdims=True)
+        has_driver = counts[:, :, Card.Driver.idx] > 0
+        scores[:, :, _SCORE_IDX[Score.GoldCoins]] += 3 * counts[:, :, Card.GoldCoin.idx]
+        scores[:, :, _SCORE_IDX[Score.Thieves]] += 2 * counts[:, :, Card.Thief.idx]
+        scores[:, :, _SCORE_IDX[Score.Trinkets]] += _TRINKET_SCORES[(counts[:, :, _TRINKETS] > 0).sum(axis=2)]
+        scores[:, :, _SCORE_IDX[Score.Bodyguards]] += 5 * highest - 2 * lowest
+        scores[:, :, _SCORE_IDX[Score.Cars]] += counts[:, :, Card.Car.idx] * has_driver
+        scores[:, :, _SCORE_IDX[Score.Drivers]] += counts[:, :, Card.Driver.idx]
+        counts[:, :, _REMOVABLE] = 0
+        self._scores[g] = scores
+        self._counts[g] = counts
+
+    def _score_game_end(self, g):
+        counts = self._counts[g][:, :, _BUSINESSES]
+        unique = (counts > 0).sum(axis=2)
+        multi = np.where(counts >= 3, 5 * (counts - 2), 0).sum(axis=2)
+        self._scores[g, :, _SCORE_IDX[Score.Businesses]] += unique + 3 * (unique == len(_BUSINESSES)) + multi
+        money = _TOTAL[self._available[g] | self._unavailable[g]]
+        lowest = money == money.min(axis=1, keepdims=True)
+        highest = money == money.max(axis=1, keepdims=True)
+        self._scores[g, :, _SCORE_IDX[Score.Cheques]] += 5 * highest - 5 * lowest
+
+    def _end_rounds(self, g):
+        self._score_rounds(g)
+        self._round[g] += 1
+        over = self._round[g] > control.GAME_ROUNDS
+        self._done[g[over]] = True
+        self._score_game_end(g[over])
+        self._start_round(g[~over])
+
+    def _step(self):
+        g = np.flatnonzero(~self._done)
+        player = self._current[g]
+        out = self._available[g, player] == 0
+        self._passes[g[out]] += 1
+        all_out = g[out][self._passes[g[out]] >= self._n]
+        g, player = g[~out], player[~out]
+        self._passes[g] = 0
+        card = self._deck[g, self._drawn[g]]
+        self._drawn[g] += 1
+
+        police = card == Card.Policeman.idx
+        gp, pp = g[police], player[police]
+        self._policemen[gp] += 1
+        limit = self._policemen[gp] == self._round_end_policemen
+        round_end = gp[limit]
+        self._board[round_end] = 0
+        self._board_cards[round_end] = 0
+        self._policemen[round_end] = 0
+        self._auction(gp[~limit], pp[~limit])
+
+        gb, pb = g[~police], player[~police]
+        self._board[gb, card[~police]] += 1
+        self._board_cards[gb] += 1
+        full = self._board_cards[gb] == control.AUTOMATIC_AUCTION_NUM_CARDS
+        gf = gb[full]
+        self._auction(gf, pb[full])
+        self._board[gf] = 0  # booty is discarded if nobody won the full board
+        self._board_cards[gf] = 0
+
+        self._current[~self._done] = (self._current[~self._done] + 1) % self._n
+        self._end_rounds(np.concatenate([all_out, round_end]))
+
+    def play(self):
+        """Play all games to the end and return scores shaped (games, players, Score)."""
+        while not self._done.all():
+            self._step()
+        return self._scores
+
+    @property
+    def num_games(self):
+        return self._k
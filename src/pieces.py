@@ -1,27 +1,39 @@
 from enum import Enum
-import random
 
 class Board:
     def __init__(self, starting_cheque):
         self._cheque = starting_cheque
         self._cards = []
+        self._counts = CardCounts()
         self._num_policemen = 0
         self._discarded_booty = []
         self._num_discarded_policemen = 0
+    def copy(self):
+        board = Board(self._cheque)
+        board._cards = self._cards[:]
+        board._counts = self._counts.copy()
+        board._num_policemen = self._num_policemen
+        board._discarded_booty = self._discarded_booty[:]
+        board._num_discarded_policemen = self._num_discarded_policemen
+        return board
 
     def add_card(self, card):
         self._cards.append(card)
+        self._counts[card] += 1
     def take_all_booty_cards(self):
         taken = self._cards
         self._cards = []
+        self._counts = CardCounts()
         return taken
     def take_booty_cards(self, cards_to_take):
         for c in cards_to_take:
             self._cards.remove(c)
+            self._counts[c] -= 1
         return cards_to_take
     def discard_booty_cards(self):
         self._discarded_booty.extend(self._cards)
         self._cards = []
+        self._counts = CardCounts()
     def add_policeman(self):
         self._num_policemen += 1
     def discard_policemen(self):
@@ -34,10 +46,9 @@ class Board:
     def get_cards(self):
         return self._cards[:]  # copy
     def get_card_counts(self):
-        counts = {c: 0 for c in Card if c != Card.Policeman}
-        for c in self._cards:
-            counts[c] += 1
-        return counts
+        return self._counts.copy()
+    def frozen_card_counts(self):
+        return FrozenCardCounts(self._counts)
     @property
     def num_cards(self):
         return len(self._cards)
@@ -59,23 +70,38 @@ class Board:
 
 
 class Deck:
-    def __init__(self):
-        counts = {c : c.how_many for c in Card}
-        batches = [[c] * c.how_many for c in Card]
-        cards = [c for sublist in batches for c in sublist]
-        random.shuffle(cards)
+    def __init__(self, rng, cards=None):
+        if cards is None:
+            batches = [[c] * c.how_many for c in Card]
+            cards = [c for sublist in batches for c in sublist]
+            rng.shuffle(cards)
+        else:
+            cards = cards[::-1]  # given in draw order
         self._cards = cards
-        self._counts = counts
+        self._counts = CardCounts.of(cards)
+    def order(self):
+        """Remaining cards in draw order."""
+        return self._cards[::-1]
+    def copy(self, rng=None):
+        """Copy of the remaining deck, reshuffled if "rng" is given."""
+        deck = Deck.__new__(Deck)
+        deck._cards = self._cards[:]
+        deck._counts = self._counts.copy()
+        if rng:
+            rng.shuffle(deck._cards)
+        return deck
     def draw(self):
         if self._cards:
             card = self._cards.pop()
-            self._counts[card] = self._counts[card] - 1
+            self._counts[card] -= 1
             return card
         else: raise Exception('Trying to draw from an empty deck.')
     def size(self):
         return len(self._cards)
     def count(self, card_type):
         return self._counts[card_type]
+    def frozen_card_counts(self):
+        return FrozenCardCounts(self._counts)
     def __str__(self):
         s = 'Deck size {} with contents:\n'.format(self.size())
         s += '\n'.join('  {} ({})'.format(k, v) for k, v in self._counts.items())
@@ -84,6 +110,8 @@ class Deck:
 
 class Card(Enum):
     def __init__(self, id, how_many, is_trinket, is_business, permanent):
+        self.id = id
+        self.idx = id - 1  # position in card count vectors
         self.how_many = how_many
         self.is_trinket = is_trinket
         self.is_business = is_business
@@ -112,19 +140,76 @@ class Card(Enum):
 TRINKET_CARDS = [c for c in Card if c.is_trinket]
 REMOVABLE_CARDS = [c for c in Card if not c.permanent]
 BUSINESS_CARDS = [c for c in Card if c.is_business]
+NUM_CARD_TYPES = len(Card)
+
+
+class _CardMultiset:
+    # Count vectors are indexed by a Card, or by a plain index or slice; a Card is not an index anywhere else.
+    # For code written against the former dict of counts, keys, values and items follow the card order.
+    __slots__ = ()
+    def copy(self):
+        return CardCounts(self)
+    def plus(self, other):
+        return CardCounts(list(map(int.__add__, self, other)))
+    def minus(self, other):
+        return CardCounts(list(map(int.__sub__, self, other)))
+    def total(self):
+        return sum(self)
+    def keys(self):
+        return iter(Card)
+    def values(self):
+        return iter(self)
+    def items(self):
+        return zip(Card, self)
+
+
+class CardCounts(_CardMultiset, list):
+    """Multiset of cards as a fixed-length count vector, indexed directly by a Card (or by Card.idx)."""
+    __slots__ = ()
+    def __init__(self, counts=None):
+        list.__init__(self, counts if counts is not None else NUM_CARD_TYPES * [0])
+    def __getitem__(self, key, _get=list.__getitem__):
+        try:
+            return _get(self, key.idx)
+        except AttributeError:
+            return _get(self, key)
+    def __setitem__(self, key, value, _set=list.__setitem__):
+        try:
+            _set(self, key.idx, value)
+        except AttributeError:
+            _set(self, key, value)
+    @staticmethod
+    def of(cards):
+        counts = CardCounts()
+        for c in cards:
+            counts[c] += 1
+        return counts
+    def add(self, other):
+        list.__setitem__(self, slice(None), map(int.__add__, self, other))
+    def subtract(self, other):
+        list.__setitem__(self, slice(None), map(int.__sub__, self, other))
+
+
+class FrozenCardCounts(_CardMultiset, tuple):
+    """Immutable CardCounts: safe to share between views without copying."""
+    __slots__ = ()
+    def __getitem__(self, key, _get=tuple.__getitem__):
+        try:
+            return _get(self, key.idx)
+        except AttributeError:
+            return _get(self, key)
 
 
 class Cheque(Enum):
     def __str__(self):
         return 'Cheque({})'.format(self.value)
-    def __eq__(self, other):
-        return self.value == other.value
     def __lt__(self, other):
         return self.value < other.value
     def __le__(self, other):
         return self.value <= other.value
-    def __hash__(self):
-        return hash(self.value)
+    @property
+    def bit(self):
+        return 1 << (self.value - 1)
     One=1
     Two=2
     Three=3
@@ -142,6 +227,40 @@ class Cheque(Enum):
     Fifteen=15
     Sixteen=16
 
+CHEQUES_BY_VALUE = [None] + [c for c in Cheque]  # cheque of value v is at index v, and its bit is 1 << (v - 1)
+
+
+##
+## Cheque sets held as bitmasks: one bit per cheque value.
+##
+
+def cheque_mask(cheques):
+    mask = 0
+    for c in cheques:
+        mask |= c.bit
+    return mask
+
+def mask_cheques(mask):
+    """Cheques of a mask in ascending order."""
+    cheques = []
+    while mask:
+        low = mask & -mask
+        cheques.append(CHEQUES_BY_VALUE[low.bit_length()])
+        mask ^= low
+    return cheques
+
+def mask_highest_cheque(mask):
+    return CHEQUES_BY_VALUE[mask.bit_length()] if mask else None
+
+def mask_lowest_cheque(mask):
+    return CHEQUES_BY_VALUE[(mask & -mask).bit_length()] if mask else None
+
+def mask_lowest_cheque_above(mask, cheque):
+    return mask_lowest_cheque(mask >> cheque.value << cheque.value)
+
+def mask_size(mask):
+    return bin(mask).count('1')
+
 
 ##
 ## Cheque sets at the start of the game.
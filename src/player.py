@@ -1,4 +1,5 @@
-from pieces import Card
+from pieces import Card, CardCounts, FrozenCardCounts
+from pieces import cheque_mask, mask_cheques, mask_highest_cheque, mask_lowest_cheque, mask_lowest_cheque_above, mask_size
 import pieces
 from scoring import Scoring, ScoringCard, ScoringCheque
 import control
@@ -6,35 +7,61 @@ import control
 class Player:
     def __init__(self, player_agent, starting_cheques):
         self._player_agent = player_agent
-        self._available_cheques = starting_cheques[:]
-        self._unavailable_cheques = []
+        self._available_mask = cheque_mask(starting_cheques)
+        self._unavailable_mask = 0
+        self._cheque_total = sum(c.value for c in starting_cheques)
         self._scards = []
         self._scored_scards = []
         self._removed_scards = []
-        self._counts = {c: 0 for c in Card if c != Card.Policeman}
+        self._counts = CardCounts()
         self._scoring_cheques = None
         self._scoring = Scoring(player_agent)
+        self._shared_scards = False
+    def copy(self, player_agent):
+        # Scoring cards are shared copy-on-write: only the unscored ones are mutated later, by scoring.
+        self._shared_scards = True
+        player = Player.__new__(Player)
+        player._player_agent = player_agent
+        player._available_mask = self._available_mask
+        player._unavailable_mask = self._unavailable_mask
+        player._cheque_total = self._cheque_total
+        player._scards = self._scards[:]
+        player._shared_scards = True
+        player._scored_scards = self._scored_scards[:]
+        player._removed_scards = self._removed_scards[:]
+        player._counts = self._counts.copy()
+        player._scoring_cheques = self._scoring_cheques
+        player._scoring = self._scoring.copy(player_agent)
+        return player
     @property
     def player_agent(self):
         return self._player_agent
     @property
     def round_is_over(self):
-        return len(self._available_cheques) == 0
+        return not self._available_mask
     @property
     def num_available_cheques(self):
-        return len(self._available_cheques)
+        return mask_size(self._available_mask)
     @property
     def num_unavailable_cheques(self):
-        return len(self._unavailable_cheques)
+        return mask_size(self._unavailable_mask)
+    @property
+    def available_cheque_mask(self):
+        return self._available_mask
+    @property
+    def unavailable_cheque_mask(self):
+        return self._unavailable_mask
     @property
     def highest_cheque(self):
-        if not self.round_is_over:
-            return max(self._available_cheques)
+        return mask_highest_cheque(self._available_mask)
+    @property
+    def lowest_cheque(self):
+        return mask_lowest_cheque(self._available_mask)
+    def lowest_cheque_above(self, cheque):
+        return mask_lowest_cheque_above(self._available_mask, cheque)
     @property
     def cheque_total(self):
-        cheques = self._available_cheques[:]  # copy
-        cheques.extend(self._unavailable_cheques)
-        return sum(c.value for c in cheques)
+        return self._cheque_total
     @property
     def num_bodyguards(self):
         return self._counts[Card.Bodyguard]
@@ -46,23 +73,28 @@ class Player:
     def get_final_scoring(self):
         return self._scoring
     def available_cheques(self):
-        return self._available_cheques[:]  # copy
+        return mask_cheques(self._available_mask)
     def has_cheque_available(self, cheque):
-        return cheque in self._available_cheques
+        return bool(self._available_mask & cheque.bit)
     def refresh_cheques(self):
-        self._available_cheques.extend(self._unavailable_cheques)
-        self._unavailable_cheques = []
+        self._available_mask |= self._unavailable_mask
+        self._unavailable_mask = 0
     def remove_available_cheque(self, cheque):
-        self._available_cheques.remove(cheque)  # removes first occurrence
+        if not self._available_mask & cheque.bit:
+            raise Exception('Trying to remove cheque {} that is not available.'.format(cheque))
+        self._available_mask ^= cheque.bit
+        self._cheque_total -= cheque.value
     def add_unavailable_cheque(self, cheque):
-        self._unavailable_cheques.append(cheque)
+        self._unavailable_mask |= cheque.bit
+        self._cheque_total += cheque.value
     def total_cheque_value(self):
-        return sum(self._available_cheques) + sum(self._unavailable_cheques)
+        return self._cheque_total
     def gain_cards(self, cards, round, cheque_value, cheque_ordinal):
         gained = [ScoringCard(c, round, cheque_value, cheque_ordinal) for c in cards]
         self._scards.extend(gained)
+        counts = self._counts
         for c in cards:
-            self._counts[c] += 1
+            counts[c] += 1
     def remove_cards(self, cards_to_remove):
         # remove player's cards one-for-one
         for c in cards_to_remove:
@@ -76,19 +108,29 @@ class Player:
             self._counts[c] -= 1
 
     def card_counts(self):
-        return dict(self._counts)  # copy
+        return self._counts.copy()
+    def frozen_card_counts(self):
+        return FrozenCardCounts(self._counts)
+
+    def _own_scards(self):
+        if self._shared_scards:
+            self._scards = [sc.copy() for sc in self._scards]
+            self._shared_scards = False
 
     def do_round_scoring(self, min_bodyguard, max_bodyguard):
-        self._scoring.score_round(min_bodyguard, max_bodyguard, self._scards)
+        self._own_scards()
+        round_scores = self._scoring.score_round(min_bodyguard, max_bodyguard, self._scards)
         self._scoring.assign_round_card_scores(min_bodyguard, max_bodyguard, self._scards)
 
         self._scored_scards.extend(sc for sc in self._scards if sc.card in pieces.REMOVABLE_CARDS)
         self._scards = [sc for sc in self._scards if sc.card not in pieces.REMOVABLE_CARDS]
         for card_type in pieces.REMOVABLE_CARDS:
             self._counts[card_type] = 0
+        return round_scores
 
     def do_game_end_scoring(self, min_money, max_money):
-        cheques = self._available_cheques + self._unavailable_cheques
+        self._own_scards()
+        cheques = mask_cheques(self._available_mask | self._unavailable_mask)
         self._scoring_cheques = [ScoringCheque(c) for c in cheques]
         self._scoring.score_businesses(self._scards)
         self._scoring.score_cheques(min_money, max_money, self._scoring_cheques)
@@ -99,8 +141,8 @@ class Player:
 
     def __str__(self):
         s  = '\n' + str(self._player_agent) + '\n'
-        s += '  Available cheques: ' + ', '.join(str(c) for c in self._available_cheques) + '\n'
-        s += '  Unavailable cheques: ' + ', '.join(str(c) for c in self._unavailable_cheques) + '\n'
+        s += '  Available cheques: ' + ', '.join(str(c) for c in mask_cheques(self._available_mask)) + '\n'
+        s += '  Unavailable cheques: ' + ', '.join(str(c) for c in mask_cheques(self._unavailable_mask)) + '\n'
         s += '  Gained cards: \n    ' + '\n    '.join(str(c) for c in self._scards) + '\n'
         s += '  Counts: ' + ', '.join(['{} {}'.format(k.name, v) for k, v in self._counts.items() if v])
         return s
@@ -0,0 +1,46 @@
+"""
+Opt-in timing of the game engine phases.
+
+A Game given a PhaseProfiler wraps its phase methods on the instance, so games without one
+run the plain methods. Times are inclusive: a turn contains its draw, which contains its auction,
+which contains the bids of the agents. Games played by Game.decisions() cannot be profiled.
+"""
+
+import time
+
+
+class PhaseProfiler:
+    """Cumulative wall time and call counts by phase; mergeable across games and worker processes."""
+    def __init__(self):
+        self.seconds = {}
+        self.calls = {}
+    def _add(self, name, seconds):
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+    def wrap(self, name, fn):
+        perf_counter = time.perf_counter
+        def timed(*args):
+            start = perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                self._add(name, perf_counter() - start)
+        return timed
+    def wrap_agent(self, name, fn):
+        # Agent decisions are keyed by the agent, whose player is the first argument.
+        perf_counter = time.perf_counter
+        def timed(player, *args):
+            start = perf_counter()
+            try:
+                return fn(player, *args)
+            finally:
+                self._add('{}[{}]'.format(name, player.player_agent), perf_counter() - start)
+        return timed
+    def merge(self, other):
+        for name, seconds in other.seconds.items():
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+            self.calls[name] = self.calls.get(name, 0) + other.calls[name]
+    def report(self):
+        s_template = '{:32s} {:10.3f} s {:10d} calls {:10.2f} us/call'
+        return '\n'.join(s_template.format(name, self.seconds[name], self.calls[name], 1e6 * self.seconds[name] / self.calls[name])
+                         for name in sorted(self.seconds, key=self.seconds.get, reverse=True))
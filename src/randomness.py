@@ -0,0 +1,26 @@
+import copy
+import random
+
+
+class GameRandom:
+    """Random streams of a single game, derived directly from (seed, game index)."""
+    def __init__(self, seed, game_idx=0):
+        self._key = '{}:{}'.format(seed, game_idx)
+        self._deal = random.Random(self._key + ':deal')
+        self._agent_streams = {}
+    @staticmethod
+    def unseeded():
+        return GameRandom(random.randrange(2**64))
+    def fork(self):
+        """Independent copy of all streams in their current states."""
+        return copy.deepcopy(self)
+    @property
+    def deal(self):
+        return self._deal
+    def agent(self, stream_id):
+        """Decision stream of one agent seat (or agent); independent of the deal and of the other streams."""
+        stream = self._agent_streams.get(stream_id)
+        if stream is None:
+            stream = random.Random('{}:agent:{}'.format(self._key, stream_id))
+            self._agent_streams[stream_id] = stream
+        return stream
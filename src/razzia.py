@@ -8,13 +8,68 @@ Implemented in Python 3.7, originally by Esa Junttila.
 
 __author__ = 'Esa Junttila'
 
+import os
 import sys
 import logging
 import random
+import argparse
+import concurrent.futures
 
 from control import Game
+from randomness import GameRandom
+from scoring import Score
 import agent
 import analytics
+import columnar
+import records
+import search
+import endgame
+import scheduler
+import profiling
+import checkpoint
+
+try:
+    import lockstep
+except ImportError:
+    lockstep = None  # the lockstep engine needs NumPy
+
+
+STATISTICS_CHUNK_GAMES = 500  # Games per batch handed to a worker process.
+CHECKPOINT_GAMES = 100000  # Games between checkpoints, rounded down to whole chunks.
+
+
+def _play_chunk(player_agents, seed, first_game_idx, num_games):
+    game_range = range(first_game_idx, first_game_idx + num_games)
+    return [Game(player_agents, GameRandom(seed, i)).play_game() for i in game_range]
+
+def _play_chunk_statistics(player_agents, seed, first_game_idx, num_games):
+    stats = analytics.GameStatistics()
+    for i in range(first_game_idx, first_game_idx + num_games):
+        stats.add_game(Game(player_agents, GameRandom(seed, i)).play_game())
+    return stats
+
+def _play_chunk_columns(player_agents, seed, first_game_idx, num_games):
+    columns = columnar.GameColumns()
+    for i in range(first_game_idx, first_game_idx + num_games):
+        columns.add_game(i, Game(player_agents, GameRandom(seed, i)).play_game())
+    return columns
+
+def _play_chunk_records(player_agents, seed, first_game_idx, num_games):
+    game_range = range(first_game_idx, first_game_idx + num_games)
+    return [records.record_game(player_agents, GameRandom(seed, i))[1] for i in game_range]
+
+def _play_chunk_profile(player_agents, seed, first_game_idx, num_games):
+    profiler = profiling.PhaseProfiler()
+    for i in range(first_game_idx, first_game_idx + num_games):
+        Game(player_agents, GameRandom(seed, i), profiler=profiler).play_game()
+    return profiler
+
+AI_AGENTS = {
+    'trivial': agent.TrivialPlayerAgent,
+    'stealing': agent.StealingPlayerAgent,
+    'search': search.SearchPlayerAgent,
+    'endgame': endgame.EndgamePlayerAgent,
+}
 
 
 class Razzia:
@@ -22,27 +77,120 @@ class Razzia:
 
     def __init__(self, num_players, ai=None, random_seed=None):
         self._player_agents = Razzia.DEFAULT_PLAYER_NAMES
-        if ai is None or ai.lower() == 'trivial':
-            ai_agent = agent.TrivialPlayerAgent
-        elif ai.lower() == 'stealing':
-            ai_agent = agent.StealingPlayerAgent
-        else:
+        ai_agent = AI_AGENTS.get(ai.lower() if ai else 'trivial')
+        if ai_agent is None:
             raise Exception('Unknown AI player setup: {}'.format(ai))
         self._player_agents = [ai_agent(name) for name in self._player_agents[:num_players]]
         self._random_seed = random_seed
-    def _play_one_game(self):
-        return Game(self._player_agents).play_game()
-    def play_game(self):
-        if self._random_seed:
-            random.seed(self._random_seed)
-        return self._play_one_game()
-    def run_statistics(self, num_games):
-        if self._random_seed:
-            random.seed(self._random_seed)
-        multi_scorings = [self._play_one_game() for _ in range(num_games)]
-        print(analytics.analyze_player_order(multi_scorings))
-        print(analytics.analyze_card_value(multi_scorings))
-        print(analytics.analyze_cheque_value(multi_scorings))
+    def _seed(self):
+        return self._random_seed if self._random_seed else random.randrange(2**64)
+    def play_game(self, game_idx=0):
+        """Play game number "game_idx" of the seeded run, independently of the games before it."""
+        return Game(self._player_agents, GameRandom(self._seed(), game_idx)).play_game()
+    def _localize(self, scorings):
+        # Scorings from worker processes are keyed by copies of the agents: map them back by seat.
+        return {a: s for a, s in zip(self._player_agents, scorings.values())}
+    def _map_chunks(self, fn, num_games, workers, chunk_games, first_game_idx=0, seed=None):
+        starts = range(first_game_idx, first_game_idx + num_games, chunk_games)
+        sizes = [min(chunk_games, first_game_idx + num_games - start) for start in starts]
+        args = (len(sizes) * [self._player_agents], len(sizes) * [self._seed() if seed is None else seed], starts, sizes)
+        if workers == 1:
+            yield from map(fn, *args)
+            return
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from executor.map(fn, *args)
+    def play_games(self, num_games, workers=1, chunk_games=STATISTICS_CHUNK_GAMES, batched=False):
+        """Play seeded games; "batched" interleaves the games of a chunk and batches the agent decisions."""
+        results = self._map_chunks(scheduler.play_chunk if batched else _play_chunk, num_games, workers, chunk_games)
+        return [self._localize(s) for chunk in results for s in chunk]
+    def collect_statistics(self, num_games, workers=1, chunk_games=STATISTICS_CHUNK_GAMES, checkpoint_path=None, resume=False,
+                           checkpoint_games=CHECKPOINT_GAMES):
+        """Statistics of "num_games" games; a "checkpoint_path" saves them every "checkpoint_games" games for "resume"."""
+        if checkpoint_path:
+            return self._collect_statistics_checkpointed(num_games, workers, chunk_games, checkpoint_path, resume, checkpoint_games)
+        stats = analytics.GameStatistics()
+        for chunk_stats in self._map_chunks(_play_chunk_statistics, num_games, workers, chunk_games):
+            stats.merge(chunk_stats)
+        return stats
+    def _collect_statistics_checkpointed(self, num_games, workers, chunk_games, path, resume, checkpoint_games):
+        # Checkpoints fall on chunk boundaries, so a resumed run merges the same chunks in the same order.
+        agents = [(type(a).__name__, a.name) for a in self._player_agents]
+        if resume and os.path.exists(path):
+            state = checkpoint.load(path)
+            if (state.num_games, state.chunk_games, state.agents) != (num_games, chunk_games, agents) or \
+                    (self._random_seed and state.seed != self._random_seed):
+                raise Exception('Checkpoint "{}" belongs to a different run.'.format(path))
+        elif os.path.exists(path):
+            raise Exception('Checkpoint "{}" exists: resume the run or remove the file.'.format(path))
+        else:
+            state = checkpoint.Checkpoint(self._seed(), num_games, chunk_games, agents, analytics.GameStatistics())
+        segment_games = max(1, checkpoint_games // chunk_games) * chunk_games
+        while not state.is_done:
+            segment = min(segment_games, num_games - state.next_game_idx)
+            for chunk_stats in self._map_chunks(_play_chunk_statistics, segment, workers, chunk_games, state.next_game_idx, state.seed):
+                state.stats.merge(chunk_stats)
+            state.next_game_idx += segment
+            checkpoint.save(path, state)
+        return state.stats
+    def store_results(self, path, num_games, workers=1, chunk_games=STATISTICS_CHUNK_GAMES):
+        """Append the scoring rows of every game to the columnar result store at "path"."""
+        with columnar.ResultStoreWriter(path) as writer:
+            for columns in self._map_chunks(_play_chunk_columns, num_games, workers, chunk_games):
+                writer.write(columns)
+    def record_games(self, path, num_games, workers=1, chunk_games=STATISTICS_CHUNK_GAMES):
+        """Append a replayable record of every game to the corpus at "path"."""
+        with records.GameRecordWriter(path) as writer:
+            for chunk in self._map_chunks(_play_chunk_records, num_games, workers, chunk_games):
+                writer.write(chunk)
+    def replay_game(self, path, game_idx):
+        """Replay game number "game_idx" of the corpus at "path" without consulting the agents."""
+        with records.GameRecordReader(path) as reader:
+            scorings = records.replay_game(reader[game_idx], [a.name for a in self._player_agents])
+        return self._localize(scorings)
+    def profile(self, num_games, workers=1, chunk_games=STATISTICS_CHUNK_GAMES):
+        """Time the engine phases and agent decisions over "num_games" games."""
+        profiler = profiling.PhaseProfiler()
+        for chunk_profiler in self._map_chunks(_play_chunk_profile, num_games, workers, chunk_games):
+            profiler.merge(chunk_profiler)
+        return profiler
+    def lockstep_scores(self, num_games):
+        """Scores of "num_games" games played at once by the NumPy lockstep engine, shaped (games, players, Score)."""
+        if lockstep is None:
+            raise Exception('The lockstep engine requires NumPy.')
+        if any(type(a) is not agent.TrivialPlayerAgent for a in self._player_agents) or len({a._bid_probs for a in self._player_agents}) != 1:
+            raise Exception('Only trivial agents with the same bid probabilities can play in lockstep.')
+        return lockstep.LockstepGames(len(self._player_agents), num_games, self._seed(), self._player_agents[0]._bid_probs).play()
+    def print_lockstep_scores(self, num_games):
+        scores = self.lockstep_scores(num_games)
+        means = scores.mean(axis=0)
+        print('Mean scores of {} lockstep games:'.format(num_games))
+        for agent_, seat_means, total in zip(self._player_agents, means, scores.sum(axis=2).mean(axis=0)):
+            print('  {}: {:.2f} ({})'.format(agent_.name, total, ', '.join('{} {:.2f}'.format(s.name, m) for s, m in zip(Score, seat_means))))
+    def collect_statistics_until(self, targets, max_games, workers=1, chunk_games=STATISTICS_CHUNK_GAMES):
+        """Play batches of games until every precision target is met, or until "max_games" games.
+
+        The cap is required, since a target may never be met (a WinnerTarget between equal agents, say).
+        The targets are checked after every batch: such repeated peeking stops early on chance fluctuations
+        more often than the nominal confidence suggests, so prefer a higher confidence than a fixed-size run needs.
+        """
+        stats = analytics.GameStatistics()
+        seed = self._seed()
+        batch_games = workers * chunk_games
+        while stats.num_games < max_games and not all(t.is_met(stats) for t in targets):
+            num_games = min(batch_games, max_games - stats.num_games)
+            for chunk_stats in self._map_chunks(_play_chunk_statistics, num_games, workers, chunk_games, stats.num_games, seed):
+                stats.merge(chunk_stats)
+        return stats
+    def run_statistics(self, num_games, workers=1, targets=None, checkpoint_path=None, resume=False):
+        """Print the reports of "num_games" games; with precision targets, stop as soon as they are met."""
+        if targets and checkpoint_path:
+            raise Exception('Checkpoints are not supported with precision targets.')
+        if targets:
+            stats = self.collect_statistics_until(targets, num_games, workers)
+            print('\n'.join(t.report(stats) for t in targets) + '\nin {} games'.format(stats.num_games))
+        else:
+            stats = self.collect_statistics(num_games, workers, checkpoint_path=checkpoint_path, resume=resume)
+        print(stats.report())
     def print_scores(self, scorings):
         print('Detailed scores:\n' + '\n'.join(str(s) for p, s in scorings.items()))
         print('Accumulated card scores: ' + ', '.join('"{}" = {}'.format(p, s.final_accumulated_card_score()) for p, s in scorings.items()))
@@ -52,11 +200,20 @@ class Razzia:
 
 
 def main(args):
+    parser = argparse.ArgumentParser(description='Razzia! card game simulator.')
+    parser.add_argument('--games', type=int, default=1000, help='games in the statistics run')
+    parser.add_argument('--checkpoint', help='file for periodic checkpoints of the statistics run')
+    parser.add_argument('--resume', action='store_true', help='continue the statistics run from its checkpoint')
+    parser.add_argument('--lockstep', action='store_true', help='play the games with trivial agents in the NumPy lockstep engine')
+    options = parser.parse_args(args)
+    if options.lockstep:
+        Razzia(4, ai='trivial', random_seed=1).print_lockstep_scores(options.games)
+        return
     logging.basicConfig(level=logging.INFO)
     r = Razzia(4, ai='stealing', random_seed=1)
     scorings = r.play_game()
     r.print_scores(scorings)
-    r.run_statistics(1000)
+    r.run_statistics(options.games, workers=os.cpu_count(), checkpoint_path=options.checkpoint, resume=options.resume)
 
 if __name__ == '__main__':
     main(sys.argv[1:])
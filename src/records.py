@@ -0,0 +1,258 @@
+"""
+Compact binary game records.
+
+A record holds the initial deck order and every agent decision of one game, which is all that
+is needed to replay the game exactly without consulting any agent. Records are appended to a
+corpus file; a companion index file of record end offsets allows seeking directly to game N.
+
+Record layout (bytes):
+    num_players, deck size, card ids in draw order, decisions...
+Decision codes:
+    0 = pass, 1..16 = bid with the cheque of that value, DRAW, AUCTION,
+    THEFT + n followed by the ids of the n stolen cards.
+"""
+
+from array import array
+import os
+
+from control import Game, ActionType, GAME_ROUNDS, ROUND_END_POLICEMEN, ROUND_END_POLICEMEN_TWOPLAYER, AUTOMATIC_AUCTION_NUM_CARDS
+from agent import PlayerAgent
+from auction import AuctionMode
+from events import Tracer, Sink, EventType, EVENT_TYPES, PassReason
+from player import Player
+from pieces import Card, Cheque, Deck
+from pieces import CHEQUE_STARTING, CHEQUES_FOR_2, CHEQUES_FOR_3, CHEQUES_FOR_4, CHEQUES_FOR_5
+
+
+PASS = 0
+DRAW = 0x11
+AUCTION = 0x12
+THEFT = 0x20
+
+CARDS_BY_ID = {c.id: c for c in Card}
+CHEQUES_BY_VALUE = {c.value: c for c in Cheque}
+
+
+class DecisionRecorderSink(Sink):
+    """Derives the agent decisions of a game from its events."""
+    def __init__(self):
+        self._data = bytearray()
+    def handle(self, event):
+        t = EVENT_TYPES[type(event)]
+        if t == EventType.Draw:
+            self._data.append(DRAW)
+        elif t == EventType.AuctionStart and event.mode == AuctionMode.ByPlayer:
+            self._data.append(AUCTION)
+        elif t == EventType.Theft:
+            self._data.append(THEFT + len(event.cards))
+            self._data.extend(c.id for c in event.cards)
+        elif t == EventType.Bid:
+            self._data.append(event.cheque.value)
+        elif t == EventType.Pass and event.reason == PassReason.Deliberate:
+            self._data.append(PASS)
+    def getvalue(self):
+        return bytes(self._data)
+
+
+def record_game(player_agents, rng):
+    """Play one game; return its scorings and its record."""
+    deck = Deck(rng.deal)
+    header = bytes([len(player_agents), deck.size()]) + bytes(c.id for c in deck.order())
+    recorder = DecisionRecorderSink()
+    scorings = Game(player_agents, rng, tracer=Tracer([recorder]), deck=deck).play_game()
+    return scorings, header + recorder.getvalue()
+
+
+class _DecisionCursor:
+    def __init__(self, data, pos):
+        self._data = data
+        self._pos = pos
+    def next(self):
+        code = self._data[self._pos]
+        self._pos += 1
+        return code
+    def take(self, n):
+        values = self._data[self._pos:self._pos + n]
+        self._pos += n
+        return values
+
+
+class ReplayAgent(PlayerAgent):
+    """Plays back recorded decisions; all seats of a game share one cursor."""
+    def __init__(self, name, cursor):
+        super().__init__(name)
+        self._cursor = cursor
+        self._stolen = None
+    def act(self, game_view):
+        code = self._cursor.next()
+        if code == DRAW:
+            return ActionType.Draw
+        elif code == AUCTION:
+            return ActionType.AuctionByPlayer
+        elif code >= THEFT:
+            self._stolen = [CARDS_BY_ID[i] for i in self._cursor.take(code - THEFT)]
+            return ActionType.Thief
+        raise Exception('Unexpected action code in game record: {}'.format(code))
+    def bid(self, game_view, auction_view, player_view, is_mandated):
+        code = self._cursor.next()
+        if code > len(CHEQUES_BY_VALUE):
+            raise Exception('Unexpected bid code in game record: {}'.format(code))
+        return CHEQUES_BY_VALUE[code] if code else None
+    def steal(self, game_view):
+        stolen, self._stolen = self._stolen, None
+        return stolen
+
+
+def replay_game_in_engine(record, names=None, tracer=None):
+    """Replay a record through the game engine, with views, events and checks; slower than "replay_game"."""
+    num_players, deck_size = record[0], record[1]
+    cards = [CARDS_BY_ID[i] for i in record[2:2 + deck_size]]
+    names = names if names else ['Seat {}'.format(i + 1) for i in range(num_players)]
+    cursor = _DecisionCursor(record, 2 + deck_size)
+    agents = [ReplayAgent(name, cursor) for name in names]
+    return Game(agents, tracer=tracer, deck=Deck(None, cards)).play_game()
+
+
+def _replay_auction(data, pos, players, initiator_seat, booty, board_cheque, round):
+    # Bidders follow the initiator around the table; only their bids and deliberate passes are recorded.
+    n = len(players)
+    top, winner = None, None
+    lowest_mask = 1  # a player passes without deciding when all their cheques are below the top bid, or spent
+    for i in range(1, n + 1):
+        player = players[(initiator_seat + i) % n]
+        if player.available_cheque_mask < lowest_mask:
+            continue
+        code = data[pos]
+        pos += 1
+        if code:
+            top, winner = CHEQUES_BY_VALUE[code], player
+            lowest_mask = top.bit
+    if top:
+        winner.gain_cards(booty, round, top, winner.num_unavailable_cheques + 1)
+        winner.remove_available_cheque(top)
+        winner.add_unavailable_cheque(board_cheque)
+        return pos, top, True
+    return pos, board_cheque, False
+
+def replay_game(record, names=None):
+    """Replay a record straight on the players; the scorings are keyed by agents named after the seats.
+
+    The rules of Game are applied to plain lists of cards, without agents, views, events or the
+    board and deck pieces, which makes this much faster than live play. "replay_game_in_engine"
+    gives the same scorings through the engine itself.
+    """
+    num_players, deck_size = record[0], record[1]
+    data = bytes(record)
+    deck = [CARDS_BY_ID[i] for i in data[2:2 + deck_size]]
+    pos = 2 + deck_size
+    names = names if names else ['Seat {}'.format(i + 1) for i in range(num_players)]
+    cheques = {2: CHEQUES_FOR_2, 3: CHEQUES_FOR_3, 4: CHEQUES_FOR_4, 5: CHEQUES_FOR_5}[num_players]
+    players = [Player(PlayerAgent(name), cs) for name, cs in zip(names, cheques)]
+    round_end_policemen = ROUND_END_POLICEMEN if num_players > 2 else ROUND_END_POLICEMEN_TWOPLAYER
+    drawn, booty, policemen, board_cheque = 0, [], 0, CHEQUE_STARTING
+    for round in range(1, GAME_ROUNDS + 1):
+        for player in players:
+            player.refresh_cheques()
+        highest = [p.highest_cheque for p in players]
+        seat = highest.index(max(highest))
+        passes = 0
+        while True:
+            player = players[seat]
+            if player.round_is_over:
+                passes += 1
+                if passes == num_players:
+                    break
+                seat = (seat + 1) % num_players
+                continue
+            passes = 0
+            code = data[pos]
+            pos += 1
+            if code == DRAW:
+                card = deck[drawn]
+                drawn += 1
+                if card == Card.Policeman:
+                    policemen += 1
+                    if policemen == round_end_policemen:
+                        booty, policemen = [], 0
+                        break
+                    pos, board_cheque, won = _replay_auction(data, pos, players, seat, booty, board_cheque, round)
+                    if won:
+                        booty = []
+                else:
+                    booty.append(card)
+                    if len(booty) == AUTOMATIC_AUCTION_NUM_CARDS:
+                        pos, board_cheque, _ = _replay_auction(data, pos, players, seat, booty, board_cheque, round)
+                        booty = []  # won, or discarded without bids
+            elif code == AUCTION:
+                pos, board_cheque, won = _replay_auction(data, pos, players, seat, booty, board_cheque, round)
+                if won:
+                    booty = []
+            elif code >= THEFT:
+                stolen = [CARDS_BY_ID[i] for i in data[pos:pos + code - THEFT]]
+                pos += len(stolen)
+                for c in stolen:
+                    booty.remove(c)
+                player.remove_cards(len(stolen) * [Card.Thief])
+                player.gain_cards(stolen, round, Card.Thief, Card.Thief)
+            else:
+                raise Exception('Unexpected action code in game record: {}'.format(code))
+            seat = (seat + 1) % num_players
+        bodyguards = [p.num_bodyguards for p in players]
+        for player in players:
+            player.do_round_scoring(min(bodyguards), max(bodyguards))
+    if pos != len(data):
+        raise Exception('Game record has {} bytes left over after the game end.'.format(len(data) - pos))
+    cheque_totals = [p.cheque_total for p in players]
+    for player in players:
+        player.do_game_end_scoring(min(cheque_totals), max(cheque_totals))
+    return {p.player_agent: p.get_final_scoring() for p in players}
+
+
+def _corpus_files(path):
+    return os.path.join(path, 'games.rec'), os.path.join(path, 'games.idx')
+
+
+class GameRecordWriter:
+    """Appends records to the corpus at "path"."""
+    def __init__(self, path):
+        os.makedirs(path, exist_ok=True)
+        corpus_file, index_file = _corpus_files(path)
+        self._corpus = open(corpus_file, 'ab')
+        self._index = open(index_file, 'ab')
+        self._end = self._corpus.tell()
+    def write(self, records):
+        ends = array('Q')
+        for record in records:
+            self._end += len(record)
+            ends.append(self._end)
+        self._corpus.write(b''.join(records))
+        ends.tofile(self._index)
+    def close(self):
+        self._corpus.close()
+        self._index.close()
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        self.close()
+
+
+class GameRecordReader:
+    """Random access to the records of a corpus by game number."""
+    def __init__(self, path):
+        corpus_file, index_file = _corpus_files(path)
+        self._ends = array('Q')
+        with open(index_file, 'rb') as f:
+            self._ends.frombytes(f.read())
+        self._corpus = open(corpus_file, 'rb')
+    def __len__(self):
+        return len(self._ends)
+    def __getitem__(self, game_idx):
+        start = self._ends[game_idx - 1] if game_idx else 0
+        self._corpus.seek(start)
+        return self._corpus.read(self._ends[game_idx] - start)
+    def close(self):
+        self._corpus.close()
+    def __enter__(self):
+        return self
+    def __exit__(self, *exc):
+        self.close()
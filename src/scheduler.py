@@ -0,0 +1,56 @@
+"""
+Batched agent decisions across many games.
+
+Every game runs as a generator of decision requests (Game.decisions). The scheduler advances all
+games to their next decision, groups the pending requests by agent and kind, and hands each group
+to its agent at once through act_batch, bid_batch or steal_batch; the games then resume with the
+answers. An agent with a costly evaluator sees many states per call instead of one.
+
+Agents shared by several games get requests from all of them interleaved, so they must not keep
+per-game state between decisions. Each game still consumes its own random streams in the same order,
+so seeded games give the same scores as when played one at a time.
+"""
+
+from control import Game
+from randomness import GameRandom
+
+
+BATCH_METHODS = {'act': 'act_batch', 'bid': 'bid_batch', 'steal': 'steal_batch'}
+
+
+class BatchScheduler:
+    def __init__(self, games):
+        self._games = list(games)
+        self.num_batches = 0
+        self.num_decisions = 0
+    def run(self):
+        """Play all games to the end; returns their scorings in order."""
+        generators = [g.decisions() for g in self._games]
+        scorings = len(generators) * [None]
+        pending = {}
+        def advance(i, answer):
+            try:
+                pending[i] = generators[i].send(answer)
+            except StopIteration as stop:
+                scorings[i] = stop.value
+        for i in range(len(generators)):
+            advance(i, None)
+        while pending:
+            groups = {}
+            for i, request in pending.items():
+                groups.setdefault((request.agent, request.kind), []).append(i)
+            requests, pending = pending, {}
+            for (agent, kind), indices in groups.items():
+                args = [requests[i].args for i in indices]
+                answers = getattr(agent, BATCH_METHODS[kind])(args if kind == 'bid' else [a[0] for a in args])
+                self.num_batches += 1
+                self.num_decisions += len(indices)
+                for i, answer in zip(indices, answers):
+                    advance(i, answer)
+        return scorings
+
+
+def play_chunk(player_agents, seed, first_game_idx, num_games):
+    """Chunk of seeded games played with batched decisions, like razzia._play_chunk."""
+    games = [Game(player_agents, GameRandom(seed, i)) for i in range(first_game_idx, first_game_idx + num_games)]
+    return BatchScheduler(games).run()
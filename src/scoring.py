@@ -1,8 +1,8 @@
 from enum import Enum
-from pieces import Card
+import functools
+from pieces import Card, CardCounts
 import pieces
 import control
-import logging
 
 class Score(Enum):
     Trinkets=1
@@ -22,6 +22,10 @@ class ScoringCard:
         self.cheque = cheque
         self.cheque_ordinal = cheque_ordinal
         self.scored_points = 0
+    def copy(self):
+        sc = ScoringCard(self.card, self.round, self.cheque, self.cheque_ordinal)
+        sc.scored_points = self.scored_points
+        return sc
     def __str__(self):
         return '{card:14s} (won by cheque {val} (ordinal {ord}) on Round {round}) scored {score} points'.format(
             card=self.card, val=self.cheque, ord=self.cheque_ordinal, round=self.round, score=self.scored_points)
@@ -42,6 +46,14 @@ class Scoring:
         self._scoring_cards = None
         self._scoring_cheques = None
 
+    def copy(self, name):
+        scoring = Scoring.__new__(Scoring)
+        scoring._name = name
+        scoring._scores = dict(self._scores)
+        scoring._scoring_cards = self._scoring_cards
+        scoring._scoring_cheques = self._scoring_cheques
+        return scoring
+
     def final_score(self):
         return round(sum(self._scores.values()))
 
@@ -75,38 +87,38 @@ class Scoring:
         self._scoring_cheques = scoring_cheques
 
     def _count_cards(self, scoring_cards):
-        return {c: len([sc for sc in scoring_cards if sc.card == c]) for c in Card}
+        return CardCounts.of(sc.card for sc in scoring_cards)
 
     def score_round(self, min_bodyguard, max_bodyguard, scoring_cards):
         counts = self._count_cards(scoring_cards)
         score_gold = 3 * counts[Card.GoldCoin]
         score_thief = 2 * counts[Card.Thief]
         num_unique_trinkets = len([t for t in pieces.TRINKET_CARDS if counts[t]])
-        score_trinkets = {0: -5, 1: 0, 2: 0, 3: 5, 4: 10, 5: 15}[num_unique_trinkets]
+        score_trinkets = TRINKET_SCORES[num_unique_trinkets]
         bodyguard_low = -2 if counts[Card.Bodyguard] == min_bodyguard else 0
         bodyguard_high = 5 if counts[Card.Bodyguard] == max_bodyguard else 0
         score_bodyguard = bodyguard_low + bodyguard_high
         score_car = 1 * counts[Card.Car] if counts[Card.Driver] else 0
         score_driver = 1 * counts[Card.Driver]
 
-        scores = [score_bodyguard, score_car, score_driver, score_gold, score_thief, score_trinkets, ]
-        groups = [Card.Bodyguard.name, Card.Car.name, Card.Driver.name, Card.GoldCoin.name, Card.Thief.name, 'Trinkets']
-        group_scores_str = ', '.join('{}({:+})'.format(g, s) for g, s in zip(groups, scores))
-        logging.debug('  Round scoring for {}: {}'.format(self._name, group_scores_str))
-
-        self._scores[Score.GoldCoins] += score_gold
-        self._scores[Score.Thieves] += score_thief
-        self._scores[Score.Trinkets] += score_trinkets
-        self._scores[Score.Bodyguards] += score_bodyguard
-        self._scores[Score.Cars] += score_car
-        self._scores[Score.Drivers] += score_driver
+        round_scores = {
+            Score.Trinkets: score_trinkets,
+            Score.Bodyguards: score_bodyguard,
+            Score.Cars: score_car,
+            Score.Drivers: score_driver,
+            Score.GoldCoins: score_gold,
+            Score.Thieves: score_thief,
+        }
+        for score, value in round_scores.items():
+            self._scores[score] += value
+        return round_scores
 
     def assign_round_card_scores(self, min_bodyguard, max_bodyguard, scoring_cards):
         counts = self._count_cards(scoring_cards)
         num_unique_trinkets = len([t for t in pieces.TRINKET_CARDS if counts[t]])
         added_score_per_unique_trinket = None
         if num_unique_trinkets:
-            score_trinkets = {0: -5, 1: 0, 2: 0, 3: 5, 4: 10, 5: 15}[num_unique_trinkets]
+            score_trinkets = TRINKET_SCORES[num_unique_trinkets]
             added_score_per_unique_trinket = (5 + score_trinkets) / num_unique_trinkets
         bodyguards = counts[Card.Bodyguard]
         cars = counts[Card.Car]
@@ -138,8 +150,6 @@ class Scoring:
         score_unique_businesses = num_unique_businesses + business_bonus
         score_multi_businesses = sum([5 * (counts[b] - 2) for b in pieces.BUSINESS_CARDS if counts[b] >= 3])
 
-        logging.debug('  Business scores for {}: unique({}), multiple({})'.format(self._name, score_unique_businesses, score_multi_businesses))
-
         self._scores[Score.Businesses] += score_unique_businesses + score_multi_businesses
 
     def assign_business_card_scores(self, scoring_cards):
@@ -178,6 +188,25 @@ class Scoring:
         return s
 
 
+STATIC_SCORE_CACHE_SIZE = 2**16
+
+# Precomputed score components, indexed by a small count.
+TRINKET_SCORES = (-5, 0, 0, 5, 10, 15)  # by number of unique trinkets
+BUSINESS_UNIQUE_SCORES = tuple(u + (3 if u == len(pieces.BUSINESS_CARDS) else 0) for u in range(len(pieces.BUSINESS_CARDS) + 1))  # by number of unique businesses
+
+
+def _business_multi_score(n):
+    return 5 * (n - 2) if n >= 3 else 0
+
+def _bodyguard_standing(bodyguards, min_bodyguard, max_bodyguard):
+    return (-2 if bodyguards == min_bodyguard else 0) + (5 if bodyguards == max_bodyguard else 0)
+
+
+@functools.lru_cache(maxsize=STATIC_SCORE_CACHE_SIZE)
+def _cached_static_card_score(card_counts, min_bodyguard, max_bodyguard, num_rounds_remaining):
+    return ExpectedScore._static_card_score(card_counts, min_bodyguard, max_bodyguard, num_rounds_remaining)
+
+
 class ExpectedScore:
     @staticmethod
     def _static_card_score(card_counts, min_bodyguard, max_bodyguard, num_rounds_remaining):
@@ -185,10 +214,8 @@ class ExpectedScore:
         score_gold = 3 * card_counts[Card.GoldCoin]
         score_thief = 2 * card_counts[Card.Thief]
         num_unique_trinkets = len([t for t in pieces.TRINKET_CARDS if card_counts[t]])
-        score_trinkets = {0: -5, 1: 0, 2: 0, 3: 5, 4: 10, 5: 15}[num_unique_trinkets]
-        bodyguard_low = -2 if card_counts[Card.Bodyguard] == min_bodyguard else 0
-        bodyguard_high = 5 if card_counts[Card.Bodyguard] == max_bodyguard else 0
-        score_bodyguard = bodyguard_low + bodyguard_high
+        score_trinkets = TRINKET_SCORES[num_unique_trinkets]
+        score_bodyguard = _bodyguard_standing(card_counts[Card.Bodyguard], min_bodyguard, max_bodyguard)
         score_car = 1 * card_counts[Card.Car] if card_counts[Card.Driver] else 0
         score_driver = 1 * card_counts[Card.Driver]
 
@@ -197,24 +224,27 @@ class ExpectedScore:
 
         # Businesses
         num_unique_businesses = len([b for b in pieces.BUSINESS_CARDS if card_counts[b]])
-        got_all_businesses = num_unique_businesses == len(pieces.BUSINESS_CARDS)
-        business_bonus = 3 if got_all_businesses else 0
-        score_unique_businesses = num_unique_businesses + business_bonus
-        score_multi_businesses = sum([5 * (card_counts[b] - 2) for b in pieces.BUSINESS_CARDS if card_counts[b] >= 3])
+        score_unique_businesses = BUSINESS_UNIQUE_SCORES[num_unique_businesses]
+        score_multi_businesses = sum([_business_multi_score(card_counts[b]) for b in pieces.BUSINESS_CARDS])
         score_business = score_unique_businesses + score_multi_businesses
 
         score = score_round + score_remaining + score_business
         return score
 
+    @staticmethod
+    def static_card_score(card_counts, min_bodyguard, max_bodyguard, num_rounds_remaining):
+        """Memoized "_static_card_score": the most recent count vectors are kept in a bounded LRU cache."""
+        return _cached_static_card_score(pieces.FrozenCardCounts(card_counts), min_bodyguard, max_bodyguard, num_rounds_remaining)
+
     @staticmethod
     def marginal_card_score(counts, gained_counts, min_oppo_bodyguards, max_oppo_bodyguards, num_rounds_remaining):
-        score_now = ExpectedScore._static_card_score(
+        score_now = ExpectedScore.static_card_score(
             counts,
             min(min_oppo_bodyguards, counts[Card.Bodyguard]),
             max(max_oppo_bodyguards, counts[Card.Bodyguard]),
             num_rounds_remaining)
-        after_counts = {c: counts[c] + gained_counts[c] for c in counts}
-        score_after = ExpectedScore._static_card_score(
+        after_counts = counts.plus(gained_counts)
+        score_after = ExpectedScore.static_card_score(
             after_counts,
             min(min_oppo_bodyguards, after_counts[Card.Bodyguard]),
             max(max_oppo_bodyguards, after_counts[Card.Bodyguard]),
@@ -222,3 +252,39 @@ class ExpectedScore:
         marginal_gain = score_after - score_now
         return marginal_gain
 
+    @staticmethod
+    def marginal_card_scores(counts, cards, min_oppo_bodyguards, max_oppo_bodyguards, num_rounds_remaining):
+        """Marginal score of gaining a single card, for each of the given cards at once.
+
+        Gaining one card changes only the score component of its own kind, so each
+        value is a constant-time difference of that component instead of two full scorings.
+        """
+        bodyguards = counts[Card.Bodyguard]
+        drivers = counts[Card.Driver]
+        num_unique_trinkets = len([t for t in pieces.TRINKET_CARDS if counts[t]])
+        num_unique_businesses = len([b for b in pieces.BUSINESS_CARDS if counts[b]])
+        marginals = {}
+        for card in cards:
+            n = counts[card]
+            if card.is_trinket:
+                gain = 0 if n else TRINKET_SCORES[num_unique_trinkets + 1] - TRINKET_SCORES[num_unique_trinkets]
+            elif card.is_business:
+                gain = _business_multi_score(n + 1) - _business_multi_score(n)
+                if not n:
+                    gain += BUSINESS_UNIQUE_SCORES[num_unique_businesses + 1] - BUSINESS_UNIQUE_SCORES[num_unique_businesses]
+            elif card == Card.Bodyguard:
+                now = _bodyguard_standing(bodyguards, min(min_oppo_bodyguards, bodyguards), max(max_oppo_bodyguards, bodyguards))
+                after = _bodyguard_standing(bodyguards + 1, min(min_oppo_bodyguards, bodyguards + 1), max(max_oppo_bodyguards, bodyguards + 1))
+                gain = (after - now) * (1 + num_rounds_remaining)
+            elif card == Card.GoldCoin:
+                gain = 3
+            elif card == Card.Thief:
+                gain = 2
+            elif card == Card.Car:
+                gain = 1 if drivers else 0
+            elif card == Card.Driver:
+                gain = 1 if drivers else 1 + counts[Card.Car]
+            else:
+                gain = 0
+            marginals[card] = gain
+        return marginals
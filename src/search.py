@@ -0,0 +1,171 @@
+"""
+Search-based agent: determinized Monte Carlo rollouts.
+
+At every decision the agent samples the unseen deck order, forces one candidate decision at the
+pending decision point and plays the game out with fast rollout agents. Candidates are picked by
+UCB1 while the budget lasts; the candidate with the best mean outcome is returned whenever the
+budget runs out, so the search is anytime.
+"""
+
+import itertools
+import math
+import sys
+import time
+
+from control import ActionType
+from agent import PlayerAgent, TrivialPlayerAgent
+from randomness import GameRandom
+from pieces import Card
+
+
+DEFAULT_MAX_ROLLOUTS = 100  # Rollouts per decision, when no budget is given.
+DEFAULT_EXPLORATION = 10.0  # UCB1 exploration constant, in points.
+
+
+class _ForcedAgent(PlayerAgent):
+    """Makes the given decision at the pending decision point, then follows the rollout policy."""
+    def __init__(self, policy, kind, decision):
+        super().__init__(policy.name)
+        self._policy = policy
+        self._kind = kind
+        self._decision = decision
+        self._stolen = None
+    def act(self, game_view):
+        if self._kind == 'act':
+            self._kind = None
+            action, self._stolen = self._decision
+            return action
+        return self._policy.act(game_view)
+    def bid(self, game_view, auction_view, player_view, is_mandated):
+        if self._kind == 'bid':
+            self._kind = None
+            return self._decision
+        return self._policy.bid(game_view, auction_view, player_view, is_mandated)
+    def steal(self, game_view):
+        if self._kind == 'act':  # cloned at a pending theft: the action was already taken
+            self._kind = None
+            self._stolen = self._decision[1]
+        stolen, self._stolen = self._stolen, None
+        return list(stolen) if stolen else self._policy.steal(game_view)
+
+
+def _rollout(game, seat, agents, kind, decision, rng):
+    # Outcome of one rollout: own score minus the best opponent score.
+    agents = list(agents)
+    agents[seat] = _ForcedAgent(agents[seat], kind, decision)
+    scores = [s.final_score() for s in game.clone(agents, rng, redeterminize=True).play_game().values()]
+    own = scores.pop(seat)
+    return own - max(scores)
+
+def _rollout_batch(game, seat, agents, kind, candidates, seed, time_budget, max_rollouts):
+    # Round-robin over the candidates; used by pool workers, which cannot share UCB statistics.
+    deadline = time.perf_counter() + time_budget if time_budget else None
+    totals, counts = len(candidates) * [0.0], len(candidates) * [0]
+    for i in range(max_rollouts):
+        if deadline and time.perf_counter() >= deadline:
+            break
+        c = i % len(candidates)
+        totals[c] += _rollout(game, seat, agents, kind, candidates[c], GameRandom(seed, i))
+        counts[c] += 1
+    return totals, counts
+
+
+class SearchPlayerAgent(PlayerAgent):
+    """Determinized rollout search under a per-decision budget.
+
+    "time_budget" is in seconds of wall-clock time and "max_rollouts" caps the rollouts; either or both
+    may be given. With an "executor" (a thread or process pool), rollouts are spread over "workers" tasks.
+    """
+    def __init__(self, name, time_budget=None, max_rollouts=None, executor=None, workers=1, exploration=DEFAULT_EXPLORATION):
+        super().__init__(name)
+        self._time_budget = time_budget
+        self._max_rollouts = max_rollouts if max_rollouts or time_budget else DEFAULT_MAX_ROLLOUTS
+        self._executor = executor
+        self._workers = workers
+        self._exploration = exploration
+        self._rollout_agents = {}
+        self._stolen = None
+        self.num_rollouts = 0
+        self.search_time = 0.0
+
+    @property
+    def rollouts_per_second(self):
+        return self.num_rollouts / self.search_time if self.search_time else 0.0
+
+    def _agents(self, num_players):
+        if num_players not in self._rollout_agents:
+            self._rollout_agents[num_players] = [TrivialPlayerAgent('Rollout {}'.format(i + 1)) for i in range(num_players)]
+        return self._rollout_agents[num_players]
+
+    def _select(self, totals, counts, num_done):
+        for c, n in enumerate(counts):
+            if not n:
+                return c
+        log_n = math.log(num_done)
+        return max(range(len(counts)), key=lambda c: totals[c] / counts[c] + self._exploration * math.sqrt(log_n / counts[c]))
+
+    def _search_serial(self, game, seat, agents, kind, candidates, seed, deadline):
+        totals, counts = len(candidates) * [0.0], len(candidates) * [0]
+        for i in range(self._max_rollouts or sys.maxsize):
+            if deadline and time.perf_counter() >= deadline:
+                break
+            c = self._select(totals, counts, i)
+            totals[c] += _rollout(game, seat, agents, kind, candidates[c], GameRandom(seed, i))
+            counts[c] += 1
+        return totals, counts
+
+    def _search_pooled(self, game, seat, agents, kind, candidates, seed, deadline):
+        time_budget = deadline - time.perf_counter() if deadline else None
+        max_rollouts = -(-self._max_rollouts // self._workers) if self._max_rollouts else sys.maxsize
+        futures = [self._executor.submit(_rollout_batch, game, seat, agents, kind, candidates, '{}:{}'.format(seed, w), time_budget, max_rollouts)
+                   for w in range(self._workers)]
+        totals, counts = len(candidates) * [0.0], len(candidates) * [0]
+        for f in futures:
+            batch_totals, batch_counts = f.result()
+            totals = [a + b for a, b in zip(totals, batch_totals)]
+            counts = [a + b for a, b in zip(counts, batch_counts)]
+        return totals, counts
+
+    def _search(self, game_view, kind, candidates):
+        if len(candidates) == 1:
+            return candidates[0]
+        start = time.perf_counter()
+        deadline = start + self._time_budget if self._time_budget else None
+        seed = game_view.random.getrandbits(64)
+        agents = self._agents(len(game_view.get_all_player_views()))
+        game = game_view.sample_game(agents, GameRandom(seed, 'base'))
+        search = self._search_pooled if self._executor else self._search_serial
+        totals, counts = search(game, game_view.seat, agents, kind, candidates, seed, deadline)
+        self.num_rollouts += sum(counts)
+        self.search_time += time.perf_counter() - start
+        tried = [c for c in range(len(candidates)) if counts[c]]
+        if not tried:
+            return candidates[0]  # out of time before the first rollout
+        return candidates[max(tried, key=lambda c: totals[c] / counts[c])]
+
+    def _theft_candidates(self, game_view):
+        thieves = game_view.get_active_player_view().num_available_thieves()
+        board_counts = game_view.get_board_view().card_counts()
+        board_cards = [c for c in Card for _ in range(board_counts[c])]
+        candidates = []
+        for n in range(1, min(thieves, len(board_cards)) + 1):
+            candidates.extend((ActionType.Thief, cards) for cards in dict.fromkeys(itertools.combinations(board_cards, n)))
+        return candidates
+
+    def act(self, game_view):
+        candidates = [(ActionType.AuctionByPlayer, None)] + self._theft_candidates(game_view)
+        if game_view.deck_size:
+            candidates.insert(0, (ActionType.Draw, None))
+        action, self._stolen = self._search(game_view, 'act', candidates)
+        return action
+
+    def bid(self, game_view, auction_view, player_view, is_mandated):
+        top = auction_view.highest_bid
+        cheques = [c for c in player_view.available_cheques() if not top or top < c]
+        return self._search(game_view, 'bid', cheques if is_mandated else [None] + cheques)
+
+    def steal(self, game_view):
+        if not self._stolen:
+            _, self._stolen = self._search(game_view, 'act', self._theft_candidates(game_view))
+        stolen, self._stolen = self._stolen, None
+        return list(stolen)
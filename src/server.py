@@ -0,0 +1,395 @@
+"""
+asyncio table server: many concurrent games in one event loop, played by agents in other processes.
+
+Every table plays a Game through Game.decisions(). Each decision request is encoded with the public
+state of its GameView and sent to the agent of its seat, over a pooled connection to that agent's
+process. The decision timeout covers the exchange on the connection, not the wait for a free one.
+An answer that misses the timeout is dropped, together with its connection, and the fallback agent
+decides instead; so it does when the connection fails, or when the answer is not a legal decision.
+"serve_agent" serves any of REMOTE_AGENTS in an agent process: agents that search sampled games need
+the hidden state, which stays on the server. StandInPool runs an agent in-process behind the same
+protocol, to load-test the server with no network.
+
+    python server.py agent --ai stealing --port 9101
+    python server.py tables --connect localhost:9101 localhost:9102 localhost:9103 --games 1000
+    python server.py tables --stand-in trivial --players 4 --games 10000
+
+Frames are a uint16 length and the payload.
+Request: uint32 request id, kind, seat, round, number of players, deck size, board cheque,
+    board policemen; card counts of the board and of the deck; per player the available cheque mask
+    (uint16) and card counts; for bids, the highest bid (0 for none) and whether the bid is mandated.
+Response: uint32 request id, then the decision in the codes of records.py (act: DRAW, AUCTION or THEFT);
+    an agent that fails on a request answers with the request id alone.
+"""
+
+import argparse
+import asyncio
+import logging
+import random
+import struct
+import sys
+import time
+
+from control import Game, ActionType, GAME_ROUNDS, AUTOMATIC_AUCTION_NUM_CARDS, ROUND_END_POLICEMEN, ROUND_END_POLICEMEN_TWOPLAYER
+from agent import PlayerAgent, TrivialPlayerAgent
+from agentview import AuctionView, BoardView, DeckView, PlayerView
+from randomness import GameRandom
+from pieces import Card, CardCounts, FrozenCardCounts, NUM_CARD_TYPES
+from records import PASS, DRAW, AUCTION, THEFT, CARDS_BY_ID, CHEQUES_BY_VALUE
+from razzia import AI_AGENTS
+
+
+KINDS = ('act', 'bid', 'steal')
+ACTION_CODES = {ActionType.Draw: DRAW, ActionType.AuctionByPlayer: AUCTION, ActionType.Thief: THEFT}
+ACTIONS_BY_CODE = {code: action for action, code in ACTION_CODES.items()}
+DEFAULT_TIMEOUT = 1.0  # Seconds per decision.
+DEFAULT_POOL_SIZE = 4  # Connections per agent process.
+DEFAULT_CONCURRENCY = 1000  # Tables in play at once.
+REMOTE_AGENTS = {name: AI_AGENTS[name] for name in ('trivial', 'stealing')}  # Agents that decide on the public state alone.
+
+_FRAME = struct.Struct('<H')
+_HEADER = struct.Struct('<IBBBBBBB')
+_ID = struct.Struct('<I')
+_MASK = struct.Struct('<H')
+
+
+##
+## Protocol
+##
+
+def encode_request(request_id, kind, args):
+    game_view = args[0]
+    board = game_view.get_board_view()
+    players = game_view.get_all_player_views()
+    data = bytearray(_HEADER.pack(request_id, KINDS.index(kind), game_view.seat, GAME_ROUNDS - game_view.rounds_remaining,
+                                  len(players), game_view.deck_size, board.cheque.value, board.num_policemen))
+    data += bytes(board.card_counts()) + bytes(game_view.get_deck_view().card_counts())
+    for p in players:
+        data += _MASK.pack(p.cheque_mask) + bytes(p.card_counts())
+    if kind == 'bid':
+        _, auction_view, _, is_mandated = args
+        top = auction_view.highest_bid
+        data += bytes([top.value if top else 0, is_mandated])
+    return bytes(data)
+
+def decode_request(data, rng):
+    """Request id, kind and the arguments of the agent call, with views rebuilt from the request."""
+    request_id, kind, seat, round, num_players, deck_size, cheque, policemen = _HEADER.unpack_from(data)
+    pos = _HEADER.size
+    board = _RemoteBoard(data[pos:pos + NUM_CARD_TYPES], CHEQUES_BY_VALUE[cheque], policemen)
+    deck = _RemoteDeck(data[pos + NUM_CARD_TYPES:pos + 2 * NUM_CARD_TYPES])
+    pos += 2 * NUM_CARD_TYPES
+    players = []
+    for _ in range(num_players):
+        mask, = _MASK.unpack_from(data, pos)
+        players.append(_RemotePlayer(mask, data[pos + _MASK.size:pos + _MASK.size + NUM_CARD_TYPES]))
+        pos += _MASK.size + NUM_CARD_TYPES
+    game_view = RemoteGameView(seat, round, deck_size, board, deck, players, rng)
+    if KINDS[kind] != 'bid':
+        return request_id, KINDS[kind], (game_view,)
+    top, is_mandated = data[pos], bool(data[pos + 1])
+    auction_view = AuctionView(_RemoteAuction(board.get_cards(), CHEQUES_BY_VALUE[top] if top else None))
+    return request_id, 'bid', (game_view, auction_view, game_view.get_active_player_view(), is_mandated)
+
+def encode_decision(kind, decision):
+    if kind == 'act':
+        return bytes([ACTION_CODES[decision]])
+    if kind == 'bid':
+        return bytes([decision.value if decision else PASS])
+    return bytes([THEFT + len(decision)] + [c.id for c in decision])
+
+def decode_decision(kind, data):
+    if kind == 'act':
+        return ACTIONS_BY_CODE[data[0]]
+    if kind == 'bid':
+        return CHEQUES_BY_VALUE[data[0]] if data[0] != PASS else None
+    if len(data) != 1 + data[0] - THEFT:
+        raise ValueError('Truncated theft: {}'.format(data.hex()))
+    return [CARDS_BY_ID[i] for i in data[1:]]
+
+def is_legal_decision(kind, args, decision):
+    """Whether "decision" is a legal answer to a request with the arguments "args" of the agent call."""
+    game_view = args[0]
+    player_view = game_view.get_active_player_view()
+    board_counts = game_view.get_board_view().card_counts()
+    if kind == 'act':
+        return decision != ActionType.Thief or (player_view.num_available_thieves() > 0 and sum(board_counts) > 0)
+    if kind == 'bid':
+        _, auction_view, _, is_mandated = args
+        if decision is None:
+            return not is_mandated
+        top = auction_view.highest_bid
+        return bool(player_view.cheque_mask & decision.bit) and (top is None or decision.value > top.value)
+    stolen = CardCounts.of(decision)
+    return len(decision) <= player_view.num_available_thieves() and all(n <= board_counts[c] for c, n in stolen.items())
+
+def handle_request(agent, payload, rng):
+    """Response of "agent" to an encoded request."""
+    request_id, kind, args = decode_request(payload, rng)
+    return _ID.pack(request_id) + encode_decision(kind, getattr(agent, kind)(*args))
+
+def _answer(agent, payload, rng):
+    # An agent that fails on a request answers with the request id alone: no decision, so the server falls back.
+    try:
+        return handle_request(agent, payload, rng)
+    except Exception:
+        logging.exception('Agent %s failed on a request', agent.name)
+        return payload[:_ID.size]
+
+
+##
+## Views for agents in another process, rebuilt from the public state of a request
+##
+
+class _RemotePlayer:
+    def __init__(self, mask, counts):
+        self.available_cheque_mask = mask
+        self._counts = FrozenCardCounts(counts)
+    def frozen_card_counts(self):
+        return self._counts
+
+class _RemoteBoard:
+    def __init__(self, counts, cheque, num_policemen):
+        self._counts = FrozenCardCounts(counts)
+        self.cheque = cheque
+        self.num_policemen = num_policemen
+        self.num_cards = sum(self._counts)
+    def frozen_card_counts(self):
+        return self._counts
+    def get_cards(self):
+        return [c for c in Card for _ in range(self._counts[c])]
+
+class _RemoteDeck:
+    def __init__(self, counts):
+        self._counts = FrozenCardCounts(counts)
+    def frozen_card_counts(self):
+        return self._counts
+    def size(self):
+        return sum(self._counts)
+
+class _RemoteAuction:
+    def __init__(self, auctioned_cards, highest_bid):
+        self.auctioned_cards = auctioned_cards
+        self.highest_bid = highest_bid
+
+
+class RemoteGameView:
+    """GameView of a decision request; the random stream is that of the agent process."""
+    def __init__(self, seat, round, deck_size, board, deck, players, rng):
+        self._seat = seat
+        self._round = round
+        self._deck_size = deck_size
+        self._player_views = [PlayerView(p) for p in players]
+        self._board_view = BoardView(board)
+        round_end_policemen = ROUND_END_POLICEMEN if len(players) > 2 else ROUND_END_POLICEMEN_TWOPLAYER
+        self._deck_view = DeckView(deck, board, round_end_policemen, AUTOMATIC_AUCTION_NUM_CARDS)
+        self._rng = rng
+    def get_active_player_view(self):
+        return self._player_views[self._seat]
+    def get_all_player_views(self):
+        return list(self._player_views)
+    def get_board_view(self):
+        return self._board_view
+    def get_deck_view(self):
+        return self._deck_view
+    @property
+    def rounds_remaining(self):
+        return GAME_ROUNDS - self._round
+    @property
+    def deck_size(self):
+        return self._deck_size
+    @property
+    def seat(self):
+        return self._seat
+    def sample_game(self, player_agents, rng):
+        raise Exception('Remote agents cannot sample games: the hidden state stays on the server.')
+    @property
+    def random(self):
+        return self._rng
+
+
+##
+## Agent side
+##
+
+async def _read_frame(reader):
+    size, = _FRAME.unpack(await reader.readexactly(_FRAME.size))
+    return await reader.readexactly(size)
+
+def _frame(payload):
+    return _FRAME.pack(len(payload)) + payload
+
+async def serve_agent(agent, host='localhost', port=0, seed=None):
+    """Serve "agent" on a socket until cancelled; returns the started asyncio server."""
+    rng = random.Random(seed)
+    async def serve_connection(reader, writer):
+        try:
+            while True:
+                writer.write(_frame(_answer(agent, await _read_frame(reader), rng)))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # the server closed the connection, for example after a timeout
+        finally:
+            writer.close()
+    return await asyncio.start_server(serve_connection, host, port)
+
+
+##
+## Server side
+##
+
+class AgentPool:
+    """Up to "size" connections to the agent process at "host":"port", opened on demand and reused."""
+    def __init__(self, host, port, size=DEFAULT_POOL_SIZE):
+        self._host = host
+        self._port = port
+        self._slots = asyncio.Semaphore(size)
+        self._idle = []
+    async def request(self, payload, timeout=None):
+        """Response to "payload"; "timeout" only covers the exchange, not waiting for or opening a connection."""
+        async with self._slots:
+            reader, writer = self._idle.pop() if self._idle else await asyncio.open_connection(self._host, self._port)
+            try:
+                response = await asyncio.wait_for(self._exchange(reader, writer, payload), timeout)
+            except BaseException:
+                writer.close()  # also on a timeout: a late answer would arrive out of step
+                raise
+            self._idle.append((reader, writer))
+            return response
+    @staticmethod
+    async def _exchange(reader, writer, payload):
+        writer.write(_frame(payload))
+        await writer.drain()
+        response = await _read_frame(reader)
+        if response[:_ID.size] != payload[:_ID.size]:
+            raise ConnectionError('Response to request {} answers request {}.'.format(_ID.unpack_from(payload)[0], _ID.unpack_from(response)[0]))
+        return response
+    def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+class StandInPool:
+    """In-process stand-in for an agent process: requests go through the protocol, but not a socket."""
+    def __init__(self, agent, delay=0.0, seed=None):
+        self._agent = agent
+        self._delay = delay
+        self._rng = random.Random(seed)
+    async def request(self, payload, timeout=None):
+        return await asyncio.wait_for(self._exchange(payload), timeout)
+    async def _exchange(self, payload):
+        await asyncio.sleep(self._delay)  # simulated network and thinking time; also yields to other tables
+        return _answer(self._agent, payload, self._rng)
+    def close(self):
+        pass
+
+
+_ILLEGAL = object()
+
+class _Seat(PlayerAgent):
+    """Seat of a remote agent: decisions are asked through the table server, never from this object."""
+    pass
+
+
+class TableServer:
+    """Plays tables whose seats are served by "pools", one per seat; "fallback" decides when a seat does not."""
+    def __init__(self, pools, timeout=DEFAULT_TIMEOUT, fallback=None):
+        if not 2 <= len(pools) <= 5:
+            raise Exception('Unsupported number of players: {}'.format(len(pools)))
+        self._pools = list(pools)
+        self._timeout = timeout
+        self._fallback = fallback if fallback else TrivialPlayerAgent('Fallback')
+        self._next_id = 0
+        self.num_decisions = 0
+        self.num_timeouts = 0
+        self.num_failures = 0  # connections that failed
+        self.num_illegal = 0  # answers that were not legal decisions
+
+    async def _decide(self, request):
+        self._next_id = request_id = (self._next_id + 1) % 2**32
+        game_view = request.args[0]
+        try:
+            response = await self._pools[game_view.seat].request(encode_request(request_id, request.kind, request.args), self._timeout)
+        except asyncio.TimeoutError:
+            self.num_timeouts += 1
+            return getattr(self._fallback, request.kind)(*request.args)
+        except (OSError, EOFError):  # the pool dropped the connection
+            self.num_failures += 1
+            return getattr(self._fallback, request.kind)(*request.args)
+        try:
+            decision = decode_decision(request.kind, response[_ID.size:])
+        except (KeyError, IndexError, ValueError):
+            decision = _ILLEGAL
+        if decision is _ILLEGAL or not is_legal_decision(request.kind, request.args, decision):
+            self.num_illegal += 1
+            return getattr(self._fallback, request.kind)(*request.args)
+        self.num_decisions += 1
+        return decision
+
+    async def play_table(self, rng):
+        game = Game([_Seat('Seat {}'.format(i + 1)) for i in range(len(self._pools))], rng)
+        decisions = game.decisions()
+        answer = None
+        while True:
+            try:
+                request = decisions.send(answer)
+            except StopIteration as stop:
+                return stop.value
+            answer = await self._decide(request)
+
+    async def run(self, num_games, seed, concurrency=DEFAULT_CONCURRENCY):
+        """Scorings of "num_games" seeded tables, with at most "concurrency" of them in play at once."""
+        tables = asyncio.Semaphore(concurrency)
+        async def play(i):
+            async with tables:
+                return await self.play_table(GameRandom(seed, i))
+        return await asyncio.gather(*(play(i) for i in range(num_games)))
+
+
+async def _run_tables(options):
+    if options.stand_in:
+        pools = [StandInPool(REMOTE_AGENTS[options.stand_in]('Stand-in {}'.format(i + 1)), options.delay, seed=i) for i in range(options.players)]
+    else:
+        addresses = [a.rsplit(':', 1) for a in options.connect]
+        pools = [AgentPool(host, int(port), options.pool_size) for host, port in addresses]
+    table_server = TableServer(pools, options.timeout)
+    start = time.perf_counter()
+    scorings = await table_server.run(options.games, options.seed, options.concurrency)
+    elapsed = time.perf_counter() - start
+    for pool in pools:
+        pool.close()
+    print('{} games in {:.2f} s: {:.1f} games/s, {:.0f} decisions/s, {} timeouts, {} failures, {} illegal answers'.format(
+        len(scorings), elapsed, len(scorings) / elapsed, table_server.num_decisions / elapsed, table_server.num_timeouts,
+        table_server.num_failures, table_server.num_illegal))
+
+async def _run_agent(options):
+    server = await serve_agent(REMOTE_AGENTS[options.ai]('Agent'), options.host, options.port, options.seed)
+    print('Serving {} agent on {}'.format(options.ai, ', '.join(str(s.getsockname()) for s in server.sockets)))
+    async with server:
+        await server.serve_forever()
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Razzia! table server and agent processes.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    agent_parser = commands.add_parser('agent', help='serve an AI agent')
+    agent_parser.add_argument('--ai', choices=list(REMOTE_AGENTS), default='trivial')
+    agent_parser.add_argument('--host', default='localhost')
+    agent_parser.add_argument('--port', type=int, required=True)
+    agent_parser.add_argument('--seed', type=int)
+    tables_parser = commands.add_parser('tables', help='play tables against agent processes or in-process stand-ins')
+    seats = tables_parser.add_mutually_exclusive_group(required=True)
+    seats.add_argument('--connect', nargs='+', metavar='HOST:PORT', help='agent process of each seat')
+    seats.add_argument('--stand-in', choices=list(REMOTE_AGENTS), help='in-process agent for every seat')
+    tables_parser.add_argument('--players', type=int, default=4, help='number of stand-in seats')
+    tables_parser.add_argument('--delay', type=float, default=0.0, help='simulated latency of stand-in decisions, in seconds')
+    tables_parser.add_argument('--games', type=int, default=1000)
+    tables_parser.add_argument('--seed', type=int, default=1)
+    tables_parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='seconds per decision')
+    tables_parser.add_argument('--pool-size', type=int, default=DEFAULT_POOL_SIZE, help='connections per agent process')
+    tables_parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY, help='tables in play at once')
+    options = parser.parse_args(args)
+    asyncio.run(_run_agent(options) if options.command == 'agent' else _run_tables(options))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,154 @@
+"""
+Parameter sweeps for tuning agents.
+
+A sweep rates parameter sets of one agent type by their mean margin over the best opponent, in games
+against a fixed field of agents. Every parameter set plays the same seeded games from every seat, and
+all of them draw from one random stream, so the ratings share common random numbers as in duplicate
+matches. Games are played in blocks on a process pool. The margins of each finished block are cached
+on disk, keyed by the parameters, the agent mix and the game range: resumed or extended sweeps only
+play the blocks that are not cached yet.
+
+Parameter sets come from a full grid, or are narrowed by successive halving: every set plays a few
+games, the best "1/eta" of them play "eta" times as many, and so on until one is left.
+"""
+
+import argparse
+import itertools
+import json
+import sys
+
+from control import Game
+from randomness import GameRandom
+from analytics import RunningStats
+from razzia import AI_AGENTS
+from tournament import AgentConfig, ResultCache, agent_config, make_agent, map_on_workers, confidence_interval
+from duplicate import CANDIDATE_STREAM
+
+
+DEFAULT_BLOCK_GAMES = 20  # Games per cached block.
+DEFAULT_ETA = 2
+
+
+def grid(**axes):
+    """Parameter sets of the full grid over the given values of each parameter."""
+    names = sorted(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*(axes[n] for n in names))]
+
+
+def _play_block(config, field, seed, first_game_idx, num_games):
+    # Per game, the mean margin of the configuration over all seats.
+    candidate = make_agent(config)
+    field_agents = [make_agent(c) for c in field]
+    margins = []
+    for i in range(first_game_idx, first_game_idx + num_games):
+        total = 0
+        for seat in range(len(field) + 1):
+            seating = field_agents[:seat] + [candidate] + field_agents[seat:]
+            scores = [s.final_score() for s in Game(seating, GameRandom(seed, i), streams_by_agent=True).play_game().values()]
+            total += scores[seat] - max(scores[:seat] + scores[seat + 1:])
+        margins.append(total / (len(field) + 1))
+    return margins
+
+
+class SweepResult:
+    def __init__(self):
+        self.margins = {}  # RunningStats by parameter set, as sorted (name, value) tuples
+    def best(self):
+        """Parameters with the highest mean margin among those that played the most games."""
+        params = max(self.margins, key=lambda p: (self.margins[p].n, self.margins[p].mean))
+        return dict(params)
+    def ranking(self, param_sets):
+        return sorted(param_sets, key=lambda p: -self.margins[tuple(sorted(p.items()))].mean)
+    def report(self):
+        s_template = 'margin {:+.2f} ± {:.2f} in {} games: {}'
+        ranked = sorted(self.margins.items(), key=lambda item: (-item[1].n, -item[1].mean))
+        return '\n'.join(s_template.format(*confidence_interval(m), m.n, dict(p)) for p, m in ranked)
+
+
+class Sweep:
+    """Rates parameter sets of agent type "ai" against the "field" configurations in the other seats."""
+    def __init__(self, ai, field, seed=1, block_games=DEFAULT_BLOCK_GAMES, cache_path=None):
+        if CANDIDATE_STREAM in {c.name for c in field} or len({c.name for c in field}) != len(field):
+            raise Exception('Field configuration names must be unique and differ from "{}".'.format(CANDIDATE_STREAM))
+        if not 2 <= len(field) + 1 <= 5:
+            raise Exception('Unsupported number of players: {}'.format(len(field) + 1))
+        self._ai = ai
+        self._field = list(field)
+        self._seed = seed
+        self._block_games = block_games
+        self._cache = ResultCache(cache_path)
+        self.games_played = 0
+
+    def _cache_key(self, params, block_idx):
+        # Cache keys cover the parameters, the agent mix and the games, not the agent code.
+        return [self._ai, [list(p) for p in params], [[c.name, c.ai, list(c.params)] for c in self._field],
+                len(self._field) + 1, self._seed, block_idx * self._block_games, self._block_games]
+    def _play(self, blocks, workers):
+        n = len(blocks)
+        configs = [AgentConfig(CANDIDATE_STREAM, self._ai, params) for params, _ in blocks]
+        args = (configs, n * [self._field], n * [self._seed], [b * self._block_games for _, b in blocks], n * [self._block_games])
+        return map_on_workers(_play_block, args, workers)
+
+    def evaluate(self, param_sets, num_games, workers=1, result=None):
+        """Rate the parameter sets over the first "num_games" games, rounded up to whole blocks."""
+        result = result if result else SweepResult()
+        keys = [tuple(sorted(p.items())) for p in param_sets]
+        blocks = [(params, b) for params in keys for b in range(-(-num_games // self._block_games))]
+        margins = {block: self._cache.load(self._cache_key(*block)) for block in blocks}
+        pending = [block for block in blocks if margins[block] is None]
+        for block, block_margins in zip(pending, self._play(pending, workers)):
+            self._cache.store(self._cache_key(*block), block_margins)
+            margins[block] = block_margins
+            self.games_played += len(block_margins) * (len(self._field) + 1)
+        for params in keys:
+            result.margins[params] = RunningStats()
+        for (params, _), block_margins in margins.items():
+            for m in block_margins:
+                result.margins[params].add(m)
+        return result
+
+    def successive_halving(self, param_sets, min_games, eta=DEFAULT_ETA, max_games=None, workers=1):
+        """Keep the best "1/eta" of the parameter sets and play "eta" times as many games, until one set is left."""
+        survivors, num_games = list(param_sets), min_games
+        result = SweepResult()
+        while True:
+            self.evaluate(survivors, num_games, workers, result)
+            if len(survivors) == 1 or (max_games and num_games >= max_games):
+                return result
+            survivors = result.ranking(survivors)[:max(1, len(survivors) // eta)]
+            num_games = min(num_games * eta, max_games) if max_games else num_games * eta
+
+
+def _parse_value(s):
+    # JSON values, with lists as tuples so that parameter sets stay hashable.
+    value = json.loads(s)
+    return tuple(value) if isinstance(value, list) else value
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description='Razzia! agent parameter sweeps.')
+    parser.add_argument('--ai', choices=list(AI_AGENTS), default='stealing', help='agent type to tune')
+    parser.add_argument('--param', nargs='+', action='append', required=True, metavar=('NAME', 'VALUE'),
+                        help='parameter and its JSON values, for example: --param valuable_threshold 3 4 5')
+    parser.add_argument('--field', nargs='+', choices=list(AI_AGENTS), default=['trivial', 'trivial'], help='opponent agent types')
+    parser.add_argument('--games', type=int, default=200, help='games per parameter set (the first round, with --halving)')
+    parser.add_argument('--halving', action='store_true', help='successive halving instead of the full grid')
+    parser.add_argument('--eta', type=int, default=DEFAULT_ETA)
+    parser.add_argument('--max-games', type=int, help='games per parameter set at most, with --halving')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--cache', help='directory for cached results')
+    options = parser.parse_args(args)
+    param_sets = grid(**{p[0]: [_parse_value(v) for v in p[1:]] for p in options.param})
+    field = [agent_config('Field {}'.format(i + 1), ai) for i, ai in enumerate(options.field)]
+    sweep = Sweep(options.ai, field, options.seed, cache_path=options.cache)
+    if options.halving:
+        result = sweep.successive_halving(param_sets, options.games, options.eta, options.max_games, options.workers)
+    else:
+        result = sweep.evaluate(param_sets, options.games, options.workers)
+    print(result.report())
+    print('Best: {} ({} games played)'.format(result.best(), sweep.games_played))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,6 +1,16 @@
+import concurrent.futures
+import statistics
+import tempfile
 import unittest
+import razzia
 from razzia import Razzia
-from scoring import Score
+import analytics
+import columnar
+import events
+from control import Game
+from randomness import GameRandom
+from scoring import Score, ExpectedScore
+from pieces import Card, CardCounts, FrozenCardCounts, Deck
 
 class TestRazziaScoring(unittest.TestCase):
 
@@ -9,13 +19,13 @@ class TestRazziaScoring(unittest.TestCase):
         r = Razzia(n, ai='trivial', random_seed=1)
         scorings = r.play_game()
         name_to_agent = {agent.name : agent for agent in scorings.keys()}
-        expected_total_scores = [0, 4, 22, 34]
+        expected_total_scores = [-15, 13, 58, 24]
         expected_detailed_scores = [
             # Trinkets, Bodyguards, Cars, Drivers, GoldCoins, Thieves, Businesses, Cheques
-            [ -5, -6, 2, 3, 0, 2,  4,  0],
-            [-10, -4, 5, 1, 0, 2,  5,  5],
-            [ -5, 15, 4, 1, 0, 2, 10, -5],
-            [  5,  3, 4, 2, 3, 6,  6,  5]
+            [-10, -6,  0, 0, 3, 2,  1, -5],
+            [  0, -6,  5, 1, 3, 0,  5,  5],
+            [ -5, 15, 12, 5, 0, 6, 25,  0],
+            [  0,  5,  4, 4, 3, 4,  4,  0]
         ]
         for player_id in range(n):
             s = scorings[name_to_agent[Razzia.DEFAULT_PLAYER_NAMES[player_id]]]
@@ -28,13 +38,13 @@ class TestRazziaScoring(unittest.TestCase):
         r = Razzia(n, ai='stealing', random_seed=1)
         scorings = r.play_game()
         name_to_agent = {agent.name : agent for agent in scorings.keys()}
-        expected_total_scores = [42, 4, -2, -2]
+        expected_total_scores = [12, -2, 28, 45]
         expected_detailed_scores = [
             # Trinkets, Bodyguards, Cars, Drivers, GoldCoins, Thieves, Businesses, Cheques
-            [ 10, 15, 0, 0, 0, 6,  6,  5],
-            [-10, -2, 6, 2, 3, 0,  5,  0],
-            [-10, -4, 7, 2, 0, 0,  3,  0],
-            [ -5, -2, 3, 2, 0, 0,  5, -5]
+            [  0, -2,  1, 1, 3, 0, 9,  0],
+            [ -5, -6,  0, 0, 3, 0, 6,  0],
+            [-10, 15,  4, 4, 0, 4, 6,  5],
+            [ 15,  5, 12, 5, 3, 6, 4, -5]
         ]
         for player_id in range(n):
             s = scorings[name_to_agent[Razzia.DEFAULT_PLAYER_NAMES[player_id]]]
@@ -42,7 +52,622 @@ class TestRazziaScoring(unittest.TestCase):
             self.assertEqual(s.final_score(), expected_total_scores[player_id])
             self.assertEqual([by_type[s] for s in Score], expected_detailed_scores[player_id])
 
+    def test_single_game_replays_from_seed_and_index(self):
+        r = Razzia(4, ai='trivial', random_seed=7)
+        games = r.play_games(5)
+        replayed = r.play_game(game_idx=3)
+        self.assertEqual([s.final_score_by_type() for s in games[3].values()], [s.final_score_by_type() for s in replayed.values()])
 
+    def test_card_counts_index_by_card_and_frozen_counts_stay_fixed(self):
+        cards = [Card.Ring, Card.Ring, Card.Bodyguard, Card.Restaurant, Card.Policeman]
+        counts = CardCounts.of(cards)
+        with self.assertRaises(TypeError):
+            list(Card)[Card.Ring]  # Cards only index count vectors
+        self.assertEqual(dict(counts.items()), {c: cards.count(c) for c in Card})
+        self.assertEqual(dict(zip(counts.keys(), counts.values())), dict(counts.items()))  # as the former dict of counts
+        self.assertEqual([counts[c] for c in Card], [counts[c.idx] for c in Card])
+        self.assertEqual(counts.total(), len(cards))
+        frozen = FrozenCardCounts(counts)
+        counts[Card.Ring] += 1
+        self.assertEqual(frozen[Card.Ring], 2)
+        with self.assertRaises(TypeError):
+            frozen[Card.Ring] = 0
+        self.assertFalse(hasattr(frozen, 'add') or hasattr(frozen, 'subtract'))
+        more = frozen.plus(CardCounts.of([Card.Ring]))
+        more.add(CardCounts.of([Card.Car]))
+        self.assertEqual(list(more.minus(frozen).items()), list(CardCounts.of([Card.Ring, Card.Car]).items()))
+        copy = frozen.copy()
+        copy.subtract(frozen)
+        self.assertEqual((copy.total(), frozen.total()), (0, len(cards)))
+        self.assertIsInstance(copy, CardCounts)
+
+    def test_cheque_masks_match_cheque_sets(self):
+        import random
+        from pieces import Cheque, cheque_mask, mask_cheques, mask_highest_cheque, mask_lowest_cheque, mask_lowest_cheque_above, mask_size
+        from player import Player
+        from agent import TrivialPlayerAgent
+        rng = random.Random(3)
+        for _ in range(200):
+            cheques = set(rng.sample(list(Cheque), rng.randrange(len(Cheque) + 1)))
+            mask = cheque_mask(cheques)
+            self.assertEqual(mask_cheques(mask), sorted(cheques))
+            self.assertEqual(mask_size(mask), len(cheques))
+            self.assertEqual(mask_highest_cheque(mask), max(cheques) if cheques else None)
+            self.assertEqual(mask_lowest_cheque(mask), min(cheques) if cheques else None)
+            for top in Cheque:
+                above = [c for c in cheques if top < c]
+                self.assertEqual(mask_lowest_cheque_above(mask, top), min(above) if above else None)
+        self.assertEqual({Cheque.Five: 'a', Cheque(5): 'b'}, {Cheque.Five: 'b'})  # cheques hash and compare by identity
+        player = Player(TrivialPlayerAgent('A'), [Cheque.Two, Cheque.Six, Cheque.Thirteen])
+        player.remove_available_cheque(Cheque.Six)
+        with self.assertRaises(Exception):
+            player.remove_available_cheque(Cheque.Six)  # no longer held
+        with self.assertRaises(Exception):
+            player.remove_available_cheque(Cheque.Seven)  # never held
+        self.assertEqual((player.available_cheques(), player.cheque_total), ([Cheque.Two, Cheque.Thirteen], 15))
+        self.assertEqual(player.lowest_cheque_above(Cheque.Two), Cheque.Thirteen)
+        self.assertIsNone(player.lowest_cheque_above(Cheque.Thirteen))
+        player.add_unavailable_cheque(Cheque.One)
+        self.assertEqual((player.num_available_cheques, player.num_unavailable_cheques, player.cheque_total), (2, 1, 16))
+        player.remove_available_cheque(Cheque.Two)
+        player.remove_available_cheque(Cheque.Thirteen)
+        self.assertTrue(player.round_is_over)
+        self.assertEqual((player.highest_cheque, player.lowest_cheque), (None, None))
+        player.refresh_cheques()
+        self.assertEqual((player.available_cheques(), player.unavailable_cheque_mask), ([Cheque.One], 0))
+
+    def test_batched_marginal_scores_match_single_card_scores(self):
+        cards = [c for c in Card if c != Card.Policeman]
+        counts = CardCounts.of([Card.Ring, Card.Ring, Card.Bodyguard, Card.Car, Card.Casino, Card.Casino, Card.Film])
+        for min_bg, max_bg, rounds in [(0, 0, 2), (1, 3, 1), (2, 2, 0)]:
+            batched = ExpectedScore.marginal_card_scores(counts, cards, min_bg, max_bg, rounds)
+            for card in cards:
+                single = ExpectedScore.marginal_card_score(counts, CardCounts.of([card]), min_bg, max_bg, rounds)
+                self.assertEqual(batched[card], single)
+
+    def test_parallel_games_match_serial(self):
+        r = Razzia(4, ai='trivial', random_seed=1)
+        serial = r.play_games(40, workers=1, chunk_games=10)
+        parallel = r.play_games(40, workers=2, chunk_games=10)
+        self.assertEqual(list(serial[0]), list(parallel[0]))
+        for s, p in zip(serial, parallel):
+            self.assertEqual([x.final_score_by_type() for x in s.values()], [x.final_score_by_type() for x in p.values()])
+
+    def test_streamed_card_values_match_batch(self):
+        r = Razzia(4, ai='trivial', random_seed=5)
+        multi_scorings = r.play_games(30)
+        stats = r.collect_statistics(30, chunk_games=7)
+        for card in [Card.Ring, Card.Bodyguard, Card.Driver]:
+            points = [sc.scored_points for scores in multi_scorings for s in scores.values() for sc in s.final_scoring_cards() if sc.card == card]
+            streamed = stats.card_value._points[card]
+            self.assertEqual(streamed.n, len(points))
+            self.assertAlmostEqual(streamed.mean, statistics.mean(points))
+            self.assertAlmostEqual(streamed.stdev, statistics.stdev(points))
+
+    def test_traced_game_events_round_trip_and_keep_scores(self):
+        r = Razzia(4, ai='stealing', random_seed=3)
+        untraced = [s.final_score() for s in r.play_game().values()]
+        recorded = []
+        class ListSink(events.Sink):
+            def handle(self, event):
+                recorded.append(event)
+        counter, recorder = events.CounterSink(), events.BinaryRecorderSink()
+        tracer = events.Tracer([ListSink(), counter, recorder])
+        traced = [s.final_score() for s in Game(r._player_agents, GameRandom(3, 0), tracer=tracer).play_game().values()]
+        self.assertEqual(traced, untraced)
+        self.assertEqual(recorded[-1].scores, untraced)
+        self.assertEqual(counter.counts[events.EventType.RoundScoring], 3 * 4)
+        self.assertEqual(list(events.decode_events(recorder.getvalue())), recorded)
+
+    def test_recorded_games_replay_from_corpus(self):
+        r = Razzia(4, ai='stealing', random_seed=8)
+        with tempfile.TemporaryDirectory() as path:
+            r.record_games(path, 3, chunk_games=2)
+            r.record_games(path, 3)
+            for game_idx in [0, 2, 5]:
+                scorings = r.replay_game(path, game_idx)
+                expected = r.play_game(game_idx % 3)
+                self.assertEqual([s.final_score_by_type() for s in scorings.values()], [s.final_score_by_type() for s in expected.values()])
+
+    def test_lean_replay_matches_engine_and_beats_live_play(self):
+        import time
+        import records
+        from agent import TrivialPlayerAgent, StealingPlayerAgent
+        corpus = []
+        for n in (2, 3, 5):
+            agents = [StealingPlayerAgent(str(i)) for i in range(n)]
+            corpus.extend(records.record_game(agents, GameRandom(n, i))[1] for i in range(10))
+        for record in corpus:
+            lean, engine = records.replay_game(record), records.replay_game_in_engine(record)
+            self.assertEqual([s.final_score_by_type() for s in lean.values()], [s.final_score_by_type() for s in engine.values()])
+        live_agents = [TrivialPlayerAgent(str(i)) for i in range(4)]
+        corpus = [records.record_game([StealingPlayerAgent(str(i)) for i in range(4)], GameRandom(4, i))[1] for i in range(30)]
+        def best_time(fn):
+            times = []
+            for _ in range(3):
+                start = time.perf_counter()
+                fn()
+                times.append(time.perf_counter() - start)
+            return min(times)
+        replay_time = best_time(lambda: [records.replay_game(record) for record in corpus])
+        live_time = best_time(lambda: [Game(live_agents, GameRandom(4, i)).play_game() for i in range(30)])
+        self.assertLess(replay_time, 0.75 * live_time)  # about 0.45 when measured
+
+    def test_snapshots_are_shared_per_decision_and_dropped_on_change(self):
+        from agent import StealingPlayerAgent
+        from agentview import GameSnapshot
+        def public_state(snapshot):
+            board = snapshot.board_view
+            players = [(tuple(v.card_counts()), v.cheque_mask) for v in snapshot.player_views]
+            return players, tuple(board.card_counts()), board.num_policemen, board.cheque, snapshot.deck_size, snapshot.rounds_remaining
+        log = []
+        class Recording(StealingPlayerAgent):
+            def _record(self, kind, game_view):
+                game = game_view._game_state
+                other = game._game_view(game._players[(game_view.seat + 1) % len(game._players)])
+                self_test.assertIs(other.get_board_view(), game_view.get_board_view())  # one snapshot per decision point
+                fresh = public_state(GameSnapshot(game, game._players, game._board))
+                self_test.assertEqual(public_state(game.snapshot()), fresh)  # never stale
+                log.append((kind, game.snapshot(), fresh))
+            def act(self, game_view):
+                self._record('act', game_view)
+                return super().act(game_view)
+            def bid(self, game_view, auction_view, player_view, is_mandated):
+                self._record('bid', game_view)
+                return super().bid(game_view, auction_view, player_view, is_mandated)
+            def steal(self, game_view):
+                self._record('steal', game_view)
+                return super().steal(game_view)
+        self_test = self
+        for i in range(5):
+            Game([Recording(n) for n in 'ABCD'], GameRandom(11, i)).play_game()
+        pairs = list(zip(log, log[1:]))
+        self.assertTrue(any(a[1] is b[1] for a, b in pairs))  # bids of one auction share the snapshot
+        self.assertTrue(all(a[2] == b[2] for a, b in pairs if a[1] is b[1]))
+        self.assertTrue(any(a[0] == 'steal' and a[2] != b[2] for a, b in pairs))
+        # Views taken before and after a draw see different states.
+        game = Game([Recording(n) for n in 'ABC'], GameRandom(12, 0))
+        before = game._game_view(game._players[0])
+        board_before, deck_before = before.get_board_view(), before.deck_size
+        game._execute_draw(game._players[0])
+        after = game._game_view(game._players[0])
+        self.assertIsNot(after.get_board_view(), board_before)
+        self.assertEqual(after.deck_size, deck_before - 1)
+        self.assertEqual(board_before.card_counts().total() + board_before.num_policemen + 1,
+                         after.get_board_view().card_counts().total() + after.get_board_view().num_policemen)
+        self.assertIs(before.get_board_view(), board_before)  # a view keeps the snapshot it first read
+        self.assertEqual((before.deck_size, before.get_deck_view().num_cards), (deck_before, deck_before))
+        self.assertTrue(after.get_active_player_view().is_same_player(before.get_active_player_view()))
+        unread = game._game_view(game._players[0])
+        game._execute_draw(game._players[1])
+        self.assertRaises(Exception, unread.get_board_view)
+
+    def test_clone_resumes_without_disturbing_the_game(self):
+        r = Razzia(4, ai='stealing', random_seed=2)
+        expected = [s.final_score() for s in r.play_game().values()]
+        fresh = Game(r._player_agents, GameRandom(2, 0))
+        self.assertEqual([s.final_score() for s in fresh.clone(rng=GameRandom(2, 0)).play_game().values()], expected)
+        clones = []
+        class CloningSink(events.Sink):
+            def handle(self, event):
+                if type(event) == events.RoundStartEvent and event.round == 2:
+                    clones.append(game.clone(redeterminize=True))
+                    clones[-1].play_game()  # the clone validates its card counts at game end
+        game = Game(r._player_agents, GameRandom(2, 0), tracer=events.Tracer([CloningSink()]))
+        self.assertEqual([s.final_score() for s in game.play_game().values()], expected)
+        self.assertEqual(len(clones), 1)
+        # Clones keep drawing agent randomness by agent name, as in duplicate deals.
+        seating = r._player_agents[1:] + r._player_agents[:1]
+        by_agent = [s.final_score() for s in Game(seating, GameRandom(2, 0), streams_by_agent=True).play_game().values()]
+        fresh = Game(seating, GameRandom(2, 0), streams_by_agent=True)
+        self.assertEqual([s.final_score() for s in fresh.clone(rng=GameRandom(2, 0)).play_game().values()], by_agent)
+
+    def test_search_agent_is_reproducible_and_pools_rollouts(self):
+        from agent import TrivialPlayerAgent
+        from search import SearchPlayerAgent
+        def play(searcher):
+            scorings = Game([searcher, TrivialPlayerAgent('B')], GameRandom(4, 0)).play_game()
+            return [s.final_score() for s in scorings.values()]
+        searcher = SearchPlayerAgent('A', max_rollouts=4)
+        self.assertEqual(play(searcher), play(SearchPlayerAgent('A', max_rollouts=4)))
+        self.assertGreater(searcher.rollouts_per_second, 0)
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            searcher = SearchPlayerAgent('A', max_rollouts=4, executor=executor, workers=2)
+            play(searcher)
+        self.assertGreater(searcher.num_rollouts, 0)
+
+    def test_benchmark_compare_flags_regressions_only(self):
+        import benchmark
+        baseline = {'games': {'trivial/4': {'games_per_sec': 400.0, 'us_per_turn': 20.0}}, 'micro': {'score_round': {'us_per_op': 10.0}}}
+        current = {'games': {'trivial/4': {'games_per_sec': 300.0, 'us_per_turn': 15.0}}, 'micro': {'score_round': {'us_per_op': 11.0}, 'new_path': {'us_per_op': 1.0}}}
+        regressions = benchmark.compare(baseline, current, threshold=0.2)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith('trivial/4 games_per_sec'))
+
+    def test_profiled_games_keep_scores_and_merge_counts(self):
+        r = Razzia(3, ai='stealing', random_seed=6)
+        expected = [s.final_score() for s in r.play_game().values()]
+        import profiling
+        profiler = profiling.PhaseProfiler()
+        game = Game(r._player_agents, GameRandom(6, 0), profiler=profiler)
+        self.assertEqual([s.final_score() for s in game.play_game().values()], expected)
+        self.assertEqual(profiler.calls['play_one_turn'], game.num_turns)
+        self.assertEqual(sum(profiler.calls['agent.act[{}]'.format(a)] for a in r._player_agents), game.num_turns)
+        profiled = Game(r._player_agents, GameRandom(6, 0), profiler=profiler)
+        self.assertRaises(Exception, profiled.decisions)
+        steps, answer = profiled.clone(rng=GameRandom(6, 0)).decisions(), None  # clones are not profiled
+        try:
+            while True:
+                request = steps.send(answer)
+                answer = getattr(request.agent, request.kind)(*request.args)
+        except StopIteration as stop:
+            self.assertEqual([s.final_score() for s in stop.value.values()], expected)
+        self.assertEqual(profiler.calls['play_one_turn'], game.num_turns)
+        abandoned = Game(r._player_agents, GameRandom(6, 0))
+        next(abandoned.decisions())  # the generator is dropped at its first request
+        self.assertEqual([s.final_score() for s in abandoned.play_game().values()], expected)
+        merged = r.profile(4, chunk_games=3)
+        self.assertEqual(merged.calls['score_round'], 4 * 3)
+
+    def test_latency_deadline_falls_back_and_dumps_histograms(self):
+        import json, time
+        import latency
+        from agent import TrivialPlayerAgent
+        class SlowAgent(TrivialPlayerAgent):
+            def act(self, game_view):
+                time.sleep(0.02)
+                return super().act(game_view)
+        slow = latency.LatencyTrackingAgent(SlowAgent('Slow'), deadline=0.002)
+        timed = latency.LatencyTrackingAgent(TrivialPlayerAgent('Timed'))
+        Game([slow, timed], GameRandom(1, 0)).play_game()
+        self.assertEqual(slow.overruns['act'], slow.histograms['act'].count)
+        self.assertLess(slow.histograms['act'].max, 20000)
+        self.assertEqual(timed.overruns['bid'], 0)
+        self.assertLessEqual(timed.histograms['bid'].percentile(50), timed.histograms['bid'].percentile(99))
+        with tempfile.TemporaryDirectory() as path:
+            latency.dump_histograms([slow, timed], path + '/latency.json')
+            with open(path + '/latency.json') as f:
+                dumped = json.load(f)
+        restored = latency.LatencyHistogram.from_dict(dumped['Timed']['bid'])
+        self.assertEqual(restored.percentile(99), timed.histograms['bid'].percentile(99))
+
+    def test_latency_deadline_keeps_abandoned_calls_off_the_game(self):
+        import threading, time
+        import latency
+        from agent import TrivialPlayerAgent, StealingPlayerAgent
+        class SlowBidder(TrivialPlayerAgent):
+            def bid(self, game_view, auction_view, player_view, is_mandated):
+                time.sleep(0.01)
+                [game_view.random.random() for _ in range(100)]  # after the deadline, on its own fork
+                game_view.get_all_player_views()
+                return super().bid(game_view, auction_view, player_view, is_mandated)
+        expected = [s.final_score() for s in Game([TrivialPlayerAgent('A'), StealingPlayerAgent('B')], GameRandom(3, 0)).play_game().values()]
+        threads = threading.active_count()
+        slow = latency.LatencyTrackingAgent(SlowBidder('A'), deadline=0.001, max_abandoned=2)
+        timed = latency.LatencyTrackingAgent(StealingPlayerAgent('B'), deadline=10.0)
+        scores = [s.final_score() for s in Game([slow, timed], GameRandom(3, 0)).play_game().values()]
+        self.assertEqual(scores, expected)  # fallbacks decide on the live streams; timed calls hand theirs back
+        self.assertGreater(slow.overruns['bid'], 0)
+        self.assertEqual(timed.overruns['act'] + timed.overruns['bid'], 0)
+        self.assertLessEqual(threading.active_count() - threads, 2 + 2)  # abandoned calls, plus the live worker of each agent
+
+    def test_tournament_rotates_seats_and_reuses_cached_seatings(self):
+        import os
+        from tournament import Tournament, agent_config
+        configs = [agent_config('A', 'trivial'), agent_config('B', 'stealing'), agent_config('C', 'trivial')]
+        with tempfile.TemporaryDirectory() as path:
+            first = Tournament(configs, 2, 3, seed=4, cache_path=path)
+            result = first.run()
+            self.assertEqual(first.games_played, 6 * 3)
+            self.assertEqual([os.path.splitext(f)[1] for f in os.listdir(path)], 6 * ['.json'])  # no temporary files left
+            self.assertEqual(result.by_agent['A'].win.n, 4 * 3)
+            self.assertEqual(result.by_seat[('B', 1)].score.n, 2 * 3)
+            self.assertAlmostEqual(sum(o.win.mean * o.win.n for o in result.by_agent.values()), 6 * 3)
+            again = Tournament(configs, 2, 3, seed=4, cache_path=path)
+            self.assertEqual(again.run().report(), result.report())
+            self.assertEqual(again.games_played, 0)
+            changed = Tournament(configs[:2] + [agent_config('C', 'stealing')], 2, 3, seed=4, cache_path=path)
+            changed.run()
+            self.assertEqual(changed.games_played, 4 * 3)
+
+    def test_duplicate_deals_cancel_luck_between_identical_candidates(self):
+        from duplicate import DealBank, DuplicateMatch
+        from tournament import agent_config
+        with tempfile.TemporaryDirectory() as path:
+            bank = DealBank.generate(path + '/deals.bin', 6, seed=3)
+            self.assertEqual(bank.deck(2).order(), DealBank(path + '/deals.bin').deck(2).order())
+            candidates = [agent_config('A', 'trivial'), agent_config('B', 'stealing'), agent_config('A2', 'trivial')]
+            match = DuplicateMatch(candidates, [agent_config('F', 'trivial'), agent_config('G', 'stealing')], bank, chunk_deals=4)
+            result = match.run()
+            self.assertEqual(len(match.run(num_deals=1).deal_means), 1)
+            for num_deals in (0, 7):
+                self.assertRaises(Exception, match.run, num_deals)
+            bank.close()
+        self.assertEqual(len(result.deal_means), 6)
+        identical = result.paired_difference('A', 'A2')
+        self.assertEqual((identical.mean, identical.stdev), (0, 0))
+        self.assertAlmostEqual(result.paired_difference('A', 'B').mean, -result.paired_difference('B', 'A').mean)
+
+    def test_statistics_stop_once_targets_are_met(self):
+        razzia = Razzia(3, ai='trivial', random_seed=5)
+        loose, tight = analytics.CardValueTarget(1.0), analytics.CardValueTarget(0.001)
+        stats = razzia.collect_statistics_until([loose], max_games=1000, chunk_games=20)
+        self.assertTrue(loose.is_met(stats))
+        self.assertLess(stats.num_games, 1000)
+        self.assertEqual(stats.num_games % 20, 0)
+        capped = razzia.collect_statistics_until([tight], max_games=50, chunk_games=20)
+        self.assertFalse(tight.is_met(capped))
+        self.assertEqual(capped.num_games, 50)
+        # Batches continue the seeded game sequence, so the capped run matches a plain one.
+        plain = razzia.collect_statistics(50)
+        self.assertEqual(capped.player_order._wins, plain.player_order._wins)
+        self.assertEqual(capped.cheque_value._cards, plain.cheque_value._cards)
+
+    def test_deck_view_odds_match_dealt_decks(self):
+        game = Game(Razzia(4)._player_agents, GameRandom(3, 0))
+        deck_view = game._game_view(game._players[0]).get_deck_view()
+        self.assertAlmostEqual(deck_view.policeman_probability(), 21 / 120)
+        self.assertEqual(deck_view.round_end_probability(6), 0.0)
+        self.assertAlmostEqual(deck_view.round_end_probability(120), 1.0)
+        expected, mix = deck_view.expected_booty()
+        self.assertAlmostEqual(sum(mix.values()), expected)
+        drawn = []
+        for i in range(4000):
+            cards = Deck(GameRandom(i).deal).order()
+            drawn.append(min(cards.index(Card.Policeman), 7))
+        self.assertAlmostEqual(statistics.mean(drawn), expected, delta=0.1)
+        game._execute_draw(game._players[0])
+        self.assertEqual(game._game_view(game._players[1]).get_deck_view().num_cards, 119)
+
+    def test_endgame_solver_matches_exhaustive_expectimax(self):
+        from agent import TrivialPlayerAgent
+        from control import ActionType
+        import endgame
+        deck = Deck(None, [Card.Ring, Card.Thief, Card.Policeman, Card.Policeman])
+        game = Game([TrivialPlayerAgent(n) for n in 'ABC'], GameRandom(9, 0), deck=deck)
+        game._round = 3
+        for _ in range(5):
+            game._board.add_policeman()
+        for p in game._players:
+            p._available_mask &= p.highest_cheque.bit
+        game._start_round()
+        view = game._game_view(game._turn_player)
+        solver = endgame.EndgameSolver()
+        value, decision = solver.solve(view)
+        def exhaustive(game, pending):
+            # Expectimax without pruning or transposition table.
+            if not isinstance(pending, endgame._Pending):
+                return pending
+            values = []
+            for forced in solver._candidates(game, pending):
+                draws = [c for c in Card if game._deck._counts[c]] if forced[0] == ActionType.Draw else [None]
+                value = 0
+                for card in draws:
+                    child = solver._clone(game)
+                    if card:
+                        cards = child._deck._cards
+                        cards.append(cards.pop(len(cards) - 1 - cards[::-1].index(card)))
+                    p = game._deck._counts[card] / game.deck_size if card else 1
+                    value += p * exhaustive(child, solver._advance(child, pending.seat, forced))
+                values.append(value)
+            return max(values) if pending.seat == view.seat else min(values)
+        root = view.sample_game(solver._steppers, solver._rng)
+        root._score_round = endgame._round_over
+        self.assertAlmostEqual(value, exhaustive(root, solver._advance(root, view.seat, [])))
+        self.assertIn(decision, solver._candidates(root, solver._advance(root, view.seat, [])))
+        self.assertIsNone(endgame.EndgameSolver(max_nodes=10).solve(view))
+
+    def test_batched_games_match_sequential_games(self):
+        from agent import StealingPlayerAgent
+        from scheduler import BatchScheduler
+        class BatchCountingAgent(StealingPlayerAgent):
+            batch_sizes = []
+            def act_batch(self, game_views):
+                self.batch_sizes.append(len(game_views))
+                return super().act_batch(game_views)
+        agents = [BatchCountingAgent(n) for n in 'ABC']
+        r = Razzia(3, ai='stealing', random_seed=8)
+        expected = [[s.final_score() for s in scores.values()] for scores in r.play_games(20)]
+        batched = BatchScheduler([Game(agents, GameRandom(8, i)) for i in range(20)]).run()
+        self.assertEqual([[s.final_score() for s in scores.values()] for scores in batched], expected)
+        self.assertEqual(max(BatchCountingAgent.batch_sizes), 20)
+        self.assertEqual([[s.final_score() for s in scores.values()] for scores in r.play_games(20, batched=True)], expected)
+
+    def test_table_server_plays_remote_and_timed_out_seats(self):
+        import asyncio
+        from agent import StealingPlayerAgent
+        import server
+        async def play():
+            agent_server = await server.serve_agent(StealingPlayerAgent('Remote'), port=0, seed=1)
+            pool = server.AgentPool('localhost', agent_server.sockets[0].getsockname()[1], size=2)
+            slow = server.StandInPool(StealingPlayerAgent('Slow'), delay=0.05)
+            pools = [pool, server.StandInPool(StealingPlayerAgent('Stand-in'), seed=2), slow]
+            table_server = server.TableServer(pools, timeout=0.01)
+            scorings = await table_server.run(5, seed=3, concurrency=5)
+            pool.close()
+            agent_server.close()
+            await agent_server.wait_closed()
+            return table_server, scorings
+        table_server, scorings = asyncio.run(play())
+        self.assertEqual([len(s) for s in scorings], 5 * [3])
+        self.assertGreater(table_server.num_decisions, 0)
+        self.assertGreater(table_server.num_timeouts, 0)
+        # Requests carry the public state of the view.
+        game = Game(Razzia(3)._player_agents, GameRandom(3, 0))
+        for _ in range(5):
+            game._execute_draw(game._players[0])
+        view = game._game_view(game._players[1])
+        _, kind, (remote,) = server.decode_request(server.encode_request(7, 'act', (view,)), None)
+        self.assertEqual([p.card_counts() for p in remote.get_all_player_views()], [p.card_counts() for p in view.get_all_player_views()])
+        self.assertEqual(remote.get_board_view().card_counts(), view.get_board_view().card_counts())
+        self.assertEqual(remote.get_deck_view().policeman_probability(), view.get_deck_view().policeman_probability())
+
+    def test_table_server_falls_back_on_failing_agents_but_not_on_queued_requests(self):
+        import asyncio, logging, time
+        from agent import StealingPlayerAgent, TrivialPlayerAgent
+        from control import ActionType
+        from pieces import Cheque
+        import server
+        class CrashingAgent(TrivialPlayerAgent):
+            def act(self, game_view):
+                raise Exception('Crashed.')
+        class IllegalBidder(TrivialPlayerAgent):
+            def bid(self, game_view, auction_view, player_view, is_mandated):
+                return Cheque.Fifteen if Cheque.Fifteen.bit & ~player_view.cheque_mask else None
+        class SlowAgent(TrivialPlayerAgent):
+            def act(self, game_view):
+                time.sleep(0.01)
+                return super().act(game_view)
+        async def play():
+            crashing = await server.serve_agent(CrashingAgent('Crashing'), port=0)
+            dead = await server.serve_agent(TrivialPlayerAgent('Dead'), port=0)
+            dead_port = dead.sockets[0].getsockname()[1]
+            dead.close()
+            await dead.wait_closed()
+            pools = [server.AgentPool('localhost', crashing.sockets[0].getsockname()[1]), server.StandInPool(IllegalBidder('Illegal')),
+                     server.AgentPool('localhost', dead_port), server.StandInPool(StealingPlayerAgent('Stealing'))]
+            table_server = server.TableServer(pools)
+            scorings = await table_server.run(3, seed=3)
+            # Ten requests queue for one connection to an agent that takes 10 ms each: only the exchange is timed.
+            slow = await server.serve_agent(SlowAgent('Slow'), port=0)
+            pool = server.AgentPool('localhost', slow.sockets[0].getsockname()[1], size=1)
+            game = Game(4 * [TrivialPlayerAgent('A')], GameRandom(3, 0))
+            payload = server.encode_request(1, 'act', (game._game_view(game._players[0]),))
+            responses = await asyncio.gather(*(pool.request(payload, timeout=0.05) for _ in range(10)))
+            for s, p in ((crashing, pools[0]), (slow, pool)):
+                p.close()
+                s.close()
+                await s.wait_closed()
+            return table_server, scorings, responses
+        logging.disable(logging.ERROR)
+        try:
+            table_server, scorings, responses = asyncio.run(play())
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual([len(s) for s in scorings], 3 * [4])
+        self.assertGreater(table_server.num_failures, 0)
+        self.assertGreater(table_server.num_illegal, 0)
+        self.assertGreater(table_server.num_decisions, 0)
+        self.assertEqual(server.decode_decision('act', responses[-1][4:]), ActionType.Draw)
+
+    def test_parameter_sweep_reuses_cached_blocks(self):
+        import os
+        from agent import TrivialPlayerAgent
+        import sweep
+        from tournament import agent_config
+        field = [agent_config('Field 1', 'trivial'), agent_config('Field 2', 'stealing')]
+        param_sets = sweep.grid(valuable_threshold=[2.0, 4.0, 6.0, 8.0])
+        with tempfile.TemporaryDirectory() as path:
+            first = sweep.Sweep('stealing', field, seed=5, block_games=5, cache_path=path)
+            halving = first.successive_halving(param_sets, 5, max_games=20)
+            self.assertEqual(sorted(m.n for m in halving.margins.values()), [5, 5, 10, 20])
+            second = sweep.Sweep('stealing', field, seed=5, block_games=5, cache_path=path)
+            grid = second.evaluate(param_sets, 5)
+            self.assertEqual(second.games_played, 0)
+            self.assertTrue(all(f.endswith('.json') for f in os.listdir(path)))  # blocks are moved into place whole
+            extended = second.evaluate([halving.best()], 25)
+            self.assertEqual(second.games_played, 5 * 3)
+        # Default parameters play like the default agent.
+        default = sweep.grid(valuable_threshold=[4.0], bid_probs=[TrivialPlayerAgent.BID_PROBS])[0]
+        tuned = sweep.Sweep('stealing', field, seed=5, block_games=5).evaluate([default], 5)
+        margins = sweep._play_block(agent_config(sweep.CANDIDATE_STREAM, 'stealing'), field, 5, 0, 5)
+        self.assertEqual(list(tuned.margins.values())[0].mean, sum(margins) / 5)
+        uncached = sweep.Sweep('stealing', field, seed=5, block_games=5).evaluate(param_sets, 5)
+        self.assertEqual({p: m.mean for p, m in grid.margins.items()}, {p: m.mean for p, m in uncached.margins.items()})
+        self.assertEqual(extended.margins[tuple(sorted(halving.best().items()))].n, 25)
+
+    def test_resumed_statistics_run_reports_like_an_uninterrupted_run(self):
+        import checkpoint
+        import os
+        expected = Razzia(3, ai='stealing', random_seed=8).collect_statistics(70, chunk_games=10).report()
+        save = checkpoint.save
+        def save_and_stop(path, state):
+            save(path, state)
+            raise KeyboardInterrupt()
+        with tempfile.TemporaryDirectory() as path:
+            path = os.path.join(path, 'run.checkpoint')
+            r = Razzia(3, ai='stealing', random_seed=8)
+            checkpoint.save = save_and_stop
+            try:
+                with self.assertRaises(KeyboardInterrupt):
+                    r.collect_statistics(70, chunk_games=10, checkpoint_path=path, checkpoint_games=25)
+            finally:
+                checkpoint.save = save
+            self.assertEqual(checkpoint.load(path).next_game_idx, 20)
+            with self.assertRaises(Exception):
+                r.collect_statistics(70, chunk_games=10, checkpoint_path=path)  # no silent restart
+            with self.assertRaises(Exception):
+                r.collect_statistics(80, chunk_games=10, checkpoint_path=path, resume=True)
+            resumed = Razzia(3, ai='stealing', random_seed=8).collect_statistics(70, chunk_games=10, checkpoint_path=path, resume=True)
+            self.assertEqual(resumed.report(), expected)
+            self.assertEqual(os.listdir(os.path.dirname(path)), ['run.checkpoint'])
+
+    @unittest.skipIf(columnar.np is None, 'NumPy is not installed')
+    def test_result_store_queries_match_streamed_statistics(self):
+        r = Razzia(4, ai='trivial', random_seed=5)
+        stats = r.collect_statistics(20)
+        with tempfile.TemporaryDirectory() as path:
+            r.store_results(path, 20, chunk_games=6)
+            store = columnar.ResultStore(path)
+            self.assertEqual(store.num_games, 20)
+            for card in [Card.Ring, Card.Car, Card.Casino]:
+                mean, stdev, n = columnar.card_worth(store, card, round=2)
+                streamed = stats.card_value._round_points[2][card]
+                self.assertEqual(n, streamed.n)
+                self.assertAlmostEqual(mean, streamed.mean)
+                self.assertAlmostEqual(stdev, streamed.stdev)
+            self.assertEqual(columnar.analyze_player_order(store), stats.player_order.report().replace('Player A', 'Seat 1').replace('Player B', 'Seat 2').replace('Player C', 'Seat 3').replace('Player D', 'Seat 4'))
+            del store
+        # Far from zero, the spread survives as in RunningStats: sums of squares would cancel it.
+        values = 1e9 + columnar.np.arange(10.0)
+        streamed = analytics.RunningStats()
+        for v in values[::2]:
+            streamed.add(v)
+        mean, stdev, n = columnar._group_stats(columnar.np.arange(10) % 2, values, 2)
+        self.assertEqual((mean[0], n[0]), (streamed.mean, streamed.n))
+        self.assertAlmostEqual(stdev[0], streamed.stdev)
+
+    @unittest.skipIf(columnar.np is None, 'NumPy is not installed')
+    def test_result_store_survives_an_interrupted_writer(self):
+        import os
+        r = Razzia(3, ai='trivial', random_seed=6)
+        with tempfile.TemporaryDirectory() as path:
+            r.store_results(path, 10)
+            complete = columnar.analyze_card_value(columnar.ResultStore(path))
+            batches = list(r._map_chunks(razzia._play_chunk_columns, 10, 1, 4))
+        with tempfile.TemporaryDirectory() as path:
+            writer = columnar.ResultStoreWriter(path)
+            writer.write(batches[0])
+            writer.write(batches[1])
+            with open(os.path.join(path, 'cards.points.col'), 'ab') as f:
+                f.write(bytes(5))  # a batch cut short by the crash, never closed
+            store = columnar.ResultStore(path)
+            self.assertEqual(store.num_games, 8)
+            self.assertEqual(len(store.table('cards')['points']), batches[0].num_rows('cards') + batches[1].num_rows('cards'))
+            del store
+            with columnar.ResultStoreWriter(path) as resumed:
+                resumed.write(batches[2])
+            store = columnar.ResultStore(path)
+            self.assertEqual(store.num_games, 10)
+            self.assertEqual(columnar.analyze_card_value(store), complete)
+            del store
+
+    @unittest.skipIf(columnar.np is None, 'NumPy is not installed')
+    def test_lockstep_scores_follow_engine_distribution(self):
+        np = columnar.np
+        lockstep_scores = Razzia(4, ai='trivial', random_seed=1).lockstep_scores(20000)
+        multi_scorings = Razzia(4, ai='trivial', random_seed=2).play_games(500)
+        engine_scores = np.array([[[scores.final_score_by_type().get(c, 0) for c in Score] for scores in scorings.values()] for scorings in multi_scorings])
+        # Welch's two-sample z-statistic per seat and score category, and for the seat totals.
+        for a, b in [(lockstep_scores, engine_scores), (lockstep_scores.sum(axis=2), engine_scores.sum(axis=2))]:
+            z = (a.mean(axis=0) - b.mean(axis=0)) / np.sqrt(a.var(axis=0, ddof=1) / len(a) + b.var(axis=0, ddof=1) / len(b) + 1e-12)
+            self.assertLess(np.abs(z).max(), 4.0)
+        # Two-sample Kolmogorov-Smirnov statistic of the seat totals, at a significance level of 0.001.
+        for seat in range(4):
+            a, b = np.sort(lockstep_scores[:, seat].sum(axis=1)), np.sort(engine_scores[:, seat].sum(axis=1))
+            grid = np.union1d(a, b)
+            distance = np.abs(np.searchsorted(a, grid, side='right') / len(a) - np.searchsorted(b, grid, side='right') / len(b)).max()
+            self.assertLess(distance, 1.95 * np.sqrt((len(a) + len(b)) / (len(a) * len(b))))
 
 if __name__ == '__main__':
     unittest.main()
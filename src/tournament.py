@@ -0,0 +1,141 @@
+"""
+Round-robin tournaments between agent configurations.
+
+Every seating permutation of the configurations plays the same seeded deals, so seat and deal
+luck are balanced out. Results are reported per agent and per agent and seat, with 95% confidence
+intervals. Final scores of each seating can be cached on disk by configuration: a later tournament
+only plays the seatings whose configurations changed.
+"""
+
+from collections import namedtuple
+import concurrent.futures
+import hashlib
+import itertools
+import json
+import math
+import os
+
+from control import Game
+from randomness import GameRandom
+from analytics import RunningStats
+from razzia import AI_AGENTS
+
+
+Z_95 = 1.96
+
+AgentConfig = namedtuple('AgentConfig', 'name ai params')
+
+def agent_config(name, ai, **params):
+    return AgentConfig(name, ai, tuple(sorted(params.items())))
+
+def make_agent(config):
+    return AI_AGENTS[config.ai](config.name, **dict(config.params))
+
+
+class ResultCache:
+    """JSON results in files under "path", by JSON key; a None path caches nothing.
+
+    Files are written to a temporary file and moved into place, so a run killed while writing
+    leaves no truncated file behind.
+    """
+    def __init__(self, path):
+        self.path = path
+    def _file(self, key):
+        return os.path.join(self.path, hashlib.sha1(json.dumps(key).encode()).hexdigest() + '.json')
+    def load(self, key):
+        if self.path and os.path.exists(self._file(key)):
+            with open(self._file(key)) as f:
+                return json.load(f)
+        return None
+    def store(self, key, value):
+        if self.path:
+            os.makedirs(self.path, exist_ok=True)
+            path = self._file(key)
+            with open(path + '.tmp', 'w') as f:
+                json.dump(value, f)
+            os.replace(path + '.tmp', path)
+
+
+def map_on_workers(fn, args, workers):
+    """Results of "fn" over the argument lists "args", in order; on a process pool unless "workers" is 1."""
+    if workers == 1:
+        yield from map(fn, *args)
+        return
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(fn, *args)
+
+
+def _play_seating(seating, seed, num_games):
+    agents = [make_agent(c) for c in seating]
+    return [[s.final_score() for s in Game(agents, GameRandom(seed, i)).play_game().values()] for i in range(num_games)]
+
+
+class _Outcome:
+    """Win share, score and margin over the best opponent, accumulated over games."""
+    def __init__(self):
+        self.win = RunningStats()
+        self.score = RunningStats()
+        self.margin = RunningStats()
+    def add(self, seat, scores):
+        top = max(scores)
+        others = scores[:seat] + scores[seat + 1:]
+        self.win.add(1 / scores.count(top) if scores[seat] == top else 0)  # ties share the win
+        self.score.add(scores[seat])
+        self.margin.add(scores[seat] - max(others))
+
+
+def confidence_interval(stats):
+    """Mean and the half-width of its 95% confidence interval."""
+    half = Z_95 * stats.stdev / math.sqrt(stats.n) if stats.n > 1 else float('nan')
+    return stats.mean, half
+
+
+class TournamentResult:
+    def __init__(self):
+        self.by_agent = {}
+        self.by_seat = {}
+    def add_game(self, names, scores):
+        for seat, name in enumerate(names):
+            self.by_agent.setdefault(name, _Outcome()).add(seat, scores)
+            self.by_seat.setdefault((name, seat), _Outcome()).add(seat, scores)
+    def report(self):
+        s_template = '{:20s} win rate {:.3f} ± {:.3f}, score {:.2f} ± {:.2f}, margin {:+.2f} ± {:.2f} in {} games'
+        def line(label, o):
+            return s_template.format(label, *confidence_interval(o.win), *confidence_interval(o.score), *confidence_interval(o.margin), o.win.n)
+        lines = [line(name, o) for name, o in self.by_agent.items()]
+        lines.extend(line('{} (seat {})'.format(name, seat + 1), o) for (name, seat), o in sorted(self.by_seat.items()))
+        return '\n'.join(lines)
+
+
+class Tournament:
+    def __init__(self, configs, num_players, games_per_seating, seed=1, cache_path=None):
+        if len({c.name for c in configs}) != len(configs):
+            raise Exception('Agent configuration names must be unique.')
+        if not 2 <= num_players <= len(configs):
+            raise Exception('Cannot seat {} players from {} configurations.'.format(num_players, len(configs)))
+        self._configs = list(configs)
+        self._num_players = num_players
+        self._games_per_seating = games_per_seating
+        self._seed = seed
+        self._cache = ResultCache(cache_path)
+        self.games_played = 0
+    def seatings(self):
+        return list(itertools.permutations(self._configs, self._num_players))
+    def _cache_key(self, seating):
+        # Cache keys cover the configurations and the deals, not the agent code.
+        return [[c.name, c.ai, list(c.params)] for c in seating] + [self._seed, self._games_per_seating]
+    def run(self, workers=1):
+        seatings = self.seatings()
+        scores = {s: self._cache.load(self._cache_key(s)) for s in seatings}
+        pending = [s for s in seatings if scores[s] is None]
+        args = (pending, len(pending) * [self._seed], len(pending) * [self._games_per_seating])
+        for seating, seating_scores in zip(pending, map_on_workers(_play_seating, args, workers)):
+            self._cache.store(self._cache_key(seating), seating_scores)
+            scores[seating] = seating_scores
+            self.games_played += len(seating_scores)
+        result = TournamentResult()
+        for seating in seatings:
+            names = [c.name for c in seating]
+            for game_scores in scores[seating]:
+                result.add_game(names, game_scores)
+        return result